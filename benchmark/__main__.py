@@ -0,0 +1,158 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from const import DELIMITER, COMPOSITE_PERIODS
+from processor.custom.communicator import CustomProcessor
+from processor.drone.communicator import DroneProcessor
+from processor.landsat.communicator import LandsatProcessor
+from processor.meteor.communicator import MeteorProcessor
+from processor.performance import PERFORMANCE_PROFILES
+from processor.sentinel.communicator import SentinelProcessor
+from processor.storage import RESULT_STORES
+from .fixtures import SCALES, generate
+
+logger = logging.getLogger("benchmark")
+
+
+def processor_kwargs(fixtures, root):
+    match_fields = {int(key): value for key, value in fixtures["match_fields"].items()}
+    fields = sorted(set(match_fields.values()))
+    common = {"shape_path": fixtures["shape"], "match_fields": match_fields, "fields_whitelist": fields}
+    return {
+        "sentinel": (SentinelProcessor, dict(common, input_path=os.path.join(root, "sentinel"), expected_resolution=20,
+                                             source_resolution="R20m",
+                                             coefficients=["NDVI", "EVI", "B04", "B8A", "SCL"])),
+        "sentinel_coarse": (SentinelProcessor, dict(common, input_path=os.path.join(root, "sentinel"),
+                                                    expected_resolution=20, source_resolution="R10m",
+                                                    coefficients=["NDVI", "EVI", "B04", "B08"])),
+        "landsat": (LandsatProcessor, dict(common, input_path=os.path.join(root, "landsat"), expected_resolution=30,
+                                           coefficients=["BAND_4", "BAND_5", "NDVI", "EVI"])),
+        "meteor": (MeteorProcessor, dict(common, input_path=os.path.join(root, "meteor"), expected_resolution=60,
+                                         coefficients=["RED", "NIR", "NDVI"])),
+        "drone": (DroneProcessor, {"shape_path": fixtures["shape"], "input_path": os.path.join(root, "drone"),
+                                   "expected_resolution": 1, "shape_index": 0}),
+        "drone_mosaic": (DroneProcessor, {"shape_path": fixtures["shape"], "input_path": os.path.join(root, "drone"),
+                                          "expected_resolution": 1, "shape_index": 0, "mosaic": True}),
+        "custom": (CustomProcessor, dict(common, input_path=os.path.join(root, "meteor"), expected_resolution=60)),
+    }
+
+
+def run_processor(processor_type, kwargs, output_path, trace=False, performance_profile="default",
+                  result_backend="sqlite", memory_budget_mb=0, composite=None, chip_cache_mb=0, chip_cache_path=None):
+    shutil.rmtree(output_path, ignore_errors=True)
+    os.makedirs(output_path)
+
+    def callback(*args, callback_type):
+        pass
+
+    start = time.perf_counter()
+    proc = processor_type(output_path=output_path, callback=callback, profile=True, trace=trace,
+                          performance_profile=performance_profile, result_backend=result_backend,
+                          memory_budget_mb=memory_budget_mb, composite=composite, chip_cache_mb=chip_cache_mb,
+                          chip_cache_path=chip_cache_path, **kwargs)
+    proc.run()
+    elapsed = time.perf_counter() - start
+    with open(os.path.join(output_path, "run_report.json"), encoding="utf-8") as report_file:
+        report = json.load(report_file)
+    return {"elapsed": elapsed, "errors": proc.errors.total, "error_kinds": dict(proc.errors.kinds),
+            "stages": report["stages"], "counters": report["counters"], "peak_rss": report["peak_rss"],
+            "memory_budget": report["meta"].get("memory_budget")}
+
+
+def read_outputs(output_path):
+    outputs = {}
+    for path in glob.glob(os.path.join(output_path, "*", "*.csv")):
+        frame = pd.read_csv(path, delimiter=DELIMITER)
+        outputs[os.path.relpath(path, output_path)] = frame.sort_values(["x", "y"]).reset_index(drop=True)
+    return outputs
+
+
+def compare_outputs(output_path, reference_path, rtol=1e-5, atol=1e-6):
+    actual = read_outputs(output_path)
+    expected = read_outputs(reference_path)
+    mismatches = [f"missing {name}" for name in sorted(set(expected) - set(actual))]
+    mismatches.extend(f"unexpected {name}" for name in sorted(set(actual) - set(expected)))
+    for name in sorted(set(actual) & set(expected)):
+        left, right = actual[name], expected[name]
+        if list(left.columns) != list(right.columns) or len(left) != len(right):
+            mismatches.append(f"shape {name}")
+            continue
+        if not np.allclose(left.to_numpy(dtype="float64"), right.to_numpy(dtype="float64"),
+                           rtol=rtol, atol=atol, equal_nan=True):
+            mismatches.append(f"values {name}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark")
+    parser.add_argument("--data", default="bench_data", help="Folder for synthetic fixtures and outputs")
+    parser.add_argument("--scales", default="small", help="Comma separated: " + ",".join(SCALES))
+    parser.add_argument("--processors", default="sentinel,sentinel_coarse,landsat,meteor,drone,drone_mosaic,custom")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gtiff", action="store_true", help="Write Sentinel bands as GeoTIFF instead of JP2")
+    parser.add_argument("--reference", help="Folder with reference outputs to check equivalence against")
+    parser.add_argument("--update-reference", action="store_true")
+    parser.add_argument("--trace", action="store_true", help="Write Chrome trace files next to outputs")
+    parser.add_argument("--performance", default="default", choices=list(PERFORMANCE_PROFILES))
+    parser.add_argument("--backend", default="sqlite", choices=list(RESULT_STORES))
+    parser.add_argument("--memory-mb", type=int, default=0, help="Memory budget, 0 for half of physical memory")
+    parser.add_argument("--composite", choices=list(COMPOSITE_PERIODS), help="Also build period composites")
+    parser.add_argument("--chip-cache-mb", type=int, default=0,
+                        help="Size of the warped chip cache kept in <data>/<scale>/chips, 0 to disable")
+    parser.add_argument("--report", default="bench_results.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    results = []
+    failed = False
+    for scale_name in args.scales.split(","):
+        scale = SCALES[scale_name]
+        root = os.path.abspath(os.path.join(args.data, scale_name))
+        start = time.perf_counter()
+        fixtures = generate(root, scale, args.seed, not args.gtiff)
+        logger.info(f"Fixtures for {scale_name} ready in {time.perf_counter() - start:.1f}s")
+        processors = processor_kwargs(fixtures, root)
+        for name in args.processors.split(","):
+            processor_type, kwargs = processors[name]
+            output_path = os.path.join(root, "output", name)
+            for attempt in range(args.repeat):
+                result = run_processor(processor_type, kwargs, output_path, args.trace, args.performance,
+                                       args.backend, args.memory_mb, args.composite, args.chip_cache_mb,
+                                       os.path.join(root, "chips"))
+                result.update({"scale": scale_name, "processor": name, "attempt": attempt,
+                               "performance": args.performance, "backend": args.backend})
+                logger.info(f"{scale_name}/{name}#{attempt}: {result['elapsed']:.2f}s, "
+                            f"{result['counters'].get('pixels', 0)} pixels, {result['errors']} errors")
+                results.append(result)
+                if not result["counters"].get("pixels"):
+                    failed = True
+                    logger.error(f"{scale_name}/{name} extracted no pixels")
+            if args.reference:
+                reference_path = os.path.join(args.reference, scale_name, name)
+                if args.update_reference:
+                    shutil.rmtree(reference_path, ignore_errors=True)
+                    shutil.copytree(output_path, reference_path,
+                                    ignore=shutil.ignore_patterns("*.db", "*.duckdb", "*.json"))
+                else:
+                    mismatches = compare_outputs(output_path, reference_path)
+                    results[-1]["mismatches"] = mismatches
+                    if mismatches:
+                        failed = True
+                        logger.error(f"{scale_name}/{name} differs from reference: {', '.join(mismatches[:10])}")
+    with open(args.report, "w", encoding="utf-8") as report_file:
+        json.dump(results, report_file, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
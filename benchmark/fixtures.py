@@ -0,0 +1,204 @@
+import datetime
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import fiona
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import transform_geom
+
+FIXTURES_VERSION = 3
+SOURCE_CRS = "EPSG:32637"
+TARGET_CRS = "EPSG:4326"
+ORIGIN = (500000.0, 6200000.0)
+DATES = ["2023-05-04", "2023-05-19", "2023-06-03", "2023-06-18", "2023-07-03", "2023-07-18", "2023-08-02",
+         "2023-08-17"]
+SENTINEL_BANDS = {
+    "R10m": ["B02", "B03", "B04", "B08", "AOT", "WVP"],
+    "R20m": ["B02", "B03", "B04", "B05", "B06", "B07", "B8A", "B11", "B12", "AOT", "WVP", "SCL"],
+    "R60m": ["B01", "B02", "B03", "B04", "B05", "B06", "B07", "B8A", "B09", "B11", "B12", "AOT", "WVP", "SCL"],
+}
+LANDSAT_BANDS = {f"BAND_{i}": f"SR_B{i}" for i in range(1, 8)}
+LANDSAT_BANDS["QUALITY_L1_PIXEL"] = "QA_PIXEL"
+
+
+@dataclass
+class Scale:
+    name: str
+    extent: int
+    scenes: int
+    fields: int
+    field_size: int
+    drone_tiles: int
+
+
+SCALES = {
+    "small": Scale("small", 2560, 2, 20, 200, 2),
+    "medium": Scale("medium", 10240, 4, 200, 300, 4),
+    "large": Scale("large", 40960, 8, 2000, 400, 8),
+}
+
+
+def jp2_supported() -> bool:
+    with rasterio.Env() as env:
+        return "JP2OpenJPEG" in env.drivers()
+
+
+def _band(rng: np.random.Generator, height: int, width: int, low: int, high: int, dtype: str) -> np.ndarray:
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.sin(x / max(width, 1) * 6.0 + rng.uniform(0, 3)) + np.cos(y / max(height, 1) * 4.0 + rng.uniform(0, 3))
+    noise = rng.normal(0, 0.1, (height, width))
+    data = low + (high - low) * (base + noise + 2.2) / 4.4
+    return np.clip(data, low, high).astype(dtype)
+
+
+def write_raster(path: str, data: np.ndarray, resolution: float, crs: str = SOURCE_CRS,
+                 origin: Tuple[float, float] = ORIGIN, jp2: bool = False) -> None:
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    profile = {
+        "driver": "JP2OpenJPEG" if jp2 else "GTiff",
+        "dtype": data.dtype.name,
+        "count": data.shape[0],
+        "height": data.shape[1],
+        "width": data.shape[2],
+        "crs": crs,
+        "transform": from_origin(origin[0], origin[1], resolution, resolution),
+    }
+    if jp2:
+        profile.update({"QUALITY": 100, "REVERSIBLE": "YES"})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data)
+
+
+def write_fields(path: str, scale: Scale, seed: int = 0) -> Dict[int, str]:
+    rng = np.random.default_rng(seed)
+    margin = scale.field_size * 2
+    schema = {"geometry": "Polygon", "properties": {"id": "int"}}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with fiona.open(path, "w", driver="ESRI Shapefile", crs=TARGET_CRS, schema=schema) as shapefile:
+        for i in range(scale.fields):
+            left = ORIGIN[0] + (rng.uniform(margin, scale.extent - margin - scale.field_size) if i else margin)
+            top = ORIGIN[1] - (rng.uniform(margin, scale.extent - margin - scale.field_size) if i else margin)
+            size = scale.field_size * rng.uniform(0.5, 1.0)
+            ring = [(left, top), (left + size, top), (left + size, top - size), (left, top - size), (left, top)]
+            geometry = transform_geom(SOURCE_CRS, TARGET_CRS, {"type": "Polygon", "coordinates": [ring]})
+            shapefile.write({"geometry": geometry, "properties": {"id": i}})
+    return {i: f"field_{i}" for i in range(scale.fields)}
+
+
+def write_sentinel(root: str, scale: Scale, seed: int = 0, jp2: bool = True) -> List[str]:
+    rng = np.random.default_rng(seed)
+    jp2 = jp2 and jp2_supported()
+    products = []
+    for index in range(scale.scenes):
+        date = datetime.datetime.strptime(DATES[index % len(DATES)], "%Y-%m-%d")
+        stamp = date.strftime("%Y%m%dT083601")
+        tile = "T37UDB"
+        product = os.path.join(root, f"S2A_MSIL2A_{stamp}_N0509_R064_{tile}_{date:%Y%m%d}T121501.SAFE")
+        granule = os.path.join(product, "GRANULE", f"L2A_{tile}_A{41000 + index:06d}_{stamp}")
+        for resolution, bands in SENTINEL_BANDS.items():
+            pixel = int(resolution[1:-1])
+            size = scale.extent // pixel
+            for band in bands:
+                if band == "SCL":
+                    data = rng.choice(np.array([4, 5, 6, 8, 9], dtype="uint8"), (size, size), p=[.5, .2, .1, .1, .1])
+                else:
+                    data = _band(rng, size, size, 1000, 6000, "uint16")
+                write_raster(os.path.join(granule, "IMG_DATA", resolution, f"{tile}_{stamp}_{band}_{pixel}m.jp2"),
+                             data, pixel, jp2=jp2)
+        with open(os.path.join(granule, "MTD_TL.xml"), "w", encoding="utf-8") as metadata_file:
+            metadata_file.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+                                "<n1:Level-2A_Tile_ID xmlns:n1=\"https://psd-14.sentinel2.eo.esa.int\">"
+                                "<n1:Quality_Indicators_Info><Image_Content_QI>"
+                                f"<CLOUDY_PIXEL_PERCENTAGE>{rng.uniform(0, 100):.6f}</CLOUDY_PIXEL_PERCENTAGE>"
+                                "</Image_Content_QI></n1:Quality_Indicators_Info></n1:Level-2A_Tile_ID>\n")
+        products.append(product)
+    return products
+
+
+def write_landsat(root: str, scale: Scale, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    products = []
+    size = scale.extent // 30
+    for index in range(scale.scenes):
+        date = datetime.datetime.strptime(DATES[index % len(DATES)], "%Y-%m-%d")
+        name = f"LC08_L2SP_178021_{date:%Y%m%d}_{date + datetime.timedelta(days=6):%Y%m%d}_02_T1"
+        product = os.path.join(root, name)
+        contents = {}
+        for key, suffix in LANDSAT_BANDS.items():
+            filename = f"{name}_{suffix}.TIF"
+            if key == "QUALITY_L1_PIXEL":
+                data = rng.choice(np.array([21824, 21824, 22280, 23888], dtype="uint16"), (size, size))
+            else:
+                data = _band(rng, size, size, 7500, 20000, "uint16")
+            write_raster(os.path.join(product, filename), data, 30)
+            contents[f"FILE_NAME_{key}"] = filename
+        metadata = {"LANDSAT_METADATA_FILE": {
+            "PRODUCT_CONTENTS": contents,
+            "IMAGE_ATTRIBUTES": {"DATE_ACQUIRED": date.strftime("%Y-%m-%d"),
+                                 "CLOUD_COVER_LAND": f"{rng.uniform(0, 100):.2f}"},
+        }}
+        with open(os.path.join(product, f"{name}_MTL.json"), "w") as metadata_file:
+            json.dump(metadata, metadata_file, indent=2)
+        products.append(product)
+    return products
+
+
+def write_meteor(root: str, scale: Scale, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    files = []
+    size = scale.extent // 60
+    for index in range(scale.scenes):
+        date = datetime.datetime.strptime(DATES[index % len(DATES)], "%Y-%m-%d")
+        directory = os.path.join(root, f"meteor_m2_{index}")
+        for channel in ("red", "nir"):
+            path = os.path.join(directory, f"m2_{date:%Y}{date.timetuple().tm_yday:03d}_{channel}.tif")
+            write_raster(path, _band(rng, size, size, 0, 1, "float32"), 60)
+            files.append(path)
+    return files
+
+
+def write_drone(root: str, scale: Scale, seed: int = 0, resolution: float = 1.0) -> List[str]:
+    rng = np.random.default_rng(seed)
+    files = []
+    tile = int(scale.extent / scale.drone_tiles / resolution)
+    overlap = tile // 10
+    for index in range(scale.drone_tiles):
+        origin = (ORIGIN[0] + index * (tile - overlap) * resolution, ORIGIN[1])
+        data = _band(rng, tile, tile, 0, 255, "uint8")
+        path = os.path.join(root, f"flight_{index:03d}.tif")
+        write_raster(path, data, resolution, origin=origin)
+        files.append(path)
+    with open(os.path.join(root, "flight.log"), "w") as log_file:
+        log_file.write("synthetic flight\n")
+    return files
+
+
+def generate(root: str, scale: Scale, seed: int = 0, jp2: bool = True) -> Dict[str, object]:
+    marker = os.path.join(root, "fixtures.json")
+    options = {"version": FIXTURES_VERSION, "scale": scale.name, "seed": seed, "jp2": jp2 and jp2_supported()}
+    if os.path.isfile(marker):
+        with open(marker) as marker_file:
+            fixtures = json.load(marker_file)
+        if fixtures.get("options") == options:
+            return fixtures
+        for name in ("shape", "sentinel", "landsat", "meteor", "drone"):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    fixtures = {
+        "options": options,
+        "match_fields": write_fields(os.path.join(root, "shape", "fields.shp"), scale, seed),
+        "shape": os.path.join(root, "shape", "fields.shp"),
+        "sentinel": write_sentinel(os.path.join(root, "sentinel"), scale, seed, jp2),
+        "landsat": write_landsat(os.path.join(root, "landsat"), scale, seed),
+        "meteor": write_meteor(os.path.join(root, "meteor"), scale, seed),
+        "drone": write_drone(os.path.join(root, "drone"), scale, seed),
+    }
+    with open(marker, "w") as marker_file:
+        json.dump(fixtures, marker_file, indent=2)
+    return fixtures
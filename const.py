@@ -1 +1,30 @@
+import os
+
 DELIMITER = ';'
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".geodatapreparing")
+CLOUD_FILTER_RESOLUTION = 300
+PROGRESS_INTERVAL = 0.5
+PROGRESS_LOG_INTERVAL = 10
+PROGRESS_WINDOW = 30
+PIPELINE_DEPTH = 1
+DB_QUEUE_SIZE = 64
+DB_BATCH_ROWS = 200000
+DB_WRITERS = 4
+DB_OPEN_PARTITIONS = 8
+MOSAIC_TILE_SIZE = 2048
+OVERLAP_RULES = {"coverage": "Лучшее покрытие", "cloud": "Наименьшая облачность", "all": "Обрабатывать все снимки"}
+OVERLAP_MARGIN_PIXELS = 2
+MEMORY_BUDGET_FRACTION = 0.5
+MEMORY_MIN_BLOCK = 16 * 1024 * 1024
+EXPORT_ROW_BYTES = 256
+PROFILER_SAMPLE_INTERVAL = 0.05
+JOB_MAX_CONCURRENT = 2
+JOB_MEMORY_MB = 4096
+JOB_STATES = {"queued": "В очереди", "running": "Выполняется", "finished": "Завершена", "failed": "Ошибка",
+              "cancelled": "Отменена"}
+WORKER_START_METHOD = "spawn"
+WORKER_POLL_INTERVAL = 0.2
+COMPOSITE_PERIODS = {"month": "Месяц", "dekad": "Декада"}
+COMPOSITE_MEDIAN_SAMPLES = 15
+CHIP_CACHE_MB = 10240
+ERROR_TRACEBACK_SAMPLES = 3
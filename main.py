@@ -1,8 +1,9 @@
 import logging
+import multiprocessing
 import sys
 from PyQt5.QtWidgets import QApplication, QMainWindow
 
-from processor.window import SentinelTab, LandsatTab, MeteorTab, DroneTab, CustomTab
+from processor.window import SentinelTab, LandsatTab, MeteorTab, DroneTab, CustomTab, JobsTab
 from widgets import ForkWindow
 
 
@@ -42,10 +43,12 @@ class MainWindow(QMainWindow):
         self.fork_widget.add_tab("Meteor", MeteorTab(self))
         self.fork_widget.add_tab("Drone", DroneTab(self))
         self.fork_widget.add_tab("Custom", CustomTab(self))
+        self.fork_widget.add_tab("Очередь", JobsTab(self))
         self.setCentralWidget(self.fork_widget)
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     setup_logging()
     app = QApplication(sys.argv)
     window = MainWindow()
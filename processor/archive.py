@@ -0,0 +1,102 @@
+import functools
+import io
+import os
+import tarfile
+import zipfile
+from typing import Dict, IO, Optional, Tuple
+
+ARCHIVE_PREFIXES = {".zip": "/vsizip/", ".tar": "/vsitar/"}
+
+
+def is_archive(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in ARCHIVE_PREFIXES and os.path.isfile(path)
+
+
+def archive_path(archive: str, inner: str = "") -> str:
+    path = ARCHIVE_PREFIXES[os.path.splitext(archive)[1].lower()] + archive.replace("\\", "/")
+    if inner:
+        path += "/" + inner.strip("/")
+    return path
+
+
+def split_archive_path(path: str) -> Tuple[Optional[str], str]:
+    for prefix in ARCHIVE_PREFIXES.values():
+        if path.startswith(prefix):
+            rest = path[len(prefix):]
+            for extension in ARCHIVE_PREFIXES:
+                index = rest.lower().find(extension + "/")
+                if index >= 0:
+                    return rest[:index + len(extension)], rest[index + len(extension) + 1:]
+                if rest.lower().endswith(extension):
+                    return rest, ""
+    return None, path
+
+
+def join(path: str, *parts: str) -> str:
+    if split_archive_path(path)[0] is not None:
+        return "/".join([path.rstrip("/"), *parts])
+    return os.path.join(path, *parts)
+
+
+def physical_path(path: str) -> str:
+    archive, _ = split_archive_path(path)
+    return archive or path
+
+
+def _member_name(name: str) -> str:
+    return name[2:] if name.startswith("./") else name
+
+
+@functools.lru_cache(maxsize=64)
+def _members(archive: str, mtime: float) -> Dict[str, int]:
+    if archive.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as zip_file:
+            return {info.filename.rstrip("/"): info.compress_size for info in zip_file.infolist()}
+    with tarfile.open(archive) as tar_file:
+        return {_member_name(member.name): member.size for member in tar_file.getmembers()}
+
+
+def members(archive: str) -> Dict[str, int]:
+    return _members(archive, os.stat(archive).st_mtime)
+
+
+def list_dir(path: str) -> Dict[str, bool]:
+    archive, inner = split_archive_path(path)
+    if archive is None:
+        return {entry.name: entry.is_dir() for entry in os.scandir(path)}
+    prefix = inner.strip("/") + "/" if inner.strip("/") else ""
+    entries = {}
+    for name in members(archive):
+        if not name.startswith(prefix) or name == prefix.rstrip("/"):
+            continue
+        head, _, tail = name[len(prefix):].partition("/")
+        entries[head] = entries.get(head, False) or bool(tail)
+    return entries
+
+
+def is_file(path: str) -> bool:
+    archive, inner = split_archive_path(path)
+    if archive is None:
+        return os.path.isfile(path)
+    return inner in members(archive)
+
+
+def open_file(path: str) -> IO[bytes]:
+    archive, inner = split_archive_path(path)
+    if archive is None:
+        return open(path, "rb")
+    if archive.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive) as zip_file:
+            return io.BytesIO(zip_file.read(inner))
+    with tarfile.open(archive) as tar_file:
+        for member in tar_file.getmembers():
+            if _member_name(member.name) == inner:
+                return io.BytesIO(tar_file.extractfile(member).read())
+    raise FileNotFoundError(path)
+
+
+def file_size(path: str) -> int:
+    archive, inner = split_archive_path(path)
+    if archive is None:
+        return os.path.getsize(path)
+    return members(archive).get(inner, 0)
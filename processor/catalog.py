@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import sqlite3
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+NATIVE_BOUNDS_COLUMNS = ("native_west", "native_south", "native_east", "native_north")
+
+
+class CatalogScene(NamedTuple):
+    path: str
+    name: str
+    date: str
+    tile: str
+    crs: Optional[str]
+    bounds: Optional[Tuple[float, float, float, float]]
+    bands: Dict[Tuple[str, str], str]
+    metadata: dict
+    native_bounds: Optional[Tuple[float, float, float, float]] = None
+
+
+class ArchiveCatalog:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # the catalog is shared by jobs running in parallel processes
+        self.conn = sqlite3.connect(path, timeout=60)
+        cur = self.conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL").fetchone()
+        cur.execute("CREATE TABLE IF NOT EXISTS scenes ("
+                    "path TEXT PRIMARY KEY, "
+                    "root TEXT, "
+                    "kind VARCHAR(16), "
+                    "name TEXT, "
+                    "mtime REAL, "
+                    "date VARCHAR(16), "
+                    "tile VARCHAR(16), "
+                    "crs TEXT, "
+                    "west REAL, "
+                    "south REAL, "
+                    "east REAL, "
+                    "north REAL, "
+                    "metadata TEXT, "
+                    "native_west REAL, "
+                    "native_south REAL, "
+                    "native_east REAL, "
+                    "native_north REAL"
+                    ")")
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(scenes)")}
+        if not set(NATIVE_BOUNDS_COLUMNS) <= columns:
+            for column in NATIVE_BOUNDS_COLUMNS:
+                cur.execute(f"ALTER TABLE scenes ADD COLUMN {column} REAL")
+            cur.execute("UPDATE scenes SET mtime = NULL")  # describe every scene again to fill the new columns
+        cur.execute("CREATE TABLE IF NOT EXISTS bands ("
+                    "scene TEXT, "
+                    "band VARCHAR(64), "
+                    "resolution VARCHAR(16), "
+                    "path TEXT, "
+                    "PRIMARY KEY(scene, band, resolution)"
+                    ")")
+        cur.execute("CREATE INDEX IF NOT EXISTS scenes_root_kind_date ON scenes (root, kind, date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS scenes_root_kind_tile ON scenes (root, kind, tile)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def refresh(self, root: str, kind: str, discover: Callable[[str], List[str]], signature: Callable[[str], float],
+                describe: Callable[[str], Optional[CatalogScene]]) -> None:
+        root = os.path.abspath(root)
+        cur = self.conn.cursor()
+        cur.execute("SELECT path, mtime FROM scenes WHERE root = ? AND kind = ?", (root, kind))
+        known = dict(cur.fetchall())
+        found = set()
+        updated = 0
+        for path in discover(root):
+            found.add(path)
+            try:
+                mtime = signature(path)
+                if known.get(path) == mtime:
+                    continue
+                scene = describe(path)
+            except Exception:
+                logger.exception(f"Catalog exception in {path}")
+                continue
+            self._store(cur, root, kind, path, mtime, scene)
+            self.conn.commit()  # do not hold the write lock while the next scene is described
+            updated += 1
+        removed = [(path,) for path in known if path not in found]
+        cur.executemany("DELETE FROM scenes WHERE path = ?", removed)
+        cur.executemany("DELETE FROM bands WHERE scene = ?", removed)
+        self.conn.commit()
+        logger.info(f"Catalog {root} ({kind}): {len(found)} scenes, {updated} updated, {len(removed)} removed")
+
+    @staticmethod
+    def _store(cur: sqlite3.Cursor, root: str, kind: str, path: str, mtime: float,
+               scene: Optional[CatalogScene]) -> None:
+        cur.execute("DELETE FROM bands WHERE scene = ?", (path,))
+        if scene is None:
+            cur.execute("INSERT OR REPLACE INTO scenes (path, root, kind, name, mtime) VALUES (?, ?, ?, ?, ?)",
+                        (path, root, kind, os.path.basename(path), mtime))
+            return
+        west, south, east, north = scene.bounds or (None, None, None, None)
+        cur.execute("INSERT OR REPLACE INTO scenes "
+                    "(path, root, kind, name, mtime, date, tile, crs, west, south, east, north, metadata, "
+                    "native_west, native_south, native_east, native_north) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, root, kind, scene.name, mtime, scene.date, scene.tile, scene.crs,
+                     west, south, east, north, json.dumps(scene.metadata),
+                     *(scene.native_bounds or (None, None, None, None))))
+        cur.executemany("INSERT OR REPLACE INTO bands (scene, band, resolution, path) VALUES (?, ?, ?, ?)",
+                        [(path, band, resolution, band_path) for (band, resolution), band_path in scene.bands.items()])
+
+    def scenes(self, root: str, kind: str, date_from: Optional[str] = None, date_to: Optional[str] = None,
+               tiles: Optional[Sequence[str]] = None,
+               bounds: Optional[Tuple[float, float, float, float]] = None) -> List[CatalogScene]:
+        query = ("SELECT path, name, date, tile, crs, west, south, east, north, metadata, "
+                 "native_west, native_south, native_east, native_north FROM scenes "
+                 "WHERE root = ? AND kind = ? AND date IS NOT NULL")
+        params = [os.path.abspath(root), kind]
+        if date_from:
+            query += " AND date >= ?"
+            params.append(date_from)
+        if date_to:
+            query += " AND date <= ?"
+            params.append(date_to)
+        if tiles:
+            query += f" AND tile IN ({', '.join('?' * len(tiles))})"
+            params.extend(tiles)
+        if bounds:
+            query += " AND (west IS NULL OR (east >= ? AND west <= ? AND north >= ? AND south <= ?))"
+            params.extend([bounds[0], bounds[2], bounds[1], bounds[3]])
+        query += " ORDER BY date, path"
+        cur = self.conn.cursor()
+        rows = cur.execute(query, params).fetchall()
+        bands = {}
+        for scene, band, resolution, path in cur.execute(
+                "SELECT bands.scene, bands.band, bands.resolution, bands.path FROM bands "
+                "JOIN scenes ON scenes.path = bands.scene WHERE scenes.root = ? AND scenes.kind = ?",
+                (os.path.abspath(root), kind)):
+            bands.setdefault(scene, {})[(band, resolution)] = path
+        return [CatalogScene(path, name, date, tile, crs, None if west is None else (west, south, east, north),
+                             bands.get(path, {}), json.loads(metadata) if metadata else {},
+                             None if native[0] is None else tuple(native))
+                for path, name, date, tile, crs, west, south, east, north, metadata, *native in rows]
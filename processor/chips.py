@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from .archive import file_size, physical_path, split_archive_path
+from .memory import MB
+
+logger = logging.getLogger(__name__)
+
+CHIP_CACHE_VERSION = 2
+CHIP_INDEX = "chips.db"
+FINGERPRINT_BLOCK = 1 << 20
+
+_fingerprints: Dict[Tuple, str] = {}
+_fingerprints_lock = threading.Lock()
+
+
+def _digest_file(digest, path: str) -> None:
+    stat = os.stat(path)
+    digest.update(str(stat.st_size).encode())
+    with open(path, "rb") as content:
+        if stat.st_size <= 2 * FINGERPRINT_BLOCK:
+            for chunk in iter(lambda: content.read(FINGERPRINT_BLOCK), b""):
+                digest.update(chunk)
+            return
+        # a sampled file is also keyed on its mtime, so a rewrite in the middle is not missed
+        digest.update(str(stat.st_mtime_ns).encode())
+        digest.update(content.read(FINGERPRINT_BLOCK))
+        content.seek(stat.st_size - FINGERPRINT_BLOCK)
+        digest.update(content.read(FINGERPRINT_BLOCK))
+
+
+def source_fingerprint(path: str) -> str:
+    physical = physical_path(path)
+    stat = os.stat(physical)
+    key = (os.path.abspath(physical), split_archive_path(path)[1], stat.st_size, stat.st_mtime_ns)
+    with _fingerprints_lock:
+        if key in _fingerprints:
+            return _fingerprints[key]
+    digest = hashlib.sha1(os.path.basename(path).encode())
+    digest.update(str(file_size(path)).encode())
+    _digest_file(digest, physical)
+    with _fingerprints_lock:
+        _fingerprints[key] = digest.hexdigest()
+    return _fingerprints[key]
+
+
+def derived_fingerprint(recipe: str, inputs: Sequence[str]) -> str:
+    return hashlib.sha1(json.dumps([CHIP_CACHE_VERSION, recipe, list(inputs)]).encode()).hexdigest()
+
+
+def chip_key(fingerprint: str, crs: str, resolution: float, grid: Tuple, bounds: Optional[Tuple]) -> str:
+    parts = [CHIP_CACHE_VERSION, fingerprint, crs, resolution, list(grid), list(bounds) if bounds else None]
+    return hashlib.sha1(json.dumps(parts, default=float).encode()).hexdigest()
+
+
+def _link(source: str, destination: str) -> None:
+    temporary = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source, temporary)
+    except OSError:
+        shutil.copyfile(source, temporary)
+    os.replace(temporary, destination)
+
+
+class ChipCache:
+    def __init__(self, root: str, limit_mb: int):
+        self.root = root
+        self.limit = limit_mb * MB
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS chips ("
+                         "key VARCHAR(40) PRIMARY KEY, "
+                         "size INTEGER, "
+                         "used REAL"
+                         ")")
+            conn.execute("PRAGMA journal_mode=WAL").fetchone()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(os.path.join(self.root, CHIP_INDEX), timeout=60)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".tif")
+
+    def fetch(self, key: str, destination: str) -> bool:
+        path = self.path(key)
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM chips WHERE key = ?", (key,)).fetchone() is None:
+                return False
+            if not os.path.isfile(path):
+                conn.execute("DELETE FROM chips WHERE key = ?", (key,))
+                return False
+            conn.execute("UPDATE chips SET used = ? WHERE key = ?", (time.time(), key))
+        _link(path, destination)
+        return True
+
+    def store(self, key: str, source: str) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _link(source, path)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO chips (key, size, used) VALUES (?, ?, ?)",
+                         (key, os.path.getsize(path), time.time()))
+            self._evict(conn, key)
+
+    def _evict(self, conn: sqlite3.Connection, keep: str) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM chips").fetchone()[0]
+        if total <= self.limit:
+            return
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM chips WHERE key != ? ORDER BY used", (keep,)).fetchall():
+            if total <= self.limit:
+                break
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            evicted.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM chips WHERE key = ?", evicted)
+        logger.info(f"Chip cache evicted {len(evicted)} chips, {total / MB:.0f} MB left")
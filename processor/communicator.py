@@ -1,83 +1,520 @@
 import ast
+import contextlib
 import logging
+import math
 import os
 import re
+import shutil
 import sqlite3
-from typing import List, Set, Sequence, Callable, Dict
+import threading
+from functools import partial
+from typing import List, Set, Sequence, Callable, Dict, Optional, Tuple, NamedTuple
 
-import fiona
 import numpy as np
 import pandas as pd
 import rasterio
+from affine import Affine
+from rasterio.coords import disjoint_bounds
+from rasterio.errors import WindowError
 from rasterio.mask import mask
-from rasterio.warp import aligned_target, calculate_default_transform, reproject, Resampling
+from rasterio.warp import aligned_target, calculate_default_transform, reproject, transform_bounds, Resampling
+from rasterio.windows import Window, from_bounds
 
-from const import DELIMITER
+from const import (DELIMITER, CACHE_PATH, CLOUD_FILTER_RESOLUTION, PIPELINE_DEPTH, OVERLAP_RULES, EXPORT_ROW_BYTES,
+                   COMPOSITE_PERIODS, OVERLAP_MARGIN_PIXELS)
+from .archive import file_size, physical_path
+from .catalog import ArchiveCatalog, CatalogScene
+from .chips import ChipCache, chip_key, derived_fingerprint, source_fingerprint
+from .composite import CompositeWriter
+from .cube import CubeWriter
+from .errors import ErrorReport
+from .memory import MemoryBudget
+from .performance import PERFORMANCE_PROFILES
+from .pipeline import DatabaseWriter, prefetch
+from .profiler import Profiler
+from .progress import ProgressTracker
+from .project import load_project
+from .storage import RESULT_STORES, STORE_FILES, open_store
 
 
 logger = logging.getLogger(__name__)
 
 
-def load_shape(filename):
-    with fiona.open(filename, "r") as shapefile:
-        crs = shapefile.crs
-        shapes = [feature["geometry"] for feature in shapefile]
-    return crs, shapes
+class Scene(NamedTuple):
+    name: str
+    directory: str
+    date: str
+    args: tuple = ()
+    bounds: Optional[Tuple[float, float, float, float]] = None  # in crs
+    crs: Optional[str] = None
 
 
 class AbstractProcessor:
     input_path: str
     output_path: str
-    buffer_path: str
+    buffer_root: str
     shapes: list
     crs: rasterio.crs.CRS
     expected_resolution: int
     fields_whitelist: Set[str]
     match_fields: List[str]
+    cloud_threshold: Optional[float] = None
+    cloud_filter: str = "metadata"
+    catalog_kind: str
 
     def __init__(self, input_path: str, output_path: str, shape_path: str, expected_resolution: int,
-                 fields_whitelist: Sequence[str], match_fields: Dict[int, str], callback: Callable):
+                 fields_whitelist: Sequence[str], match_fields: Dict[int, str], callback: Callable,
+                 profile: bool = False, trace: bool = False, performance_profile: str = "default",
+                 date_from: Optional[str] = None, date_to: Optional[str] = None, tiles: Optional[Sequence[str]] = None,
+                 catalog_path: Optional[str] = None, cube: bool = False, overlap_rule: str = "coverage",
+                 result_backend: str = "sqlite", memory_budget_mb: int = 0, composite: Optional[str] = None,
+                 chip_cache_mb: int = 0, chip_cache_path: Optional[str] = None):
         logger.info(f"{self.__class__.__name__} initializing with input {input_path} and shape {shape_path}")
         self.input_path = input_path
         self.output_path = output_path
-        self.buffer_path = os.path.join(self.output_path, "buffer")
-        self.crs, self.shapes = load_shape(shape_path)
+        self.buffer_root = os.path.join(self.output_path, "buffer")
+        self._local = threading.local()
+        self.project = load_project(shape_path)
+        self.crs, self.shapes = self.project.crs, self.project.shapes
         self.expected_resolution = expected_resolution
         self.fields_whitelist = set(fields_whitelist)
         self.match_fields = []
         for i in range(len(self.shapes)):
             self.match_fields.append(match_fields.get(i, "out"))
+        self.field_indices = self.project.field_indices(dict(enumerate(self.match_fields)), self.fields_whitelist)
         self.callback = callback
+        self.errors = ErrorReport(callback)
+        self.profiler = Profiler(profile, trace)
+        self.progress = ProgressTracker(callback)
+        self.performance = PERFORMANCE_PROFILES[performance_profile]
+        self.memory = MemoryBudget(memory_budget_mb, PIPELINE_DEPTH + 1)
+        self.profiler.meta["memory_budget"] = self.memory.limit
+        self.date_from = date_from
+        self.date_to = date_to
+        self.tiles = tiles
+        self.catalog_path = catalog_path or os.path.join(CACHE_PATH, "catalog.db")
+        if overlap_rule not in OVERLAP_RULES:
+            raise ValueError(f"Unknown overlap rule: {overlap_rule}")
+        self.overlap_rule = overlap_rule
+        if result_backend not in RESULT_STORES:
+            raise ValueError(f"Unknown result backend: {result_backend}")
+        self.result_backend = result_backend
         self.db_path = os.path.join(self.output_path, "result.db")
         self.db_conn = None
         self.db_cur = None
+        self.db_writer = None
+        self._aoi_bounds = None
+        self._chip_bounds = None
+        self.chip_cache = None
+        self._derived: Dict[str, list] = {}
+        if chip_cache_mb:
+            self.chip_cache = ChipCache(chip_cache_path or os.path.join(CACHE_PATH, "chips"), chip_cache_mb)
+        if composite is not None and composite not in COMPOSITE_PERIODS:
+            raise ValueError(f"Unknown composite period: {composite}")
+        field_shapes = {}
+        for field_index in self.field_indices:
+            field_shapes.setdefault(self.match_fields[field_index], []).append(self.shapes[field_index])
+        self.cube_writer = None
+        if cube:
+            self.cube_writer = CubeWriter(os.path.join(self.output_path, "cube"), field_shapes,
+                                          self.expected_resolution * 9 / 1000000)
+        self.composite_writer = None
+        if composite:
+            self.composite_writer = CompositeWriter(os.path.join(self.output_path, "composite"), field_shapes,
+                                                    self.expected_resolution * 9 / 1000000, composite)
         self._initialize_database()
 
     def _initialize_database(self):
         with sqlite3.connect(self.db_path) as conn:
             cur = conn.cursor()
-            cur.execute("CREATE TABLE IF NOT EXISTS result ("
-                           "id INTEGER PRIMARY KEY AUTOINCREMENT, "
-                           "coefficient VARCHAR(64), "
-                           "field VARCHAR(64), "
-                           "date VARCHAR(16), "
-                           "longitude REAL, "
-                           "latitude REAL,"
-                           "value REAL, "
-                           "UNIQUE(coefficient, field, date, longitude, latitude)"
-                           ")")
+            cur.execute("CREATE TABLE IF NOT EXISTS scene_cloud ("
+                        "scene VARCHAR(256), "
+                        "mode VARCHAR(16), "
+                        "cloud REAL, "
+                        "PRIMARY KEY(scene, mode)"
+                        ")")
+            cur.execute("PRAGMA journal_mode=WAL").fetchone()
             conn.commit()
+        self.store = open_store(os.path.join(self.output_path, STORE_FILES[self.result_backend]), self.result_backend)
+        self.store.set_memory_limit(self.memory.limit)
 
     def run(self) -> None:
-        with sqlite3.connect(self.db_path) as self.db_conn:
+        with self.performance.env(), sqlite3.connect(self.db_path) as self.db_conn:
             self.db_cur = self.db_conn.cursor()
             self._import_from_csv()
-            self._run()
-            self._export_to_csv()
+            self.progress.set_span(0.0, 0.95)
+            with DatabaseWriter(self.store, self.profiler) as self.db_writer:
+                self._run()
+            with self.profiler.stage("index"):
+                self.store.create_indexes()  # built once the writers are done, ResultQuery only reads
+            self.progress.set_span(0.95, 1.0)
+            with self.profiler.stage("export"):
+                self._export_to_csv()
+            if self.composite_writer:
+                with self.profiler.stage("composite"):
+                    self.profiler.count("composite_rows", self.composite_writer.write())
+            self.store.close()
+            self.progress.update(1.0, stage="done")
+        self.errors.write(self.output_path)
+        self.profiler.write(self.output_path, self.__class__.__name__)
 
     def _run(self) -> None:
         raise NotImplementedError()
 
+    @property
+    def buffer_path(self) -> str:
+        return getattr(self._local, "buffer_path", None) or self.buffer_root
+
+    @contextlib.contextmanager
+    def scene_buffer(self, scene: Scene):
+        previous = getattr(self._local, "buffer_path", None)
+        self._local.buffer_path = os.path.join(self.buffer_root, self._sanitize_filename(scene.name))
+        os.makedirs(self._local.buffer_path, exist_ok=True)
+        try:
+            yield self._local.buffer_path
+        finally:
+            self._local.buffer_path = previous
+
+    def buffer_meta(self, meta: dict, **kwargs) -> dict:
+        meta = meta.copy()
+        meta.update(kwargs)
+        if meta["driver"] == "GTiff":
+            meta.update(self.performance.creation_options)
+        return meta
+
+    def decimation(self, src: rasterio.DatasetReader) -> int:
+        resolution = abs(src.res[0])
+        if src.crs and src.crs.is_geographic:
+            resolution = resolution * 1000000 / 9
+        return max(int(self.expected_resolution / resolution), 1)
+
+    def decimated_grid(self, src: rasterio.DatasetReader) -> Tuple[int, int, Affine]:
+        factor = self.decimation(src)
+        if factor == 1:
+            return src.height, src.width, src.transform
+        height, width = max(src.height // factor, 1), max(src.width // factor, 1)
+        return height, width, src.transform * Affine.scale(src.width / width, src.height / height)
+
+    def read_decimated(self, src: rasterio.DatasetReader, index: int = 1, rows: Optional[Tuple[int, int]] = None,
+                       source_function: Optional[Callable[[np.ndarray], np.ndarray]] = None
+                       ) -> Tuple[np.ndarray, Affine]:
+        height, width, transform = self.decimated_grid(src)
+        start, stop = rows or (0, height)
+        scale = src.height / height
+        window = None
+        if rows is not None:
+            window = Window(0, start * scale, src.width, (stop - start) * scale)
+        if (height, width) == (src.height, src.width):
+            data = src.read(index, window=window)
+            return (source_function(data) if source_function else data), transform
+        if source_function is None:
+            data = src.read(index, window=window, out_shape=(stop - start, width), resampling=Resampling.average)
+            return data, transform
+        # a non-linear function (a clip) is applied to every source pixel before they are averaged
+        top, bottom = int(start * scale), min(math.ceil(stop * scale), src.height)
+        source_window = Window(0, top, src.width, bottom - top)
+        source = source_function(src.read(index, window=source_window))
+        data = np.zeros((stop - start, width), dtype=source.dtype)
+        reproject(source, data, src_transform=src.window_transform(source_window), src_crs=src.crs,
+                  src_nodata=src.nodata, dst_transform=transform * Affine.translation(0, start), dst_crs=src.crs,
+                  dst_nodata=src.nodata, resampling=Resampling.average)
+        return data, transform
+
+    def write_decimated(self, src: rasterio.DatasetReader, output_filename: str,
+                        function: Callable[[np.ndarray], np.ndarray] = lambda data: data, stage: str = "harmonize",
+                        source_function: Optional[Callable[[np.ndarray], np.ndarray]] = None, **kwargs) -> None:
+        height, width, transform = self.decimated_grid(src)
+        meta = self.buffer_meta(src.meta, transform=transform, height=height, width=width, **kwargs)
+        bytes_per_pixel = np.dtype(src.dtypes[0]).itemsize + 2 * np.dtype(meta["dtype"]).itemsize
+        if source_function is not None:
+            bytes_per_pixel += 2 * np.dtype(src.dtypes[0]).itemsize * self.decimation(src) ** 2
+        with rasterio.open(output_filename, 'w', **meta) as output:
+            for start, stop in self.memory.row_blocks(height, width, bytes_per_pixel):
+                window = Window(0, start, width, stop - start)
+                for index in range(1, src.count + 1):
+                    with self.profiler.stage("decode"):
+                        data, _ = self.read_decimated(src, index, (start, stop), source_function)
+                    with self.profiler.stage(stage):
+                        output.write(function(data), index, window=window)
+
+    def prepare_scene(self, scene: Scene, coefficients: Sequence[str]) -> List[Tuple[str, object]]:
+        # bands of the next scene are decoded and warped here while the main thread masks the current one
+        prepared = []
+        with self.performance.env(), self.profiler.scene(scene.name), self.scene_buffer(scene):
+            for coefficient in coefficients:
+                try:
+                    path = self.get_coefficient_path(scene.directory, coefficient, *scene.args)
+                    if path:
+                        reprojected_path = os.path.join(self.buffer_path, coefficient + "_proc.tif")
+                        self.reproject_one(path, reprojected_path)
+                        path = reprojected_path
+                except Exception as e:
+                    prepared.append((coefficient, e))
+                    break
+                prepared.append((coefficient, path))
+        return prepared
+
+    def derive(self, output_filename: str, inputs: Sequence[str], recipe: str, write: Callable[[], None]) -> str:
+        # with the chip cache a derived band is only written when its warped chip is not cached
+        if not self.chip_cache:
+            write()
+            return output_filename
+        self._derived.setdefault(os.path.abspath(output_filename),
+                                 [derived_fingerprint(recipe, [self.fingerprint(path) for path in inputs]), write])
+        return output_filename
+
+    def fingerprint(self, path: str) -> str:
+        derived = self._derived.get(os.path.abspath(path))
+        return derived[0] if derived else source_fingerprint(path)
+
+    def materialize(self, path: str) -> None:
+        derived = self._derived.get(os.path.abspath(path))
+        if derived and derived[1]:
+            write, derived[1] = derived[1], None
+            write()
+
+    def forget_derived(self, directory: str) -> None:
+        prefix = os.path.abspath(directory) + os.sep
+        for path in [path for path in list(self._derived) if path.startswith(prefix)]:
+            self._derived.pop(path, None)
+
+    def run_scenes(self, scenes: Sequence[Scene], coefficients: Sequence[str]) -> None:
+        shutil.rmtree(self.buffer_root, ignore_errors=True)
+        try:
+            selected = []
+            for scene in scenes:
+                try:
+                    if not self.skip_scene(scene.directory, *scene.args):
+                        selected.append(scene)
+                except Exception:
+                    self.errors.record("scene_error", f"Exception in scene {scene.name}", scene=scene.name,
+                                       exc_info=True)
+            assignments = self.assign_fields(selected)
+            selected = [scene for scene in selected if assignments.get(scene.directory, True)]
+            total = len(selected) * len(coefficients)
+            prepared_scenes = prefetch(selected, partial(self.prepare_scene, coefficients=coefficients), PIPELINE_DEPTH)
+            for scene_index, (scene, prepared) in enumerate(prepared_scenes):
+                with self.errors.scene(scene.name):
+                    try:
+                        if isinstance(prepared, Exception):
+                            raise prepared
+                        self._local.fields = assignments.get(scene.directory)
+                        with self.profiler.scene(scene.name), self.scene_buffer(scene):
+                            for coefficient_index, (coefficient, path) in enumerate(prepared):
+                                self.progress.set_step(scene_index * len(coefficients) + coefficient_index, total,
+                                                       stage="mask", scene=scene.name)
+                                if isinstance(path, Exception):
+                                    raise path
+                                if not path:
+                                    continue
+                                self.process_file(path, coefficient, scene.date)
+                    except Exception:
+                        self.errors.record("scene_error", f"Exception in scene {scene.name}", exc_info=True)
+                    finally:
+                        self._local.fields = None
+                        scene_buffer = os.path.join(self.buffer_root, self._sanitize_filename(scene.name))
+                        shutil.rmtree(scene_buffer, ignore_errors=True)
+                        self.forget_derived(scene_buffer)
+        except Exception:
+            self.errors.record("unexpected", f"{self.__class__.__name__} unexpected exception", exc_info=True)
+        shutil.rmtree(self.buffer_root, ignore_errors=True)
+
+    def assign_fields(self, scenes: Sequence[Scene]) -> Dict[str, Optional[Set[int]]]:
+        assignments = {}
+        if self.overlap_rule == "all":
+            return assignments
+        dates = {}
+        for scene in scenes:
+            dates.setdefault(scene.date, []).append(scene)
+        for date, date_scenes in dates.items():
+            if len(date_scenes) < 2 or any(scene.bounds is None or not scene.crs for scene in date_scenes):
+                continue
+            for scene in date_scenes:
+                assignments[scene.directory] = set()
+            # fields are compared with each scene in its own CRS: WGS84 boxes overestimate the coverage of UTM tiles
+            insets = {scene.directory: self._insets(scene) for scene in date_scenes}
+            margins = {scene.directory: self._overlap_margin(scene) for scene in date_scenes}
+            clouds = {}
+            for field_index in self.field_indices:
+                candidates = [scene for scene in date_scenes if insets[scene.directory][1][field_index]]
+                full = [scene for scene in candidates
+                        if insets[scene.directory][0][field_index] >= margins[scene.directory]]
+                if self.overlap_rule == "cloud" and len(full) > 1:
+                    for scene in full:
+                        if scene.directory not in clouds:
+                            clouds[scene.directory] = self.scene_cloud_cover(scene.directory, *scene.args)
+                    cloud = {scene.directory: 100.0 if clouds[scene.directory] is None else clouds[scene.directory]
+                             for scene in full}
+                    full = [scene for scene in full if cloud[scene.directory] == min(cloud.values())]
+                if full:
+                    # scenes that cover the field about as well as the best one are all kept, e.g. the same tile
+                    # from two orbits on one date, where the bounds cannot tell which part has data
+                    best = max(insets[scene.directory][0][field_index] for scene in full)
+                    candidates = [scene for scene in full
+                                  if best - insets[scene.directory][0][field_index] < margins[scene.directory]]
+                for scene in candidates:
+                    assignments[scene.directory].add(field_index)
+            for scene in date_scenes:
+                logger.info(f"Scene {scene.name}: {len(assignments[scene.directory])} fields assigned on {date}")
+        return assignments
+
+    def _insets(self, scene: Scene) -> Tuple[np.ndarray, np.ndarray]:
+        _, bounds = self.project.reprojected(scene.crs)
+        west, south, east, north = scene.bounds
+        with np.errstate(invalid="ignore"):
+            inset = np.min([bounds[:, 0] - west, bounds[:, 1] - south, east - bounds[:, 2], north - bounds[:, 3]],
+                           axis=0)
+            overlaps = (bounds[:, 0] < east) & (bounds[:, 2] > west) & (bounds[:, 1] < north) & (bounds[:, 3] > south)
+        return inset, overlaps
+
+    def _overlap_margin(self, scene: Scene) -> float:
+        margin = OVERLAP_MARGIN_PIXELS * self.expected_resolution
+        if rasterio.crs.CRS.from_string(scene.crs).is_geographic:
+            margin = margin * 9 / 1000000
+        return margin
+
+    def discover_scenes(self, root: str) -> List[str]:
+        raise NotImplementedError()
+
+    def scene_mtime(self, path: str) -> float:
+        return os.stat(physical_path(path)).st_mtime
+
+    def describe_scene(self, path: str) -> Optional[CatalogScene]:
+        raise NotImplementedError()
+
+    @staticmethod
+    def describe_raster(path: str) -> Tuple[Optional[str], Optional[Tuple[float, float, float, float]],
+                                            Optional[Tuple[float, float, float, float]]]:
+        with rasterio.open(path) as src:
+            if src.crs is None:
+                return None, None, None
+            return src.crs.to_string(), transform_bounds(src.crs, "EPSG:4326", *src.bounds), tuple(src.bounds)
+
+    def catalog_scenes(self) -> List[CatalogScene]:
+        with ArchiveCatalog(self.catalog_path) as catalog:
+            catalog.refresh(self.input_path, self.catalog_kind, self.discover_scenes, self.scene_mtime,
+                            self.describe_scene)
+            bounds = None
+            if self.aoi_bounds is not None:
+                bounds = transform_bounds(self.crs, "EPSG:4326", *self.aoi_bounds)
+            return catalog.scenes(self.input_path, self.catalog_kind, self.date_from, self.date_to, self.tiles,
+                                  bounds)
+
+    @property
+    def aoi_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        if self._aoi_bounds is None:
+            if not len(self.field_indices):
+                return None
+            field_bounds = self.project.bounds[self.field_indices]
+            self._aoi_bounds = (*field_bounds[:, :2].min(axis=0), *field_bounds[:, 2:].max(axis=0))
+        return self._aoi_bounds
+
+    def chip_bounds(self) -> Optional[Tuple[float, float, float, float]]:
+        if self._chip_bounds is None and len(self.project.bounds) and not np.isnan(self.project.bounds[:, 0]).all():
+            bounds = self.project.bounds
+            self._chip_bounds = (*np.nanmin(bounds[:, :2], axis=0), *np.nanmax(bounds[:, 2:], axis=0))
+        return self._chip_bounds
+
+    def chip_window(self, transform: Affine, width: int, height: int) -> Optional[Window]:
+        bounds = self.chip_bounds()
+        if bounds is None:
+            return None
+        west, south, east, north = bounds
+        col_start = max(math.floor((west - transform.c) / transform.a) - 1, 0)
+        col_stop = min(math.ceil((east - transform.c) / transform.a) + 1, width)
+        row_start = max(math.floor((transform.f - north) / -transform.e) - 1, 0)
+        row_stop = min(math.ceil((transform.f - south) / -transform.e) + 1, height)
+        if col_stop <= col_start or row_stop <= row_start:
+            return None
+        if (col_start, row_start, col_stop, row_stop) == (0, 0, width, height):
+            return None
+        return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+    def store_chip(self, key: str, file_output: str) -> None:
+        chip_path = os.path.splitext(file_output)[0] + "_chip.tif"
+        with rasterio.open(file_output) as src:
+            window = self.chip_window(src.transform, src.width, src.height)
+            if window is None and src.driver == "GTiff":
+                chip_path = file_output
+            else:
+                # always cache a GeoTIFF: a JP2 buffer keeps its georeferencing in an .aux.xml sidecar
+                window = window or Window(0, 0, src.width, src.height)
+                meta = self.buffer_meta(src.meta, driver="GTiff", transform=src.window_transform(window),
+                                        width=window.width, height=window.height)
+                with rasterio.open(chip_path, "w", **meta) as chip:
+                    chip.write(src.read(window=window))
+        self.chip_cache.store(key, chip_path)
+        if chip_path != file_output:
+            os.replace(chip_path, file_output)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_output + ".aux.xml")
+
+    def chip_cache_key(self, file_input: str, transform: Affine, width: int, height: int) -> str:
+        return chip_key(source_fingerprint(file_input), str(self.crs), self.expected_resolution * 9 / 1000000,
+                        (*transform[:6], width, height), self.chip_bounds())
+
+    def derived_chip_key(self, fingerprint: str) -> str:
+        # the warped grid of a derived band follows from its inputs, which the fingerprint already covers
+        return chip_key(fingerprint, str(self.crs), self.expected_resolution * 9 / 1000000, (), self.chip_bounds())
+
+    def fetch_chip(self, key: str, file_output: str) -> bool:
+        if self.chip_cache.fetch(key, file_output):
+            self.profiler.count("chip_hits")
+            self.progress.update(nbytes=os.path.getsize(file_output))
+            return True
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file_output)  # may be a hard link to a cached chip
+        return False
+
+    def get_scene_cloud_cover(self, directory, *args, **kwargs) -> Optional[float]:
+        raise NotImplementedError()
+
+    def skip_scene(self, directory, *args, **kwargs) -> bool:
+        if self.cloud_threshold is None:
+            return False
+        cloud = self.scene_cloud_cover(directory, *args, **kwargs)
+        if cloud is None or cloud <= self.cloud_threshold:
+            return False
+        logger.info(f"Scene {os.path.basename(directory)} skipped: cloud cover {cloud:.1f}% > {self.cloud_threshold}%")
+        return True
+
+    def scene_cloud_cover(self, directory, *args, **kwargs) -> Optional[float]:
+        scene = os.path.basename(directory)
+        mode = self.cloud_filter
+        if mode == "overview":
+            mode = "overview:" + ",".join(f"{value:.6f}" for value in self.aoi_bounds or ())
+        self.db_cur.execute("SELECT cloud FROM scene_cloud WHERE scene = ? AND mode = ?", (scene, mode))
+        row = self.db_cur.fetchone()
+        if row is not None:
+            cloud = row[0]
+        else:
+            cloud = self.get_scene_cloud_cover(directory, *args, **kwargs)
+            if cloud is None:
+                return None
+            self.db_cur.execute("INSERT OR REPLACE INTO scene_cloud (scene, mode, cloud) VALUES (?, ?, ?)",
+                                (scene, mode, cloud))
+            self.db_conn.commit()
+        return cloud
+
+    def estimate_aoi_cloud_cover(self, path: str, is_cloudy: Callable[[np.ndarray], np.ndarray],
+                                 is_valid: Callable[[np.ndarray], np.ndarray]) -> Optional[float]:
+        if self.aoi_bounds is None:
+            return None
+        with rasterio.open(path) as src:
+            window = from_bounds(*transform_bounds(self.crs, src.crs, *self.aoi_bounds), transform=src.transform)
+            try:
+                window = window.intersection(Window(0, 0, src.width, src.height))
+            except WindowError:
+                return 100.0
+            scale = src.res[0] / CLOUD_FILTER_RESOLUTION
+            out_shape = (max(1, round(window.height * scale)), max(1, round(window.width * scale)))
+            data = src.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
+        valid = is_valid(data)
+        valid_count = np.count_nonzero(valid)
+        if not valid_count:
+            return 100.0
+        return 100.0 * np.count_nonzero(is_cloudy(data) & valid) / valid_count
+
     @staticmethod
     def _sanitize_filename(name: str) -> str:
         safe_name = re.sub(r'[\\/*?:"<>|\s]', '_', name)
@@ -88,8 +525,7 @@ class AbstractProcessor:
         return safe_name
 
     def _import_from_csv(self) -> None:
-        self.db_cur.execute("SELECT COUNT(*) FROM result")
-        if self.db_cur.fetchone()[0] > 0:
+        if self.store.count() > 0:
             return
 
         if not os.path.exists(self.output_path):
@@ -120,38 +556,41 @@ class AbstractProcessor:
                     df_long['field'] = field
                     df_long.rename(columns={'x': 'longitude', 'y': 'latitude'}, inplace=True)
                     df_long = df_long[['coefficient', 'field', 'date', 'longitude', 'latitude', 'value']]
-                    df_long.to_sql('result', self.db_conn, if_exists='append', index=False,
-                                   dtype={'coefficient': 'TEXT', 'field': 'TEXT', 'date': 'TEXT',
-                                          'longitude': 'REAL', 'latitude': 'REAL', 'value': 'REAL'})
+                    self.store.insert_frame(df_long)
                 except Exception as e:
                     continue
-            self.db_conn.commit()
 
     def _export_to_csv(self) -> None:
-        df = pd.read_sql_query(
-            "SELECT coefficient, field, date, longitude, latitude, value FROM result",
-            self.db_conn
-        )
+        coefficients = self.store.coefficients()
+        for coefficient_index, coef in enumerate(coefficients):
+            self._export_coefficient(coef, coefficient_index, len(coefficients))
 
-        for (coef, field), group in df.groupby(['coefficient', 'field']):
-            coef_safe = self._sanitize_filename(coef)
+    def _export_coefficient(self, coef: str, coefficient_index: int, coefficient_count: int) -> None:
+        field_count = len(self.store.fields(coef))
+        coef_safe = self._sanitize_filename(coef)
+        pivots = self.store.pivot_fields(coef, self.memory.task_limit // EXPORT_ROW_BYTES)
+        for field_index, (field, pivot) in enumerate(pivots):
             field_safe = self._sanitize_filename(field)
-
-            pivot = group.pivot(index=['longitude', 'latitude'], columns='date', values='value')
-            pivot.reset_index(inplace=True)
-            pivot.rename(columns={'longitude': 'x', 'latitude': 'y'}, inplace=True)
-
-            date_cols = [c for c in pivot.columns if c not in ('x', 'y')]
-            date_cols_sorted = sorted(date_cols)
-            pivot = pivot[['x', 'y'] + date_cols_sorted]
-
             coef_dir = os.path.join(self.output_path, coef_safe)
             os.makedirs(coef_dir, exist_ok=True)
             csv_path = os.path.join(coef_dir, f"{field_safe}.csv")
             pivot.to_csv(csv_path, index=False, sep=DELIMITER)
+            self.profiler.count("rows_exported", len(pivot))
+            self.profiler.count("bytes_written", os.path.getsize(csv_path))
+            self.progress.update((coefficient_index + (field_index + 1) / field_count) / coefficient_count,
+                                 stage="export", scene=f"{coef}/{field}",
+                                 rows=len(pivot), nbytes=os.path.getsize(csv_path))
 
     def reproject_one(self, file_input, file_output):
-        with rasterio.open(file_input) as src:
+        self.progress.update(stage="warp")
+        key = None
+        derived = self.chip_cache and self._derived.get(os.path.abspath(file_input))
+        if derived:
+            key = self.derived_chip_key(derived[0])
+            if self.fetch_chip(key, file_output):
+                return
+            self.materialize(file_input)
+        with self.profiler.stage("warp"), rasterio.open(file_input) as src:
             dst_transform, dst_width, dst_height = calculate_default_transform(
                 src.crs,
                 self.crs,
@@ -161,50 +600,101 @@ class AbstractProcessor:
             )
             dst_transform, dst_width, dst_height = aligned_target(dst_transform, dst_width, dst_height,
                                                                   self.expected_resolution * 9 / 1000000)
-            dst_kwargs = src.meta.copy()
-            dst_kwargs.update({"crs": self.crs,
-                               "transform": dst_transform,
-                               "width": dst_width,
-                               "height": dst_height})
-            with rasterio.open(file_output, "w", **dst_kwargs) as dst:
+            if self.chip_cache and key is None:
+                key = self.chip_cache_key(file_input, dst_transform, dst_width, dst_height)
+                if self.fetch_chip(key, file_output):
+                    return
+            dst_kwargs = self.buffer_meta(src.meta, crs=self.crs, transform=dst_transform,
+                                          width=dst_width, height=dst_height)
+            height, width, _ = self.decimated_grid(src)
+            decimated = (height, width) != (src.height, src.width)
+            with contextlib.ExitStack() as stack:
+                if decimated and not self.memory.fits(height * width * np.dtype(src.dtypes[0]).itemsize):
+                    decimated_output = os.path.splitext(file_output)[0] + "_decimated.tif"
+                    self.write_decimated(src, decimated_output, stage="decimate", driver="GTiff")
+                    src = stack.enter_context(rasterio.open(decimated_output))
+                    decimated = False
+                dst = stack.enter_context(rasterio.open(file_output, "w", **dst_kwargs))
                 for i in range(1, src.count + 1):
+                    source, src_transform = rasterio.band(src, i), src.transform
+                    if decimated:
+                        source, src_transform = self.read_decimated(src, i)
                     reproject(
-                        source=rasterio.band(src, i),
+                        source=source,
                         destination=rasterio.band(dst, i),
-                        src_transform=src.transform,
+                        src_transform=src_transform,
                         src_crs=src.crs,
+                        src_nodata=src.nodata,
                         dst_transform=dst_transform,
                         dst_crs=self.crs,
-                        resampling=Resampling.bilinear)
+                        resampling=Resampling.bilinear,
+                        num_threads=self.performance.warp_threads,
+                        warp_mem_limit=self.performance.warp_mem_limit)
+        if key is not None:
+            with self.profiler.stage("chip"):
+                self.store_chip(key, file_output)
+            self.profiler.count("chip_misses")
+        self.profiler.count("bytes_read", file_size(file_input))
+        self.profiler.count("bytes_written", os.path.getsize(file_output))
+        self.progress.update(nbytes=file_size(file_input))
+
+    def composite_date(self, date: str) -> str:
+        return date
 
     def process_file(self, file_path: str, coefficient: str, date: str) -> None:
+        self.process_bands(file_path, [coefficient], date)
+
+    def process_bands(self, file_path: str, coefficients: Sequence[str], date: str,
+                      formulas: Optional[Dict[str, str]] = None) -> None:
+        self.progress.update(stage="mask")
+        assigned = getattr(self._local, "fields", None)
         with rasterio.open(file_path) as src:
-            for field_index, field_shape in enumerate(self.shapes):
-                if not field_shape:
-                    continue
-                if field_index >= len(self.match_fields) or self.match_fields[field_index] not in self.fields_whitelist:
+            for position, field_index in enumerate(self.field_indices):
+                if assigned is not None and field_index not in assigned:
                     continue
+                field_shape = self.shapes[field_index]
                 field_name = self.match_fields[field_index]
+                if disjoint_bounds(self.project.bounds[field_index], src.bounds):
+                    self.errors.record("field_outside", f"Field {field_name} is not presented in {file_path}",
+                                       field=field_name)
+                    continue
                 try:
                     try:
-                        out_image, out_transform = mask(src, [field_shape], filled=False, crop=True)
-                        out_image = np.ma.squeeze(out_image, axis=0)
+                        with self.profiler.stage("mask"):
+                            out_image, out_transform = mask(src, [field_shape], filled=False, crop=True)
                     except ValueError:
-                        self.callback(f"Field {field_name} is not presented in {file_path}", callback_type="error")
+                        self.errors.record("field_outside", f"Field {field_name} is not presented in {file_path}",
+                                           field=field_name)
                         continue
-                    x_points, y_points = np.where(~out_image.mask)
-                    x_coords, y_coords = rasterio.transform.xy(out_transform, x_points, y_points)
-                    data = np.array([np.round(x_coords, 6), np.round(y_coords, 6), out_image.compressed()]).T
-                    data = [(coefficient, field_name, date, x, y, val) for x, y, val in data]
-
-                    self.db_cur.executemany("INSERT OR IGNORE INTO result "
-                                    "(coefficient, field, date, longitude, latitude, value) "
-                                    "VALUES (?, ?, ?, ?, ?, ?)", data)
-                except Exception as e:
-                    logger.exception(f"field_name-{field_name},file-{file_path}")
-                    self.callback(f"Error with field {field_name}, file: {file_path}", callback_type="error")
+                    bands = list(zip(coefficients, out_image))
+                    if formulas:
+                        with self.profiler.stage("formula"), np.errstate(divide='ignore', invalid='ignore'):
+                            variables = {name: band.astype("float32") for name, band in bands}
+                            for name, formula in formulas.items():
+                                bands.append((name, eval(formula, {"__builtins__": {'__import__': __import__}},
+                                                         dict(variables))))
+                    data = []
+                    with self.profiler.stage("extract"):
+                        for coefficient, band in bands:
+                            x_points, y_points = np.where(~np.ma.getmaskarray(band))
+                            x_coords, y_coords = rasterio.transform.xy(out_transform, x_points, y_points)
+                            band_values = np.ma.getdata(band)[x_points, y_points]
+                            values = np.array([np.round(x_coords, 6), np.round(y_coords, 6), band_values]).T
+                            data.extend((coefficient, field_name, date, x, y, val) for x, y, val in values)
+                            if self.cube_writer:
+                                self.cube_writer.add(field_name, coefficient, date, x_coords, y_coords, band_values)
+                            if self.composite_writer:
+                                self.composite_writer.add(field_name, coefficient, self.composite_date(date),
+                                                          x_coords, y_coords, band_values)
+                    self.profiler.count("pixels", len(data))
+
+                    self.db_writer.insert(data)
+                    self.profiler.count("rows_inserted", len(data))
+                    self.progress.update((position + 1) / len(self.field_indices), pixels=len(data), rows=len(data))
+                except Exception:
+                    self.errors.record("field_error", f"Error with field {field_name}, file: {file_path}",
+                                       field=field_name, exc_info=True)
                     continue
-            self.db_conn.commit()
 
     def get_coefficient_path(self, directory_path, coefficient, *args, **kwargs):
         raise NotImplementedError()
@@ -226,20 +716,37 @@ class AbstractProcessor:
             extractor.visit(tree)
         except SyntaxError:
             return None
-        meta = {}
+        paths = {}
         for var in variables:
             path = self.get_coefficient_path(directory_path, var, *args, **kwargs)
             if not path:
                 return None
-            with rasterio.open(path) as dataset:
-                data = dataset.read(1).astype("float32")
-                meta = dataset.meta.copy()
-            variables[var] = data
-        meta["driver"] = "GTiff"
-        meta["dtype"] = "float32"
-        with np.errstate(divide='ignore'):
-            data = eval(formula, {"__builtins__": {'__import__': __import__}}, variables)
-
-        with rasterio.open(out_filename, 'w', **meta) as output:
-            output.write(data, 1)
-        return out_filename
+            paths[var] = path
+        if not paths:
+            return None
+
+        def write():
+            for path in paths.values():
+                self.materialize(path)
+            with contextlib.ExitStack() as stack:
+                datasets = {var: stack.enter_context(rasterio.open(path)) for var, path in paths.items()}
+                reference = next(iter(datasets.values()))
+                height, width, transform = self.decimated_grid(reference)
+                meta = self.buffer_meta(reference.meta, driver="GTiff", dtype="float32", transform=transform,
+                                        height=height, width=width)
+                bytes_per_pixel = 4 * (len(datasets) + 2)
+                with rasterio.open(out_filename, 'w', **meta) as output:
+                    for start, stop in self.memory.row_blocks(height, width, bytes_per_pixel):
+                        for var, dataset in datasets.items():
+                            with self.profiler.stage("decode"):
+                                data, _ = self.read_decimated(dataset, rows=(start, stop))
+                                variables[var] = data.astype("float32")
+                        with self.profiler.stage("formula"), np.errstate(divide='ignore'):
+                            data = eval(formula, {"__builtins__": {'__import__': __import__}}, variables)
+                            output.write(data, 1, window=Window(0, start, width, stop - start))
+            for path in paths.values():
+                self.profiler.count("bytes_read", file_size(path))
+                self.progress.update(stage="formula", nbytes=file_size(path))
+            self.profiler.count("bytes_written", os.path.getsize(out_filename))
+
+        return self.derive(out_filename, list(paths.values()), f"formula {formula} {list(paths)}", write)
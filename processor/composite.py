@@ -0,0 +1,149 @@
+import datetime
+import os
+import re
+import threading
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from const import COMPOSITE_MEDIAN_SAMPLES, DELIMITER
+from .cube import _safe_name, field_pixels, pixel_keys
+
+COMPOSITE_COLUMNS = ["x", "y", "period", "count", "mean", "max", "median"]
+STATE_EXTENSION = ".npz"
+PERIOD_DAYS = {"month": 31, "dekad": 11}
+
+
+def composite_period(date: str, period: str) -> Tuple[str, int]:
+    match = re.match(r"(\d{4})-?(\d{2})-?(\d{2})", str(date))
+    try:
+        day = datetime.date(*map(int, match.groups()))
+    except (AttributeError, ValueError):
+        return str(date), 0
+    if period == "dekad":
+        dekad = min((day.day - 1) // 10, 2)
+        return f"{day:%Y-%m}-{dekad + 1}", day.day - 1 - dekad * 10
+    return f"{day:%Y-%m}", day.day - 1
+
+
+class _PeriodAggregate:
+    def __init__(self, size: int, samples: int):
+        self.days = np.zeros(size, dtype="uint32")
+        self.count = np.zeros(size, dtype="uint32")
+        self.total = np.zeros(size, dtype="float64")
+        self.maximum = np.full(size, -np.inf, dtype="float32")
+        self.samples = np.full((size, samples), np.nan, dtype="float32")
+
+    def add(self, index: np.ndarray, day: int, values: np.ndarray, rng: np.random.Generator) -> None:
+        bit = np.uint32(1 << day)
+        fresh = (self.days[index] & bit) == 0
+        index, values = index[fresh], values[fresh]
+        self.days[index] |= bit
+        finite = np.isfinite(values)
+        index, values = index[finite], values[finite]
+        seen = self.count[index].astype("int64")
+        reservoir = self.samples.shape[1]
+        slot = np.where(seen < reservoir, seen, rng.integers(0, seen + 1))
+        kept = slot < reservoir
+        self.samples[index[kept], slot[kept]] = values[kept]
+        self.count[index] += 1
+        self.total[index] += values
+        self.maximum[index] = np.maximum(self.maximum[index], values)
+
+    def median(self, index: np.ndarray) -> np.ndarray:
+        return np.nanmedian(self.samples[index], axis=1)
+
+
+class _FieldComposite:
+    def __init__(self, path: str, shapes: Sequence[dict], resolution: float, period: str):
+        self.path = path
+        self.resolution = resolution
+        self.period = period
+        self.periods: Dict[str, _PeriodAggregate] = {}
+        self.samples = min(COMPOSITE_MEDIAN_SAMPLES, PERIOD_DAYS[period])
+        self.rng = np.random.default_rng(0)
+        state_path = path + STATE_EXTENSION
+        self.keys = None
+        if os.path.isfile(state_path):
+            self._load(state_path)
+        if self.keys is None:
+            self.keys = field_pixels(shapes, resolution)
+
+    def _load(self, state_path: str) -> None:
+        with np.load(state_path) as state:
+            if str(state["period"]) != self.period:
+                return
+            self.keys = state["keys"]
+            for position, label in enumerate(state["periods"]):
+                aggregate = _PeriodAggregate(len(self.keys), state["samples"].shape[2])
+                for name in ("days", "count", "total", "maximum", "samples"):
+                    setattr(aggregate, name, state[name][position].copy())
+                self.periods[str(label)] = aggregate
+
+    def add(self, date: str, x: np.ndarray, y: np.ndarray, values: np.ndarray) -> None:
+        if not len(self.keys):
+            return
+        keys = pixel_keys(np.floor(np.asarray(y) / self.resolution), np.floor(np.asarray(x) / self.resolution))
+        index = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[index] == keys
+        index, first = np.unique(index[found], return_index=True)
+        if not len(index):
+            return
+        label, day = composite_period(date, self.period)
+        if label not in self.periods:
+            self.periods[label] = _PeriodAggregate(len(self.keys), self.samples)
+        self.periods[label].add(index, day, np.asarray(values, dtype="float32")[found][first], self.rng)
+
+    def frame(self) -> pd.DataFrame:
+        rows, cols = self.keys >> 32, (self.keys & 0xFFFFFFFF).astype("int32")
+        x, y = np.round((cols + 0.5) * self.resolution, 6), np.round((rows + 0.5) * self.resolution, 6)
+        frames = []
+        for label in sorted(self.periods):
+            aggregate = self.periods[label]
+            index = np.flatnonzero(aggregate.count)
+            frames.append(pd.DataFrame({
+                "x": x[index], "y": y[index], "period": label, "count": aggregate.count[index],
+                "mean": aggregate.total[index] / aggregate.count[index], "max": aggregate.maximum[index],
+                "median": aggregate.median(index),
+            }, columns=COMPOSITE_COLUMNS))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COMPOSITE_COLUMNS)
+
+    def save(self) -> int:
+        labels = sorted(self.periods)
+        aggregates = [self.periods[label] for label in labels]
+        arrays = {name: np.stack([getattr(aggregate, name) for aggregate in aggregates]) if aggregates
+                  else np.empty((0, len(self.keys))) for name in ("days", "count", "total", "maximum")}
+        arrays["samples"] = (np.stack([aggregate.samples for aggregate in aggregates]) if aggregates
+                             else np.empty((0, len(self.keys), self.samples), dtype="float32"))
+        np.savez(self.path + STATE_EXTENSION, keys=self.keys, period=self.period,
+                 periods=np.array(labels, dtype=str), **arrays)
+        frame = self.frame()
+        frame.to_csv(self.path + ".csv", index=False, sep=DELIMITER)
+        return len(frame)
+
+
+class CompositeWriter:
+    def __init__(self, root: str, shapes: Dict[str, Sequence[dict]], resolution: float, period: str = "month"):
+        self.root = root
+        self.shapes = shapes
+        self.resolution = resolution
+        self.period = period
+        self.fields: Dict[Tuple[str, str], _FieldComposite] = {}
+        self._lock = threading.Lock()
+
+    def add(self, field: str, coefficient: str, date: str, x: np.ndarray, y: np.ndarray, values: np.ndarray) -> None:
+        if field not in self.shapes:
+            return
+        with self._lock:
+            key = (coefficient, field)
+            if key not in self.fields:
+                directory = os.path.join(self.root, _safe_name(coefficient))
+                os.makedirs(directory, exist_ok=True)
+                self.fields[key] = _FieldComposite(os.path.join(directory, _safe_name(field)), self.shapes[field],
+                                                   self.resolution, self.period)
+            self.fields[key].add(date, x, y, values)
+
+    def write(self) -> int:
+        with self._lock:
+            return sum(composite.save() for composite in self.fields.values())
@@ -0,0 +1,145 @@
+import json
+import math
+import os
+import re
+import threading
+from typing import Dict, List, NamedTuple, Sequence
+
+import numpy as np
+from affine import Affine
+from rasterio.features import bounds as geometry_bounds, geometry_mask
+
+CUBE_HEADER = "cube.json"
+COORDS_FILE = "coords.npy"
+VALUES_DTYPE = np.dtype("float32")
+VALID_DTYPE = np.dtype("uint8")
+
+
+class Cube(NamedTuple):
+    coords: np.ndarray
+    dates: List[str]
+    values: Dict[str, np.ndarray]
+    valid: Dict[str, np.ndarray]
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r'[\\/*?:"<>|]', "_", str(name)) or "_"
+
+
+def field_pixels(shapes: Sequence[dict], resolution: float) -> np.ndarray:
+    keys = []
+    for shape in shapes:
+        west, south, east, north = geometry_bounds(shape)
+        col_min, col_max = math.floor(west / resolution), math.floor(east / resolution)
+        row_min, row_max = math.floor(south / resolution), math.floor(north / resolution)
+        transform = Affine(resolution, 0, col_min * resolution, 0, -resolution, (row_max + 1) * resolution)
+        inside = geometry_mask([shape], out_shape=(row_max - row_min + 1, col_max - col_min + 1),
+                               transform=transform, invert=True)
+        rows, cols = np.nonzero(inside)
+        keys.append(pixel_keys(row_max - rows, col_min + cols))
+    if not keys:
+        return np.empty(0, dtype="int64")
+    return np.unique(np.concatenate(keys))
+
+
+def pixel_keys(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    return (np.asarray(rows, dtype="int64") << 32) + (np.asarray(cols, dtype="int64") & 0xFFFFFFFF)
+
+
+class _FieldCube:
+    def __init__(self, path: str, shapes: Sequence[dict], resolution: float):
+        self.path = path
+        self.resolution = resolution
+        os.makedirs(path, exist_ok=True)
+        header_path = os.path.join(path, CUBE_HEADER)
+        if os.path.isfile(header_path):
+            with open(header_path) as header_file:
+                header = json.load(header_file)
+            self.keys = np.load(os.path.join(path, "keys.npy"))
+            self.dates = header["dates"]
+            self.coefficients = header["coefficients"]
+        else:
+            self.keys = field_pixels(shapes, resolution)
+            self.dates = []
+            self.coefficients = {}
+            rows, cols = self.keys >> 32, (self.keys & 0xFFFFFFFF).astype("int32")
+            np.save(os.path.join(path, "keys.npy"), self.keys)
+            np.save(os.path.join(path, COORDS_FILE),
+                    np.column_stack([(cols + 0.5) * resolution, (rows + 0.5) * resolution]))
+            self._write_header()
+        self.date_index = {date: index for index, date in enumerate(self.dates)}
+
+    def _write_header(self) -> None:
+        with open(os.path.join(self.path, CUBE_HEADER), "w") as header_file:
+            json.dump({"resolution": self.resolution, "pixels": len(self.keys), "dates": self.dates,
+                       "coefficients": self.coefficients}, header_file, ensure_ascii=False, indent=1)
+
+    def write(self, coefficient: str, date: str, x: np.ndarray, y: np.ndarray, values: np.ndarray) -> None:
+        if not len(self.keys):
+            return
+        keys = pixel_keys(np.floor(np.asarray(y) / self.resolution), np.floor(np.asarray(x) / self.resolution))
+        index = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[index] == keys
+        if not found.any():
+            return
+        changed = False
+        if date not in self.date_index:
+            self.date_index[date] = len(self.dates)
+            self.dates.append(date)
+            changed = True
+        if coefficient not in self.coefficients:
+            self.coefficients[coefficient] = _safe_name(coefficient)
+            changed = True
+        if changed:
+            self._write_header()
+        slab = self.date_index[date]
+        stem = os.path.join(self.path, self.coefficients[coefficient])
+        self._write_slab(stem + ".values", VALUES_DTYPE, np.nan, slab, index[found],
+                         np.asarray(values, dtype=VALUES_DTYPE)[found])
+        self._write_slab(stem + ".valid", VALID_DTYPE, 0, slab, index[found], 1)
+
+    def _write_slab(self, path: str, dtype: np.dtype, fill, slab: int, index: np.ndarray, values) -> None:
+        slab_bytes = len(self.keys) * dtype.itemsize
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        if size < (slab + 1) * slab_bytes:
+            with open(path, "ab") as data_file:
+                data_file.write(np.full((slab + 1) * len(self.keys) - size // dtype.itemsize, fill,
+                                        dtype=dtype).tobytes())
+        data = np.memmap(path, dtype=dtype, mode="r+", offset=slab * slab_bytes, shape=(len(self.keys),))
+        data[index] = values
+        data.flush()
+        del data
+
+
+class CubeWriter:
+    def __init__(self, root: str, shapes: Dict[str, Sequence[dict]], resolution: float):
+        self.root = root
+        self.shapes = shapes
+        self.resolution = resolution
+        self.fields: Dict[str, _FieldCube] = {}
+        self._lock = threading.Lock()
+
+    def add(self, field: str, coefficient: str, date: str, x: np.ndarray, y: np.ndarray, values: np.ndarray) -> None:
+        if field not in self.shapes:
+            return
+        with self._lock:
+            if field not in self.fields:
+                self.fields[field] = _FieldCube(os.path.join(self.root, _safe_name(field)), self.shapes[field],
+                                                self.resolution)
+            self.fields[field].write(coefficient, date, x, y, values)
+
+
+def load_cube(path: str) -> Cube:
+    with open(os.path.join(path, CUBE_HEADER)) as header_file:
+        header = json.load(header_file)
+    pixels = header["pixels"]
+    values, valid = {}, {}
+    for coefficient, stem in header["coefficients"].items():
+        for arrays, extension, dtype in ((values, ".values", VALUES_DTYPE), (valid, ".valid", VALID_DTYPE)):
+            data_path = os.path.join(path, stem + extension)
+            slabs = os.path.getsize(data_path) // (pixels * dtype.itemsize) if pixels else 0
+            if slabs:
+                arrays[coefficient] = np.memmap(data_path, dtype=dtype, mode="r", shape=(slabs, pixels))
+            else:
+                arrays[coefficient] = np.empty((0, pixels), dtype=dtype)
+    return Cube(np.load(os.path.join(path, COORDS_FILE), mmap_mode="r"), header["dates"], values, valid)
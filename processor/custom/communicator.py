@@ -1,11 +1,14 @@
+import ast
+import datetime
 import glob
 import logging
 import os
 import re
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Sequence
 
 import rasterio
 
+from processor.catalog import CatalogScene
 from processor.communicator import AbstractProcessor
 
 logger = logging.getLogger(__name__)
@@ -19,33 +22,89 @@ def try_extract_date(path: str) -> Optional[str]:
     return None
 
 
+def formula_variables(formula: str) -> Optional[set]:
+    try:
+        tree = ast.parse(formula, mode='eval')
+    except SyntaxError:
+        return None
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+
+
 class CustomProcessor(AbstractProcessor):
+    catalog_kind = "custom"
+    band_names: Dict[int, str]
+    formulas: Dict[str, str]
+
+    def __init__(self, input_path: str, output_path: str, shape_path: str, expected_resolution: int,
+                 fields_whitelist: Sequence[str], match_fields: Dict[int, str], callback: Callable,
+                 band_names: Optional[Dict[int, str]] = None, formulas: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(input_path, output_path, shape_path, expected_resolution, fields_whitelist, match_fields,
+                         callback, **kwargs)
+        self.band_names = band_names or {}
+        self.formulas = formulas or {}
+
+    def get_band_names(self, src: rasterio.DatasetReader) -> List[str]:
+        if src.count == 1:
+            return [self.band_names.get(1, "")]
+        return [self.band_names.get(index) or src.descriptions[index - 1] or f"B{index}"
+                for index in range(1, src.count + 1)]
+
+    def get_formulas(self, band_names: Sequence[str], input_path: str) -> Dict[str, str]:
+        formulas = {}
+        for name, formula in self.formulas.items():
+            variables = formula_variables(formula)
+            if variables is None or not variables <= set(band_names):
+                self.errors.record("formula", f"Formula {name} can not be calculated for {input_path}")
+                continue
+            formulas[name] = formula
+        return formulas
+
+    def discover_scenes(self, root):
+        files = glob.glob(os.path.join(root, "**", "*.tif"), recursive=True)
+        files.extend(glob.glob(os.path.join(root, "**", "*.tiff"), recursive=True))
+        return [path for path in files if os.path.isfile(path)]
+
+    def describe_scene(self, path):
+        date = try_extract_date(path)
+        iso_date = ""
+        if date is not None:
+            try:
+                iso_date = datetime.datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+            except ValueError:
+                iso_date = date
+        crs, bounds, _ = self.describe_raster(path)
+        return CatalogScene(path, os.path.basename(path), iso_date, "", crs, bounds, {("", ""): path},
+                            {"date": date})
+
     def _run(self):
         if os.path.isfile(self.input_path):
             self._process_file(self.input_path, self.output_path, "CUSTOM")
         if os.path.isdir(self.input_path):
-            files = glob.glob(os.path.join(self.input_path, "**", "*.tif"), recursive=True)
-            files.extend(glob.glob(os.path.join(self.input_path, "**", "*.tiff"), recursive=True))
-            files = [path for path in files if os.path.isfile(path)]
+            with self.profiler.stage("scan"):
+                scenes = self.catalog_scenes()
+            # the catalog orders scenes by date, CUSTOM_n labels keep following the order files are found in
+            order = {path: index for index, path in enumerate(self.discover_scenes(os.path.abspath(self.input_path)))}
+            scenes.sort(key=lambda scene: order.get(scene.path, len(order)))
             unknown_count = 0
-            for ind, filename in enumerate(files):
-                date = try_extract_date(filename)
+            for ind, scene in enumerate(scenes):
+                filename = scene.path
+                self.progress.set_step(ind, len(scenes), stage="decode", scene=scene.name)
+                date = scene.metadata["date"]
                 if date is None:
                     date = f"CUSTOM_{unknown_count}"
                     unknown_count += 1
-                self._process_file(filename, self.output_path, date)
-                self.callback(100 * ind // len(files), callback_type="percent")
+                with self.profiler.scene(os.path.basename(filename)), self.errors.scene(os.path.basename(filename)):
+                    self._process_file(filename, self.output_path, date)
 
     def _process_file(self, input_path: str, output_path: str, date: str):
         reprojected_path = os.path.join(output_path, os.path.basename(input_path) + "_proc.tif")
         try:
             with rasterio.open(input_path) as src:
-                if src.count != 1:
-                    return
+                band_names = self.get_band_names(src)
+            formulas = self.get_formulas(band_names, input_path)
             self.reproject_one(input_path, reprojected_path)
-            self.process_file(reprojected_path, "", date)
-        except Exception as e:
-            logger.exception("CustomProcessor exception")
-            self.callback("Unexpected exception", callback_type="error")
+            self.process_bands(reprojected_path, band_names, date, formulas)
+        except Exception:
+            self.errors.record("scene_error", f"Exception in file {input_path}", exc_info=True)
         if os.path.isfile(reprojected_path):
             os.remove(reprojected_path)
@@ -1,29 +1,143 @@
-import glob
 import logging
 import os
+import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Callable
 
+import numpy as np
+import rasterio
+from rasterio.errors import RasterioIOError, WindowError
+from rasterio.features import geometry_mask
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import aligned_target, calculate_default_transform, Resampling
+from rasterio.windows import Window, from_bounds
+
+from const import MOSAIC_TILE_SIZE
+from processor.catalog import CatalogScene
 from processor.communicator import AbstractProcessor
+from .mosaic import build_vrt, read_info
 
 logger = logging.getLogger(__name__)
 
 
 class DroneProcessor(AbstractProcessor):
+    catalog_kind = "drone"
+
     def __init__(self, input_path: str, output_path: str, shape_path: str, expected_resolution: int, shape_index: int,
-                 callback: Callable):
-        super().__init__(input_path, output_path, shape_path, expected_resolution, [str(shape_index)], {i: str(i) for i in range(shape_index + 1)}, callback)
+                 callback: Callable, mosaic: bool = False, **kwargs):
+        super().__init__(input_path, output_path, shape_path, expected_resolution, [str(shape_index)], {i: str(i) for i in range(shape_index + 1)}, callback, **kwargs)
+        self.mosaic = mosaic
+
+    def discover_scenes(self, root):
+        return [entry.path for entry in os.scandir(root) if entry.is_file()]
+
+    def describe_scene(self, path):
+        try:
+            crs, bounds, _ = self.describe_raster(path)
+        except RasterioIOError:
+            return None
+        name = os.path.basename(path)
+        return CatalogScene(path, name, name, "", crs, bounds, {("", ""): path}, {})
 
     def _run(self):
-        files = glob.glob(os.path.join(self.input_path, "*"))
-        for file in files:
+        if not self.mosaic:
+            self._run_files()
+            return
+        with self.profiler.stage("scan"):
+            groups = {}
+            for scene in self.catalog_scenes():
+                info = read_info(scene.path)
+                groups.setdefault(info.key, []).append(info)
+        date = os.path.basename(os.path.normpath(self.input_path))
+        shutil.rmtree(self.buffer_root, ignore_errors=True)
+        os.makedirs(self.buffer_root, exist_ok=True)
+        try:
+            for group_index, rasters in enumerate(groups.values()):
+                self.progress.set_step(group_index, len(groups), stage="mosaic", scene=f"{date} ({len(rasters)})")
+                vrt_path = os.path.join(self.buffer_root, f"mosaic_{group_index}.vrt")
+                with self.errors.scene(f"{date}_{group_index}"):
+                    try:
+                        with self.profiler.scene(f"{date}_{group_index}"):
+                            with self.profiler.stage("mosaic"):
+                                build_vrt(rasters, vrt_path)
+                            self.process_mosaic(vrt_path, "", date)
+                    except Exception:
+                        self.errors.record("scene_error", f"Exception in mosaic of {len(rasters)} rasters",
+                                           exc_info=True)
+        finally:
+            shutil.rmtree(self.buffer_root, ignore_errors=True)
+
+    def _run_files(self):
+        with self.profiler.stage("scan"):
+            files = [scene.path for scene in self.catalog_scenes()]
+        for file_index, file in enumerate(files):
+            self.progress.set_step(file_index, len(files), stage="decode", scene=os.path.basename(file))
+            with self.errors.scene(os.path.basename(file)):
+                try:
+                    with self.profiler.scene(os.path.basename(file)), \
+                            tempfile.NamedTemporaryFile(delete=False) as tmpfile:
+                        tmpfile.close()
+                        self.reproject_one(file, tmpfile.name)
+                        self.process_file(tmpfile.name, "", os.path.basename(file))
+                        os.unlink(tmpfile.name)
+                except Exception:
+                    self.errors.record("scene_error", f"Exception in file {file}", exc_info=True)
+
+    def process_mosaic(self, vrt_path: str, coefficient: str, date: str) -> None:
+        with rasterio.open(vrt_path) as src:
+            transform, width, height = calculate_default_transform(src.crs, self.crs, src.width, src.height,
+                                                                   *src.bounds)
+            transform, width, height = aligned_target(transform, width, height,
+                                                      self.expected_resolution * 9 / 1000000)
+        warp = {"crs": self.crs, "transform": transform, "width": width, "height": height,
+                "resampling": Resampling.bilinear}
+        if self.performance.warp_mem_limit:
+            warp["warp_mem_limit"] = self.performance.warp_mem_limit
+        tiles = []
+        for field_index in self.field_indices:
+            field_name, field_shape = self.match_fields[field_index], self.shapes[field_index]
             try:
-                with tempfile.NamedTemporaryFile(delete=False) as tmpfile:
-                    tmpfile.close()
-                    self.reproject_one(file, tmpfile.name)
-                    self.process_file(tmpfile.name, "", os.path.basename(file))
-                    os.unlink(tmpfile.name)
-            except Exception as e:
-                logger.exception(f"Error while processing file: {file}")
-                self.callback(f"Unexpected exception for file: {file}", callback_type="error")
+                window = from_bounds(*self.project.bounds[field_index], transform=transform)
+                window = window.round_offsets().round_lengths().intersection(Window(0, 0, width, height))
+            except WindowError:
+                self.errors.record("field_outside", f"Field {field_name} is not presented in {vrt_path}",
+                                   field=field_name)
+                continue
+            col_off, row_off = int(window.col_off), int(window.row_off)
+            col_end, row_end = col_off + int(window.width), row_off + int(window.height)
+            for row in range(row_off, row_end, MOSAIC_TILE_SIZE):
+                for col in range(col_off, col_end, MOSAIC_TILE_SIZE):
+                    tiles.append((field_name, field_shape, Window(col, row, min(MOSAIC_TILE_SIZE, col_end - col),
+                                                                  min(MOSAIC_TILE_SIZE, row_end - row))))
+        self.progress.update(stage="extract")
+        with ThreadPoolExecutor(max_workers=self.performance.warp_threads) as executor:
+            futures = [executor.submit(self._extract_tile, vrt_path, warp, coefficient, date, *tile) for tile in tiles]
+            for tile_index, future in enumerate(as_completed(futures)):
+                pixels = future.result()
+                self.progress.update((tile_index + 1) / len(futures), pixels=pixels, rows=pixels)
 
+    def _extract_tile(self, vrt_path: str, warp: dict, coefficient: str, date: str, field_name: str, field_shape,
+                      window: Window) -> int:
+        with self.performance.env(), rasterio.open(vrt_path) as src, WarpedVRT(src, **warp) as vrt:
+            with self.profiler.stage("warp"):
+                out_image = vrt.read(1, window=window, masked=True)
+            with self.profiler.stage("extract"):
+                out_transform = vrt.window_transform(window)
+                valid = geometry_mask([field_shape], out_shape=out_image.shape, transform=out_transform, invert=True)
+                x_points, y_points = np.where(valid & ~np.ma.getmaskarray(out_image))
+                if not len(x_points):
+                    return 0
+                x_coords, y_coords = rasterio.transform.xy(out_transform, x_points, y_points)
+                values = out_image.data[x_points, y_points]
+                data = np.array([np.round(x_coords, 6), np.round(y_coords, 6), values]).T
+                data = [(coefficient, field_name, date, x, y, val) for x, y, val in data]
+                if self.cube_writer:
+                    self.cube_writer.add(field_name, coefficient, date, x_coords, y_coords, values)
+                if self.composite_writer:
+                    self.composite_writer.add(field_name, coefficient, self.composite_date(date), x_coords, y_coords,
+                                              values)
+        self.profiler.count("pixels", len(data))
+        self.db_writer.insert(data)
+        self.profiler.count("rows_inserted", len(data))
+        return len(data)
@@ -0,0 +1,71 @@
+from typing import List, NamedTuple, Optional, Tuple
+from xml.etree import ElementTree
+
+import rasterio
+from affine import Affine
+
+GDAL_TYPES = {
+    "uint8": "Byte",
+    "int8": "Int8",
+    "uint16": "UInt16",
+    "int16": "Int16",
+    "uint32": "UInt32",
+    "int32": "Int32",
+    "float32": "Float32",
+    "float64": "Float64",
+}
+
+
+class RasterInfo(NamedTuple):
+    path: str
+    crs: str
+    transform: Affine
+    width: int
+    height: int
+    dtype: str
+    nodata: Optional[float]
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.crs, self.dtype
+
+
+def read_info(path: str) -> RasterInfo:
+    with rasterio.open(path) as src:
+        return RasterInfo(path, src.crs.to_wkt() if src.crs else "", src.transform, src.width, src.height,
+                          src.dtypes[0], src.nodata)
+
+
+def build_vrt(rasters: List[RasterInfo], vrt_path: str) -> None:
+    resolution_x = min(raster.transform.a for raster in rasters)
+    resolution_y = min(-raster.transform.e for raster in rasters)
+    west = min(raster.transform.c for raster in rasters)
+    north = max(raster.transform.f for raster in rasters)
+    east = max(raster.transform.c + raster.width * raster.transform.a for raster in rasters)
+    south = min(raster.transform.f + raster.height * raster.transform.e for raster in rasters)
+    width = int(round((east - west) / resolution_x))
+    height = int(round((north - south) / resolution_y))
+    nodata = next((raster.nodata for raster in rasters if raster.nodata is not None), None)
+
+    root = ElementTree.Element("VRTDataset", rasterXSize=str(width), rasterYSize=str(height))
+    ElementTree.SubElement(root, "SRS").text = rasters[0].crs
+    ElementTree.SubElement(root, "GeoTransform").text = ", ".join(
+        repr(value) for value in (west, resolution_x, 0.0, north, 0.0, -resolution_y))
+    # only the first band is extracted, as in the per-file path, so RGB orthophotos mosaic like single-band ones
+    band_element = ElementTree.SubElement(root, "VRTRasterBand", dataType=GDAL_TYPES[rasters[0].dtype], band="1")
+    if nodata is not None:
+        ElementTree.SubElement(band_element, "NoDataValue").text = repr(nodata)
+    for raster in rasters:
+        source = ElementTree.SubElement(band_element, "ComplexSource")
+        ElementTree.SubElement(source, "SourceFilename", relativeToVRT="0").text = raster.path
+        ElementTree.SubElement(source, "SourceBand").text = "1"
+        ElementTree.SubElement(source, "SrcRect", xOff="0", yOff="0", xSize=str(raster.width),
+                               ySize=str(raster.height))
+        ElementTree.SubElement(source, "DstRect",
+                               xOff=repr((raster.transform.c - west) / resolution_x),
+                               yOff=repr((north - raster.transform.f) / resolution_y),
+                               xSize=repr(raster.width * raster.transform.a / resolution_x),
+                               ySize=repr(-raster.height * raster.transform.e / resolution_y))
+        if raster.nodata is not None:
+            ElementTree.SubElement(source, "NODATA").text = repr(raster.nodata)
+    ElementTree.ElementTree(root).write(vrt_path)
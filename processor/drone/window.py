@@ -2,12 +2,15 @@ import logging
 from functools import partial
 
 from PyQt5.QtWidgets import (QWidget, QPushButton, QGridLayout, QLineEdit, QStatusBar,
-                             QFileDialog, QLabel, QSpinBox, QVBoxLayout, QSizePolicy)
-from PyQt5.QtCore import QThread, QObject, pyqtSignal
+                             QFileDialog, QLabel, QComboBox, QSpinBox, QVBoxLayout, QSizePolicy, QCheckBox)
+from PyQt5.QtCore import QObject, pyqtSignal
 from PyQt5.QtGui import QIntValidator
 
+from const import COMPOSITE_PERIODS, CHIP_CACHE_MB
 from .communicator import DroneProcessor
-from processor.worker import Worker
+from processor.performance import PERFORMANCE_PROFILES
+from processor.progress import format_status
+from processor.jobs.scheduler import job_queue
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +19,6 @@ logger = logging.getLogger(__name__)
 class DroneTab(QWidget):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.new_thread = None
-        self.error_state = False
 
         self.main_layout = QVBoxLayout(self)
 
@@ -69,9 +70,36 @@ class DroneTab(QWidget):
         self.expected_resolution_line.setSingleStep(1)
         self.layout.addWidget(self.expected_resolution_line, 5, 1, 1, 1)
 
+        self.mosaic_checkbox = QCheckBox("Объединить снимки полёта в мозаику (дата — имя папки)", self.widget)
+        self.mosaic_checkbox.setChecked(False)
+        self.layout.addWidget(self.mosaic_checkbox, 6, 0, 1, 2)
+
+        self.performance_label = QLabel(self.widget)
+        self.performance_label.setText("Профиль производительности")
+        self.layout.addWidget(self.performance_label, 7, 0, 1, 1)
+        self.performance_line = QComboBox(self.widget)
+        for profile_name, profile in PERFORMANCE_PROFILES.items():
+            self.performance_line.addItem(profile.title, profile_name)
+        self.layout.addWidget(self.performance_line, 7, 1, 1, 1)
+
+        self.cube_checkbox = QCheckBox("Сохранять куб временных рядов для обучения", self.widget)
+        self.layout.addWidget(self.cube_checkbox, 8, 0, 1, 2)
+
+        self.composite_label = QLabel(self.widget)
+        self.composite_label.setText("Композиты по периодам")
+        self.layout.addWidget(self.composite_label, 9, 0, 1, 1)
+        self.composite_line = QComboBox(self.widget)
+        self.composite_line.addItem("Не считать", None)
+        for period_name, period_title in COMPOSITE_PERIODS.items():
+            self.composite_line.addItem(period_title, period_name)
+        self.layout.addWidget(self.composite_line, 9, 1, 1, 1)
+
+        self.chip_cache_checkbox = QCheckBox("Кэшировать перепроецированные снимки для повторных запусков", self.widget)
+        self.layout.addWidget(self.chip_cache_checkbox, 10, 0, 1, 2)
+
         self.start_button = QPushButton("Начать", self.widget)
         self.start_button.clicked.connect(self.start_button_clicked)
-        self.layout.addWidget(self.start_button, 6, 0, 1, 2)
+        self.layout.addWidget(self.start_button, 11, 0, 1, 2)
 
     def message(self, text, time=0):
         self.status_bar.showMessage(text, time)
@@ -109,33 +137,26 @@ class DroneTab(QWidget):
                 "output_path": output,
                 "shape_index": int(index),
                 "expected_resolution": expected_resolution,
+                "mosaic": self.mosaic_checkbox.isChecked(),
+                "performance_profile": self.performance_line.currentData(),
+                "cube": self.cube_checkbox.isChecked(),
+                "composite": self.composite_line.currentData(),
+                "chip_cache_mb": CHIP_CACHE_MB if self.chip_cache_checkbox.isChecked() else 0,
             }
-            self.new_thread = QThread()
-            worker = Worker(DroneProcessor)
-            worker.moveToThread(self.new_thread)
-            self.new_thread.started.connect(partial(worker.run, data))
-            worker.finished.connect(self.new_thread.quit)
-            worker.finished.connect(self.finished_function)
-            worker.progressChanged.connect(self.progress_changed)
-            worker.errorRaised.connect(self.error_raised)
-            self.new_thread.finished.connect(worker.deleteLater)
-            self.new_thread.finished.connect(self.new_thread.deleteLater)
-            self.new_thread.start()
-            self.start_button.setText("Идет обработка...")
-            self.start_button.setEnabled(False)
-
-    def progress_changed(self, percent):
-        self.message(f"Завершено на {percent}%")
-
-    def error_raised(self, message):
-        self.error_state = True
-
-    def finished_function(self):
-        self.new_thread.quit()
-        self.start_button.setText("Начать")
-        self.start_button.setEnabled(True)
-        if self.error_state:
-            self.message("Обработка завершена с ошибками", 3000)
-            self.error_state = False
+            job = job_queue().submit(DroneProcessor, data, "Drone")
+            job.worker.finished.connect(partial(self.finished_function, job))
+            job.worker.progressChanged.connect(partial(self.progress_changed, job))
+            job.worker.statusChanged.connect(partial(self.status_changed, job))
+            self.message(f"Задача №{job.id} добавлена в очередь", 3000)
+
+    def progress_changed(self, job, percent):
+        self.message(f"Задача №{job.id}: завершено на {percent}%")
+
+    def status_changed(self, job, status):
+        self.message(f"Задача №{job.id}: {format_status(status)}")
+
+    def finished_function(self, job):
+        if job.errors:
+            self.message(f"Задача №{job.id}: обработка завершена с ошибками", 3000)
         else:
-            self.message("Обработка завершена", 3000)
+            self.message(f"Задача №{job.id}: обработка завершена", 3000)
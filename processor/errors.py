@@ -0,0 +1,88 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import traceback
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+
+from const import ERROR_TRACEBACK_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+ERRORS_FILE = "errors.json"
+EXPECTED_ERRORS = {"field_outside"}
+
+
+class ErrorReport:
+    def __init__(self, callback: Callable, samples: int = ERROR_TRACEBACK_SAMPLES):
+        self.callback = callback
+        self.samples = samples
+        self.kinds: Counter = Counter()
+        self.scenes: Dict[Optional[str], Counter] = defaultdict(Counter)
+        self.fields: Dict[str, Counter] = defaultdict(Counter)
+        self.sampled: Dict[str, List[dict]] = defaultdict(list)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def current_scene(self) -> Optional[str]:
+        return getattr(self._local, "scene", None)
+
+    @property
+    def total(self) -> int:
+        return sum(count for kind, count in self.kinds.items() if kind not in EXPECTED_ERRORS)
+
+    @contextlib.contextmanager
+    def scene(self, name: str):
+        previous = self.current_scene
+        self._local.scene = name
+        try:
+            yield
+        finally:
+            self._local.scene = previous
+            self.summarize(name)
+
+    def record(self, kind: str, message: str, field: Optional[str] = None, scene: Optional[str] = None,
+               exc_info: bool = False) -> None:
+        immediate = self.current_scene is None
+        scene = scene or self.current_scene
+        with self._lock:
+            self.kinds[kind] += 1
+            self.scenes[scene][kind] += 1
+            if field is not None:
+                self.fields[field][kind] += 1
+            sampled = len(self.sampled[kind]) < self.samples
+            if sampled:
+                self.sampled[kind].append({"scene": scene, "field": field, "message": message,
+                                           "traceback": traceback.format_exc() if exc_info else None})
+        if sampled and kind not in EXPECTED_ERRORS:
+            logger.error(message, exc_info=exc_info)
+        else:
+            logger.debug(message)
+        if immediate and kind not in EXPECTED_ERRORS:
+            self.callback(message, callback_type="error")
+
+    def summarize(self, scene: str) -> None:
+        with self._lock:
+            kinds = dict(self.scenes.get(scene, {}))
+        if not kinds:
+            return
+        text = ", ".join(f"{count} {kind}" for kind, count in sorted(kinds.items()))
+        logger.info(f"Scene {scene}: {text}")
+        if any(kind not in EXPECTED_ERRORS for kind in kinds):
+            self.callback(f"Scene {scene}: {text}", callback_type="error")
+
+    def write(self, output_path: str) -> None:
+        with self._lock:
+            report = {
+                "total": self.total,
+                "expected": sorted(EXPECTED_ERRORS),
+                "kinds": dict(self.kinds),
+                "scenes": {scene or "": dict(kinds) for scene, kinds in self.scenes.items()},
+                "fields": {field: dict(kinds) for field, kinds in self.fields.items()},
+                "samples": dict(self.sampled),
+            }
+        with open(os.path.join(output_path, ERRORS_FILE), "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, ensure_ascii=False, indent=1)
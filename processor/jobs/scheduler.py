@@ -0,0 +1,175 @@
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import List, Optional, Type
+
+import psutil
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from const import JOB_MAX_CONCURRENT, JOB_MEMORY_MB, MEMORY_BUDGET_FRACTION
+from processor.communicator import AbstractProcessor
+from processor.memory import MB
+from processor.performance import PERFORMANCE_PROFILES
+from processor.worker import Worker
+
+logger = logging.getLogger(__name__)
+
+
+def _output_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+@dataclass
+class Job:
+    id: int
+    title: str
+    processor_type: Type[AbstractProcessor]
+    data: dict
+    worker: Worker
+    cpu: int
+    memory_mb: int
+    state: str = "queued"
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    progress: int = 0
+    errors: int = 0
+    message: str = ""
+    thread: Optional[QThread] = None
+
+    @property
+    def output_path(self) -> str:
+        return self.data["output_path"]
+
+    @property
+    def waited(self) -> Optional[float]:
+        return (self.started or time.time()) - self.submitted if self.state != "cancelled" else None
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+
+class JobQueue(QObject):
+    jobChanged = pyqtSignal(object)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.jobs: List[Job] = []
+        self.max_jobs = JOB_MAX_CONCURRENT
+        self.cpu_limit = os.cpu_count() or 1
+        self.memory_limit_mb = int(psutil.virtual_memory().total * MEMORY_BUDGET_FRACTION) // MB
+        self.job_memory_mb = min(JOB_MEMORY_MB, self.memory_limit_mb)
+        self._next_id = 1
+
+    def set_limits(self, max_jobs: int, cpu_limit: int, memory_limit_mb: int, job_memory_mb: int) -> None:
+        self.max_jobs, self.cpu_limit, self.memory_limit_mb = max_jobs, cpu_limit, memory_limit_mb
+        self.job_memory_mb = job_memory_mb
+        self.schedule()
+
+    def submit(self, processor_type: Type[AbstractProcessor], data: dict, title: str) -> Job:
+        profile = PERFORMANCE_PROFILES[data.get("performance_profile", "default")]
+        data = dict(data)
+        data.setdefault("memory_budget_mb", min(self.job_memory_mb, self.memory_limit_mb))
+        data.setdefault("profile", True)  # every GUI run writes run_report.json with per-stage peak memory
+        job = Job(self._next_id, title, processor_type, data, Worker(processor_type),
+                  cpu=max(profile.decode_threads, profile.warp_threads, 1), memory_mb=data["memory_budget_mb"])
+        self._next_id += 1
+        job.worker.progressChanged.connect(partial(self._job_progress, job))
+        job.worker.errorRaised.connect(partial(self._job_error, job))
+        job.worker.failed.connect(partial(self._job_failed, job))
+        job.worker.cancelled.connect(partial(self._job_cancelled, job))
+        job.worker.finished.connect(partial(self._job_finished, job))
+        self.jobs.append(job)
+        logger.info(f"Job {job.id} ({title}) queued for {job.output_path}")
+        self.jobChanged.emit(job)
+        self.schedule()
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        if job.state == "running":
+            # the child process is terminated, the job becomes cancelled once the worker returns
+            job.worker.terminate()
+            return True
+        if job.state != "queued":
+            return False
+        job.state = "cancelled"
+        job.worker.deleteLater()
+        self.jobChanged.emit(job)
+        self.schedule()
+        return True
+
+    def clear_finished(self) -> None:
+        self.jobs = [job for job in self.jobs if job.state in ("queued", "running")]
+
+    def schedule(self) -> None:
+        running = [job for job in self.jobs if job.state == "running"]
+        busy_outputs = {_output_key(job.output_path) for job in running}
+        cpu = sum(job.cpu for job in running)
+        memory = sum(job.memory_mb for job in running)
+        for job in self.jobs:
+            if job.state != "queued":
+                continue
+            output = _output_key(job.output_path)
+            if output in busy_outputs:
+                continue
+            busy_outputs.add(output)
+            if len(running) >= self.max_jobs:
+                break
+            if running and (cpu + job.cpu > self.cpu_limit or memory + job.memory_mb > self.memory_limit_mb):
+                break
+            self._start(job)
+            running.append(job)
+            cpu += job.cpu
+            memory += job.memory_mb
+
+    def _start(self, job: Job) -> None:
+        logger.info(f"Job {job.id} ({job.title}) started")
+        job.state = "running"
+        job.started = time.time()
+        job.thread = QThread(self)
+        job.worker.moveToThread(job.thread)
+        job.thread.started.connect(partial(job.worker.run, job.data))
+        job.worker.finished.connect(job.thread.quit)
+        job.thread.finished.connect(job.worker.deleteLater)
+        job.thread.finished.connect(job.thread.deleteLater)
+        job.thread.start()
+        self.jobChanged.emit(job)
+
+    def _job_progress(self, job: Job, percent: int) -> None:
+        job.progress = percent
+        self.jobChanged.emit(job)
+
+    def _job_error(self, job: Job, message: str) -> None:
+        job.errors += 1
+        job.message = message
+
+    def _job_failed(self, job: Job, message: str) -> None:
+        job.state = "failed"
+        job.message = message
+
+    def _job_cancelled(self, job: Job) -> None:
+        job.state = "cancelled"
+        job.message = "Остановлена пользователем"
+
+    def _job_finished(self, job: Job) -> None:
+        if job.state == "running":
+            job.state = "finished"
+        job.finished = time.time()
+        logger.info(f"Job {job.id} ({job.title}) {job.state} in {job.elapsed:.1f}s with {job.errors} errors")
+        self.jobChanged.emit(job)
+        self.schedule()
+
+
+_queue: Optional[JobQueue] = None
+
+
+def job_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        _queue = JobQueue()
+    return _queue
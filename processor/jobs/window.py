@@ -0,0 +1,126 @@
+import logging
+import os
+import time
+
+from PyQt5.QtWidgets import (QWidget, QPushButton, QGridLayout, QLabel, QSpinBox, QVBoxLayout, QHBoxLayout,
+                             QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView)
+from PyQt5.QtCore import QTimer
+
+from const import JOB_STATES
+from processor.progress import format_duration
+from .scheduler import job_queue
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = ["№", "Задача", "Папка результата", "Статус", "Прогресс", "Память, МБ", "Добавлена", "Ожидание",
+               "Длительность", "Ошибки"]
+
+
+class JobsTab(QWidget):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queue = job_queue()
+
+        self.main_layout = QVBoxLayout(self)
+
+        self.limits_layout = QGridLayout()
+        self.main_layout.addLayout(self.limits_layout)
+
+        self.max_jobs_label = QLabel("Одновременно задач", self)
+        self.limits_layout.addWidget(self.max_jobs_label, 0, 0, 1, 1)
+        self.max_jobs_line = QSpinBox(self)
+        self.max_jobs_line.setRange(1, 64)
+        self.max_jobs_line.setValue(self.queue.max_jobs)
+        self.limits_layout.addWidget(self.max_jobs_line, 0, 1, 1, 1)
+
+        self.cpu_label = QLabel("Потоков CPU", self)
+        self.limits_layout.addWidget(self.cpu_label, 1, 0, 1, 1)
+        self.cpu_line = QSpinBox(self)
+        self.cpu_line.setRange(1, max(256, self.queue.cpu_limit))
+        self.cpu_line.setValue(self.queue.cpu_limit)
+        self.limits_layout.addWidget(self.cpu_line, 1, 1, 1, 1)
+
+        self.memory_label = QLabel("Память, МБ", self)
+        self.limits_layout.addWidget(self.memory_label, 2, 0, 1, 1)
+        self.memory_line = QSpinBox(self)
+        self.memory_line.setRange(256, max(1 << 20, self.queue.memory_limit_mb))
+        self.memory_line.setSingleStep(512)
+        self.memory_line.setValue(self.queue.memory_limit_mb)
+        self.limits_layout.addWidget(self.memory_line, 2, 1, 1, 1)
+
+        self.job_memory_label = QLabel("Бюджет памяти задачи, МБ", self)
+        self.limits_layout.addWidget(self.job_memory_label, 3, 0, 1, 1)
+        self.job_memory_line = QSpinBox(self)
+        self.job_memory_line.setRange(256, max(1 << 20, self.queue.memory_limit_mb))
+        self.job_memory_line.setSingleStep(512)
+        self.job_memory_line.setValue(self.queue.job_memory_mb)
+        self.limits_layout.addWidget(self.job_memory_line, 3, 1, 1, 1)
+
+        for line in (self.max_jobs_line, self.cpu_line, self.memory_line, self.job_memory_line):
+            line.valueChanged.connect(self.limits_changed)
+
+        self.table = QTableWidget(0, len(JOB_COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(JOB_COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.main_layout.addWidget(self.table)
+
+        self.button_layout = QHBoxLayout()
+        self.main_layout.addLayout(self.button_layout)
+        self.cancel_button = QPushButton("Отменить", self)
+        self.cancel_button.clicked.connect(self.cancel_button_clicked)
+        self.button_layout.addWidget(self.cancel_button)
+        self.clear_button = QPushButton("Очистить завершенные", self)
+        self.clear_button.clicked.connect(self.clear_button_clicked)
+        self.button_layout.addWidget(self.clear_button)
+
+        self.queue.jobChanged.connect(self.refresh)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+
+    def limits_changed(self):
+        self.queue.set_limits(self.max_jobs_line.value(), self.cpu_line.value(), self.memory_line.value(),
+                              self.job_memory_line.value())
+
+    def refresh(self, *args):
+        jobs = self.queue.jobs
+        self.table.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            values = [
+                str(job.id),
+                job.title,
+                job.output_path,
+                JOB_STATES[job.state],
+                f"{job.progress}%",
+                str(job.memory_mb),
+                time.strftime("%H:%M:%S", time.localtime(job.submitted)),
+                format_duration(job.waited),
+                format_duration(job.elapsed),
+                str(job.errors),
+            ]
+            for column, value in enumerate(values):
+                item = self.table.item(row, column)
+                if item is None:
+                    item = QTableWidgetItem()
+                    self.table.setItem(row, column, item)
+                if item.text() != value:
+                    item.setText(value)
+            self.table.item(row, 2).setToolTip(os.path.abspath(job.output_path))
+            self.table.item(row, 3).setToolTip(job.message)
+
+    def selected_jobs(self):
+        rows = {index.row() for index in self.table.selectionModel().selectedRows()}
+        return [job for row, job in enumerate(self.queue.jobs) if row in rows]
+
+    def cancel_button_clicked(self):
+        for job in self.selected_jobs():
+            self.queue.cancel(job)
+
+    def clear_button_clicked(self):
+        self.queue.clear_finished()
+        self.table.clearSelection()
+        self.refresh()
@@ -1,93 +1,113 @@
-import glob
 import json
 import logging
 import os
 import pathlib
 import re
-import shutil
-from typing import List, Sequence, Callable, Dict
+from typing import List, Sequence, Callable, Dict, Optional, Literal, Tuple
 
 import rasterio
 
-from processor.communicator import AbstractProcessor
-from .const import FORMULAS
+from processor.archive import archive_path, file_size, is_archive, join, open_file, physical_path
+from processor.catalog import CatalogScene
+from processor.communicator import AbstractProcessor, Scene
+from .const import FORMULAS, QA_PIXEL_FILL, QA_PIXEL_CLOUD, PRODUCT_PATTERN
 
 logger = logging.getLogger(__name__)
 
 
 class LandsatProcessor(AbstractProcessor):
+    catalog_kind = "landsat"
     coefficients: List[str]
-    directories: List[str]
+    directories: List[CatalogScene]
+    bands: Dict[str, Dict[Tuple[str, str], str]]
 
     def __init__(self, input_path: str, output_path: str, shape_path: str, expected_resolution: int,
                  fields_whitelist: Sequence[str], match_fields: Dict[int, str], coefficients: List[str],
-                 callback: Callable):
+                 callback: Callable, cloud_threshold: Optional[float] = None,
+                 cloud_filter: Literal["metadata", "overview"] = "metadata", **kwargs):
         super().__init__(input_path, output_path, shape_path, expected_resolution, fields_whitelist, match_fields,
-                         callback)
+                         callback, **kwargs)
         self.coefficients = coefficients
+        self.cloud_threshold = cloud_threshold
+        self.cloud_filter = cloud_filter
         self.directories = []
+        self.bands = {}
+
+    def discover_scenes(self, root):
+        scenes = []
+        for entry in os.scandir(root):
+            if entry.is_dir() and re.fullmatch(PRODUCT_PATTERN, entry.name):
+                scenes.append(entry.path)
+            elif re.fullmatch(PRODUCT_PATTERN, os.path.splitext(entry.name)[0]) and is_archive(entry.path):
+                scenes.append(archive_path(entry.path))
+        return scenes
+
+    def describe_scene(self, path):
+        name = os.path.splitext(os.path.basename(physical_path(path)))[0]
+        with open_file(join(path, name + "_MTL.json")) as metadata_file:
+            metadata = json.load(metadata_file)["LANDSAT_METADATA_FILE"]
+        bands = {(key[len("FILE_NAME_"):], ""): join(path, filename)
+                 for key, filename in metadata["PRODUCT_CONTENTS"].items()
+                 if key.startswith("FILE_NAME_") and filename.upper().endswith(".TIF")}
+        crs, bounds, native_bounds = None, None, None
+        if bands:
+            crs, bounds, native_bounds = self.describe_raster(bands.get(("BAND_4", ""), bands[min(bands)]))
+        return CatalogScene(path, name, metadata["IMAGE_ATTRIBUTES"]["DATE_ACQUIRED"], name.split("_")[2], crs, bounds,
+                            bands, metadata, native_bounds)
 
     def parse_directories(self):
-        processing_directories = glob.glob(os.path.join(self.input_path, "*"))
-        for directory in processing_directories:
-            directory_name = os.path.basename(directory)
-            if re.fullmatch(r"L.{3}_.{4}_\d{6}_\d{8}_\d{8}_\d{2}_.{2}", directory_name):
-                self.directories.append(directory)
+        for scene in self.catalog_scenes():
+            self.directories.append(scene)
+            self.bands[scene.path] = scene.bands
 
     def get_coefficient_path(self, directory, coefficient, *args, **kwargs):
         if 'metadata' in kwargs:
             metadata = kwargs['metadata']
         else:
             metadata = args[0]
-        filename = metadata["PRODUCT_CONTENTS"].get(f"FILE_NAME_{coefficient}")
+        filename = self.bands.get(directory, {}).get((coefficient, ""))
         if filename:
-            filename = os.path.join(directory, filename)
             if coefficient.startswith("BAND"):
                 output_filename = os.path.join(self.buffer_path, os.path.basename(filename))
                 if os.path.isfile(output_filename):
                     return output_filename
-                with rasterio.open(filename) as dataset:
-                    meta = dataset.meta.copy()
-                    meta["driver"] = "GTiff"
-                    meta["dtype"] = "float32"
-                    with rasterio.open(output_filename, 'w', **meta) as output:
-                        output.write(dataset.read(1).astype("float32") * 0.0000275 - 0.2, 1)
-                return output_filename
+
+                def scale():
+                    with rasterio.open(filename) as dataset:
+                        self.write_decimated(dataset, output_filename,
+                                             lambda data: data.astype("float32") * 0.0000275 - 0.2, driver="GTiff",
+                                             dtype="float32")
+                    self.profiler.count("bytes_read", file_size(filename))
+
+                return self.derive(output_filename, [filename], "scale 0.0000275 -0.2", scale)
             return filename
         if coefficient in FORMULAS:
             return self.get_calculation_coefficient_path(FORMULAS[coefficient], directory, coefficient, metadata)
         return None
 
+    def get_scene_cloud_cover(self, directory, *args, **kwargs):
+        if 'metadata' in kwargs:
+            metadata = kwargs['metadata']
+        else:
+            metadata = args[0]
+        if self.cloud_filter == "overview":
+            filename = self.bands.get(directory, {}).get(("QUALITY_L1_PIXEL", ""))
+            if not filename:
+                return None
+            return self.estimate_aoi_cloud_cover(filename,
+                                                 lambda data: (data & QA_PIXEL_CLOUD) != 0,
+                                                 lambda data: (data & QA_PIXEL_FILL) == 0)
+        cloud = float(metadata["IMAGE_ATTRIBUTES"].get("CLOUD_COVER_LAND", -1))
+        if cloud < 0:
+            return None
+        return cloud
+
     def _run(self):
-        self.parse_directories()
+        with self.profiler.stage("scan"):
+            self.parse_directories()
         for coefficient in self.coefficients:
             path = os.path.join(self.output_path, coefficient)
             pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-        try:
-            for directory_index, directory in enumerate(self.directories):
-                try:
-                    shutil.rmtree(self.buffer_path, ignore_errors=True)
-                    os.makedirs(self.buffer_path)
-
-                    dir_name = os.path.basename(directory)
-                    with open(os.path.join(directory, dir_name + "_MTL.json")) as metadata_file:
-                        metadata = json.load(metadata_file)["LANDSAT_METADATA_FILE"]
-                    date = metadata["IMAGE_ATTRIBUTES"]["DATE_ACQUIRED"]
-
-                    for coefficient_index, coefficient in enumerate(self.coefficients):
-                        self.callback(100 * (directory_index * len(self.coefficients) + coefficient_index) // (
-                                len(self.directories) * len(self.coefficients)), callback_type="percent")
-                        path = self.get_coefficient_path(directory, coefficient, metadata)
-                        if not path:
-                            continue
-                        reprojected_path = os.path.join(self.buffer_path, coefficient + "_proc.tif")
-                        self.reproject_one(path, reprojected_path)
-                        self.process_file(reprojected_path, coefficient, date)
-                except Exception as e:
-                    logger.exception(f"Landsat exception in directory {directory}")
-                    self.callback(f"Exception in directory {directory}", callback_type="error")
-                    continue
-        except Exception:
-            logger.exception("LandsatProcessor exception")
-            self.callback("Unexpected exception", callback_type="error")
-        shutil.rmtree(self.buffer_path, ignore_errors=True)
+        scenes = [Scene(directory.name, directory.path, directory.date, (directory.metadata,),
+                        directory.native_bounds, directory.crs) for directory in self.directories]
+        self.run_scenes(scenes, self.coefficients)
@@ -4,3 +4,6 @@ FORMULAS = {
     "EVI": "2.5 * (BAND_5 - BAND_4) / (BAND_5 + 6 * BAND_4 - 7.5 * BAND_2 + 1)",
     "NDWI-Green": "(BAND_3 - BAND_5) / (BAND_3 + BAND_5)",
 }
+QA_PIXEL_FILL = 0b1
+QA_PIXEL_CLOUD = 0b11110
+PRODUCT_PATTERN = r"L.{3}_.{4}_\d{6}_\d{8}_\d{8}_\d{2}_.{2}"
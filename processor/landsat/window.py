@@ -1,15 +1,18 @@
 import logging
 from functools import partial
 
-from PyQt5.QtWidgets import (QWidget, QPushButton, QGridLayout, QLineEdit, QStatusBar,
-                             QFileDialog, QHBoxLayout, QLabel, QSpinBox, QVBoxLayout, QSizePolicy)
-from PyQt5.QtCore import QThread, QObject, pyqtSignal
-import openpyxl
+from PyQt5.QtWidgets import (QWidget, QPushButton, QGridLayout, QLineEdit, QStatusBar, QCheckBox,
+                             QFileDialog, QHBoxLayout, QLabel, QComboBox, QSpinBox, QVBoxLayout, QSizePolicy)
+from PyQt5.QtCore import QObject, pyqtSignal
 
+from const import OVERLAP_RULES, COMPOSITE_PERIODS, CHIP_CACHE_MB
 from widgets import CheckboxListWidget
 from .const import LANDSAT_COEFFICIENT_NAMES
 from .communicator import LandsatProcessor
-from processor.worker import Worker
+from processor.performance import PERFORMANCE_PROFILES
+from processor.progress import format_status
+from processor.matching import MATCH_FILE_FILTER, match_loader
+from processor.jobs.scheduler import job_queue
 
 logger = logging.getLogger(__name__)
 
@@ -17,8 +20,6 @@ logger = logging.getLogger(__name__)
 class LandsatTab(QWidget):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.new_thread = None
-        self.error_state = False
 
         self.main_layout = QVBoxLayout(self)
 
@@ -64,8 +65,12 @@ class LandsatTab(QWidget):
         self.match_button.clicked.connect(self.match_button_clicked)
         self.layout.addWidget(self.match_button, 3, 1, 1, 1)
 
-        self.match_hash = 0
+        self.match_line.editingFinished.connect(self.request_match_data)
+        self.match_key = None
         self.match_data = {}
+        self.match_pending = None
+        match_loader().loaded.connect(self.match_loaded)
+        match_loader().failed.connect(self.match_failed)
 
         self.expected_resolution_label = QLabel(self.widget)
         self.expected_resolution_label.setText("Ожидаемое разрешение в метрах")
@@ -76,8 +81,20 @@ class LandsatTab(QWidget):
         self.expected_resolution_line.setSingleStep(10)
         self.layout.addWidget(self.expected_resolution_line, 4, 1, 1, 1)
 
+        self.cloud_threshold_label = QLabel(self.widget)
+        self.cloud_threshold_label.setText("Максимальная облачность сцены, %")
+        self.layout.addWidget(self.cloud_threshold_label, 5, 0, 1, 1)
+        self.cloud_threshold_line = QSpinBox(self.widget)
+        self.cloud_threshold_line.setRange(0, 100)
+        self.cloud_threshold_line.setValue(100)
+        self.cloud_threshold_line.setSingleStep(5)
+        self.layout.addWidget(self.cloud_threshold_line, 5, 1, 1, 1)
+
+        self.cloud_overview_check = QCheckBox("Оценивать облачность по маске над полями", self.widget)
+        self.layout.addWidget(self.cloud_overview_check, 6, 0, 1, 2)
+
         self.choice_button_layout = QHBoxLayout()
-        self.layout.addLayout(self.choice_button_layout, 5, 0, 1, 2)
+        self.layout.addLayout(self.choice_button_layout, 7, 0, 1, 2)
 
         self.field_choice_button = QPushButton("Поля", self.widget)
         self.field_choice_button.clicked.connect(self.field_choice_button_clicked)
@@ -90,18 +107,67 @@ class LandsatTab(QWidget):
         self.coefficient_choice_widget = CheckboxListWidget(self.widget)
         self.coefficient_choice_widget.set_choices(choices=LANDSAT_COEFFICIENT_NAMES)
 
+        self.overlap_label = QLabel(self.widget)
+        self.overlap_label.setText("Поля в перекрытии снимков одной даты")
+        self.layout.addWidget(self.overlap_label, 8, 0, 1, 1)
+        self.overlap_line = QComboBox(self.widget)
+        for rule_name, rule_title in OVERLAP_RULES.items():
+            self.overlap_line.addItem(rule_title, rule_name)
+        self.layout.addWidget(self.overlap_line, 8, 1, 1, 1)
+
+        self.performance_label = QLabel(self.widget)
+        self.performance_label.setText("Профиль производительности")
+        self.layout.addWidget(self.performance_label, 9, 0, 1, 1)
+        self.performance_line = QComboBox(self.widget)
+        for profile_name, profile in PERFORMANCE_PROFILES.items():
+            self.performance_line.addItem(profile.title, profile_name)
+        self.layout.addWidget(self.performance_line, 9, 1, 1, 1)
+
+        self.cube_checkbox = QCheckBox("Сохранять куб временных рядов для обучения", self.widget)
+        self.layout.addWidget(self.cube_checkbox, 10, 0, 1, 2)
+
+        self.composite_label = QLabel(self.widget)
+        self.composite_label.setText("Композиты по периодам")
+        self.layout.addWidget(self.composite_label, 11, 0, 1, 1)
+        self.composite_line = QComboBox(self.widget)
+        self.composite_line.addItem("Не считать", None)
+        for period_name, period_title in COMPOSITE_PERIODS.items():
+            self.composite_line.addItem(period_title, period_name)
+        self.layout.addWidget(self.composite_line, 11, 1, 1, 1)
+
+        self.chip_cache_checkbox = QCheckBox("Кэшировать перепроецированные снимки для повторных запусков", self.widget)
+        self.layout.addWidget(self.chip_cache_checkbox, 12, 0, 1, 2)
+
         self.start_button = QPushButton("Начать", self.widget)
         self.start_button.clicked.connect(self.start_button_clicked)
-        self.layout.addWidget(self.start_button, 6, 0, 1, 2)
+        self.layout.addWidget(self.start_button, 13, 0, 1, 2)
 
-    def load_match_data(self):
+    def request_match_data(self, pending=None):
         match_path = self.match_line.text()
-        self.match_hash = hash(match_path)
-        self.match_data = {}
-        wb: openpyxl.workbook.Workbook = openpyxl.load_workbook(match_path, read_only=True)
-        sheet = wb.active
-        for row in sheet.rows:
-            self.match_data[int(row[0].value)] = str(row[1].value)
+        if not match_path:
+            return
+        if pending is not None:
+            self.match_pending = pending
+        self.message("Загрузка файла сопоставления...")
+        match_loader().load(match_path)
+
+    def match_loaded(self, match_path, key, match_data):
+        if match_path != self.match_line.text():
+            return
+        if key != self.match_key:
+            self.match_key = key
+            self.match_data = match_data
+            self.field_choice_widget.set_choices(sorted(set(match_data.values())))
+        self.message("Файл сопоставления загружен", 3000)
+        pending, self.match_pending = self.match_pending, None
+        if pending is not None:
+            pending()
+
+    def match_failed(self, match_path, error):
+        if match_path != self.match_line.text():
+            return
+        self.match_pending = None
+        self.message(f"Ошибка: не удалось прочитать файл сопоставления: {error}", 5000)
 
     def message(self, text, time=0):
         self.status_bar.showMessage(text, time)
@@ -123,17 +189,18 @@ class LandsatTab(QWidget):
         if not match_path:
             self.message("Ошибка: файл для сопоставления не выбран", 3000)
             return
-        if self.match_hash != hash(match_path):
-            self.load_match_data()
-            self.field_choice_widget.set_choices(sorted(set(self.match_data.values())))
+        if not match_loader().is_current(match_path, self.match_key):
+            self.request_match_data(self.field_choice_widget.exec)
+            return
         self.field_choice_widget.exec()
 
     def coefficient_choice_button_clicked(self):
         self.coefficient_choice_widget.exec()
 
     def match_button_clicked(self):
-        directory = QFileDialog.getOpenFileName(self, "Выбрать Excel-файл", filter="Excel-файл (*.xls, *.xlsx)")
+        directory = QFileDialog.getOpenFileName(self, "Выбрать файл сопоставления", filter=MATCH_FILE_FILTER)
         self.match_line.setText(directory[0])
+        self.request_match_data()
 
     def start_button_clicked(self):
         directory = self.directory_line.text()
@@ -143,6 +210,7 @@ class LandsatTab(QWidget):
         coefficients = self.coefficient_choice_widget.selected_item_texts()
         match = self.match_line.text()
         expected_resolution = self.expected_resolution_line.value()
+        cloud_threshold = self.cloud_threshold_line.value()
         if directory == "":
             self.message("Ошибка: папка с исходными данными не выбрана", 3000)
         elif shape == "":
@@ -152,10 +220,9 @@ class LandsatTab(QWidget):
         elif match == "":
             pass
         else:
-            if self.match_hash != hash(match):
-                self.load_match_data()
-                self.field_choice_widget.set_choices(sorted(set(self.match_data.values())))
-                fields = self.field_choice_widget.selected_item_texts()
+            if not match_loader().is_current(match, self.match_key):
+                self.request_match_data(self.start_button_clicked)
+                return
             data = {
                 "input_path": directory,
                 "shape_path": shape,
@@ -164,33 +231,28 @@ class LandsatTab(QWidget):
                 "coefficients": coefficients,
                 "match_fields": self.match_data,
                 "expected_resolution": expected_resolution,
+                "performance_profile": self.performance_line.currentData(),
+                "overlap_rule": self.overlap_line.currentData(),
+                "cube": self.cube_checkbox.isChecked(),
+                "composite": self.composite_line.currentData(),
+                "chip_cache_mb": CHIP_CACHE_MB if self.chip_cache_checkbox.isChecked() else 0,
+                "cloud_threshold": cloud_threshold if cloud_threshold < 100 else None,
+                "cloud_filter": "overview" if self.cloud_overview_check.isChecked() else "metadata",
             }
-            self.new_thread = QThread()
-            worker = Worker(LandsatProcessor)
-            worker.moveToThread(self.new_thread)
-            self.new_thread.started.connect(partial(worker.run, data))
-            worker.finished.connect(self.new_thread.quit)
-            worker.finished.connect(self.finished_function)
-            worker.progressChanged.connect(self.progress_changed)
-            worker.errorRaised.connect(self.error_raised)
-            self.new_thread.finished.connect(worker.deleteLater)
-            self.new_thread.finished.connect(self.new_thread.deleteLater)
-            self.new_thread.start()
-            self.start_button.setText("Идет обработка...")
-            self.start_button.setEnabled(False)
-
-    def progress_changed(self, percent):
-        self.message(f"Завершено на {percent}%")
-
-    def error_raised(self, message):
-        self.error_state = True
-
-    def finished_function(self):
-        self.new_thread.quit()
-        self.start_button.setText("Начать")
-        self.start_button.setEnabled(True)
-        if self.error_state:
-            self.message("Обработка завершена с ошибками", 3000)
-            self.error_state = False
+            job = job_queue().submit(LandsatProcessor, data, "Landsat")
+            job.worker.finished.connect(partial(self.finished_function, job))
+            job.worker.progressChanged.connect(partial(self.progress_changed, job))
+            job.worker.statusChanged.connect(partial(self.status_changed, job))
+            self.message(f"Задача №{job.id} добавлена в очередь", 3000)
+
+    def progress_changed(self, job, percent):
+        self.message(f"Задача №{job.id}: завершено на {percent}%")
+
+    def status_changed(self, job, status):
+        self.message(f"Задача №{job.id}: {format_status(status)}")
+
+    def finished_function(self, job):
+        if job.errors:
+            self.message(f"Задача №{job.id}: обработка завершена с ошибками", 3000)
         else:
-            self.message("Обработка завершена", 3000)
+            self.message(f"Задача №{job.id}: обработка завершена", 3000)
@@ -0,0 +1,65 @@
+import logging
+from typing import Optional, Set
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from .project import cached_file_hash, file_hash, load_match
+
+logger = logging.getLogger(__name__)
+
+MATCH_FILE_FILTER = "Файл сопоставления (*.xlsx *.xls *.csv *.txt *.parquet)"
+
+
+class _MatchTask(QRunnable):
+    def __init__(self, loader: "MatchLoader", match_path: str):
+        super().__init__()
+        self.loader = loader
+        self.match_path = match_path
+
+    def run(self):
+        try:
+            key = file_hash(self.match_path)
+            match_data = load_match(self.match_path)
+        except Exception as e:
+            logger.exception(f"Failed to load match file {self.match_path}")
+            self.loader.failed.emit(self.match_path, str(e))
+        else:
+            self.loader.loaded.emit(self.match_path, key, match_data)
+        finally:
+            self.loader.finished.emit(self.match_path)
+
+
+class MatchLoader(QObject):
+    loaded = pyqtSignal(str, str, object)
+    failed = pyqtSignal(str, str)
+    finished = pyqtSignal(str)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.pending: Set[str] = set()
+        self.finished.connect(self._task_finished)
+
+    def load(self, match_path: str) -> None:
+        if match_path in self.pending:
+            return
+        self.pending.add(match_path)
+        self.pool.start(_MatchTask(self, match_path))
+
+    def _task_finished(self, match_path: str) -> None:
+        self.pending.discard(match_path)
+
+    @staticmethod
+    def is_current(match_path: str, key: Optional[str]) -> bool:
+        return key is not None and cached_file_hash(match_path) == key
+
+
+_loader: Optional[MatchLoader] = None
+
+
+def match_loader() -> MatchLoader:
+    global _loader
+    if _loader is None:
+        _loader = MatchLoader()
+    return _loader
@@ -0,0 +1,35 @@
+import logging
+from typing import Iterator, Tuple
+
+import psutil
+
+from const import MEMORY_BUDGET_FRACTION, MEMORY_MIN_BLOCK
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class MemoryBudget:
+    def __init__(self, limit_mb: int = 0, share: int = 1):
+        if limit_mb:
+            self.limit = limit_mb * MB
+        else:
+            self.limit = int(psutil.virtual_memory().total * MEMORY_BUDGET_FRACTION)
+        self.share = max(share, 1)
+
+    @property
+    def task_limit(self) -> int:
+        return max(self.limit // self.share, MEMORY_MIN_BLOCK)
+
+    def fits(self, nbytes: int) -> bool:
+        return nbytes <= self.task_limit
+
+    def row_blocks(self, height: int, width: int, bytes_per_pixel: int) -> Iterator[Tuple[int, int]]:
+        rows = max(self.task_limit // max(width * bytes_per_pixel, 1), 1)
+        if rows >= height:
+            yield 0, height
+            return
+        logger.info(f"Array {height}x{width} exceeds memory budget, processing in blocks of {rows} rows")
+        for start in range(0, height, rows):
+            yield start, min(start + rows, height)
@@ -2,14 +2,16 @@ import logging
 from functools import partial
 
 from PyQt5.QtWidgets import (QWidget, QPushButton, QGridLayout, QLineEdit, QStatusBar,
-                             QFileDialog, QHBoxLayout, QLabel, QSpinBox, QVBoxLayout, QSizePolicy)
-from PyQt5.QtCore import QThread
-import openpyxl
+                             QFileDialog, QHBoxLayout, QLabel, QComboBox, QSpinBox, QVBoxLayout, QSizePolicy, QCheckBox)
 
+from const import COMPOSITE_PERIODS, CHIP_CACHE_MB
 from widgets import CheckboxListWidget
 from .const import METEOR_COEFFICIENT_NAMES
 from .communicator import MeteorProcessor
-from processor.worker import Worker
+from processor.performance import PERFORMANCE_PROFILES
+from processor.progress import format_status
+from processor.matching import MATCH_FILE_FILTER, match_loader
+from processor.jobs.scheduler import job_queue
 
 logger = logging.getLogger(__name__)
 
@@ -17,8 +19,6 @@ logger = logging.getLogger(__name__)
 class MeteorTab(QWidget):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.new_thread = None
-        self.error_state = False
 
         self.main_layout = QVBoxLayout(self)
 
@@ -64,8 +64,12 @@ class MeteorTab(QWidget):
         self.match_button.clicked.connect(self.match_button_clicked)
         self.layout.addWidget(self.match_button, 3, 1, 1, 1)
 
-        self.match_hash = 0
+        self.match_line.editingFinished.connect(self.request_match_data)
+        self.match_key = None
         self.match_data = {}
+        self.match_pending = None
+        match_loader().loaded.connect(self.match_loaded)
+        match_loader().failed.connect(self.match_failed)
 
         self.expected_resolution_label = QLabel(self.widget)
         self.expected_resolution_label.setText("Ожидаемое разрешение в метрах")
@@ -90,18 +94,59 @@ class MeteorTab(QWidget):
         self.coefficient_choice_widget = CheckboxListWidget(self.widget)
         self.coefficient_choice_widget.set_choices(choices=METEOR_COEFFICIENT_NAMES)
 
+        self.performance_label = QLabel(self.widget)
+        self.performance_label.setText("Профиль производительности")
+        self.layout.addWidget(self.performance_label, 6, 0, 1, 1)
+        self.performance_line = QComboBox(self.widget)
+        for profile_name, profile in PERFORMANCE_PROFILES.items():
+            self.performance_line.addItem(profile.title, profile_name)
+        self.layout.addWidget(self.performance_line, 6, 1, 1, 1)
+
+        self.cube_checkbox = QCheckBox("Сохранять куб временных рядов для обучения", self.widget)
+        self.layout.addWidget(self.cube_checkbox, 7, 0, 1, 2)
+
+        self.composite_label = QLabel(self.widget)
+        self.composite_label.setText("Композиты по периодам")
+        self.layout.addWidget(self.composite_label, 8, 0, 1, 1)
+        self.composite_line = QComboBox(self.widget)
+        self.composite_line.addItem("Не считать", None)
+        for period_name, period_title in COMPOSITE_PERIODS.items():
+            self.composite_line.addItem(period_title, period_name)
+        self.layout.addWidget(self.composite_line, 8, 1, 1, 1)
+
+        self.chip_cache_checkbox = QCheckBox("Кэшировать перепроецированные снимки для повторных запусков", self.widget)
+        self.layout.addWidget(self.chip_cache_checkbox, 9, 0, 1, 2)
+
         self.start_button = QPushButton("Начать", self.widget)
         self.start_button.clicked.connect(self.start_button_clicked)
-        self.layout.addWidget(self.start_button, 6, 0, 1, 2)
+        self.layout.addWidget(self.start_button, 10, 0, 1, 2)
 
-    def load_match_data(self):
+    def request_match_data(self, pending=None):
         match_path = self.match_line.text()
-        self.match_hash = hash(match_path)
-        self.match_data = {}
-        wb: openpyxl.workbook.Workbook = openpyxl.load_workbook(match_path, read_only=True)
-        sheet = wb.active
-        for row in sheet.rows:
-            self.match_data[int(row[0].value)] = str(row[1].value)
+        if not match_path:
+            return
+        if pending is not None:
+            self.match_pending = pending
+        self.message("Загрузка файла сопоставления...")
+        match_loader().load(match_path)
+
+    def match_loaded(self, match_path, key, match_data):
+        if match_path != self.match_line.text():
+            return
+        if key != self.match_key:
+            self.match_key = key
+            self.match_data = match_data
+            self.field_choice_widget.set_choices(sorted(set(match_data.values())))
+        self.message("Файл сопоставления загружен", 3000)
+        pending, self.match_pending = self.match_pending, None
+        if pending is not None:
+            pending()
+
+    def match_failed(self, match_path, error):
+        if match_path != self.match_line.text():
+            return
+        self.match_pending = None
+        self.message(f"Ошибка: не удалось прочитать файл сопоставления: {error}", 5000)
 
     def message(self, text, time=0):
         self.status_bar.showMessage(text, time)
@@ -123,17 +168,18 @@ class MeteorTab(QWidget):
         if not match_path:
             self.message("Ошибка: файл для сопоставления не выбран", 3000)
             return
-        if self.match_hash != hash(match_path):
-            self.load_match_data()
-            self.field_choice_widget.set_choices(sorted(set(self.match_data.values())))
+        if not match_loader().is_current(match_path, self.match_key):
+            self.request_match_data(self.field_choice_widget.exec)
+            return
         self.field_choice_widget.exec()
 
     def coefficient_choice_button_clicked(self):
         self.coefficient_choice_widget.exec()
 
     def match_button_clicked(self):
-        directory = QFileDialog.getOpenFileName(self, "Выбрать Excel-файл", filter="Excel-файл (*.xls, *.xlsx)")
+        directory = QFileDialog.getOpenFileName(self, "Выбрать файл сопоставления", filter=MATCH_FILE_FILTER)
         self.match_line.setText(directory[0])
+        self.request_match_data()
 
     def start_button_clicked(self):
         directory = self.directory_line.text()
@@ -152,10 +198,9 @@ class MeteorTab(QWidget):
         elif match == "":
             pass
         else:
-            if self.match_hash != hash(match):
-                self.load_match_data()
-                self.field_choice_widget.set_choices(sorted(set(self.match_data.values())))
-                fields = self.field_choice_widget.selected_item_texts()
+            if not match_loader().is_current(match, self.match_key):
+                self.request_match_data(self.start_button_clicked)
+                return
             data = {
                 "input_path": directory,
                 "shape_path": shape,
@@ -164,33 +209,25 @@ class MeteorTab(QWidget):
                 "coefficients": coefficients,
                 "match_fields": self.match_data,
                 "expected_resolution": expected_resolution,
+                "performance_profile": self.performance_line.currentData(),
+                "cube": self.cube_checkbox.isChecked(),
+                "composite": self.composite_line.currentData(),
+                "chip_cache_mb": CHIP_CACHE_MB if self.chip_cache_checkbox.isChecked() else 0,
             }
-            self.new_thread = QThread()
-            worker = Worker(MeteorProcessor)
-            worker.moveToThread(self.new_thread)
-            self.new_thread.started.connect(partial(worker.run, data))
-            worker.finished.connect(self.new_thread.quit)
-            worker.finished.connect(self.finished_function)
-            worker.progressChanged.connect(self.progress_changed)
-            worker.errorRaised.connect(self.error_raised)
-            self.new_thread.finished.connect(worker.deleteLater)
-            self.new_thread.finished.connect(self.new_thread.deleteLater)
-            self.new_thread.start()
-            self.start_button.setText("Идет обработка...")
-            self.start_button.setEnabled(False)
-
-    def progress_changed(self, percent):
-        self.message(f"Завершено на {percent}%")
-
-    def error_raised(self, message):
-        self.error_state = True
-
-    def finished_function(self):
-        self.new_thread.quit()
-        self.start_button.setText("Начать")
-        self.start_button.setEnabled(True)
-        if self.error_state:
-            self.message("Обработка завершена с ошибками", 3000)
-            self.error_state = False
+            job = job_queue().submit(MeteorProcessor, data, "Meteor")
+            job.worker.finished.connect(partial(self.finished_function, job))
+            job.worker.progressChanged.connect(partial(self.progress_changed, job))
+            job.worker.statusChanged.connect(partial(self.status_changed, job))
+            self.message(f"Задача №{job.id} добавлена в очередь", 3000)
+
+    def progress_changed(self, job, percent):
+        self.message(f"Задача №{job.id}: завершено на {percent}%")
+
+    def status_changed(self, job, status):
+        self.message(f"Задача №{job.id}: {format_status(status)}")
+
+    def finished_function(self, job):
+        if job.errors:
+            self.message(f"Задача №{job.id}: обработка завершена с ошибками", 3000)
         else:
-            self.message("Обработка завершена", 3000)
+            self.message(f"Задача №{job.id}: обработка завершена", 3000)
@@ -0,0 +1,47 @@
+import os
+from dataclasses import dataclass, field
+from typing import Dict
+
+import rasterio
+
+
+@dataclass(frozen=True)
+class PerformanceProfile:
+    title: str
+    decode_threads: int = 1
+    cache_mb: int = 0
+    warp_threads: int = 1
+    warp_mem_limit: int = 0
+    creation_options: Dict[str, object] = field(default_factory=dict)
+
+    def env(self) -> rasterio.Env:
+        options = {}
+        if self.decode_threads > 1:
+            options["GDAL_NUM_THREADS"] = self.decode_threads
+            options["OPJ_NUM_THREADS"] = self.decode_threads
+        if self.cache_mb:
+            options["GDAL_CACHEMAX"] = self.cache_mb
+        return rasterio.Env(**options)
+
+
+_CPU_COUNT = os.cpu_count() or 1
+
+PERFORMANCE_PROFILES = {
+    "default": PerformanceProfile("По умолчанию"),
+    "laptop": PerformanceProfile(
+        "Ноутбук",
+        decode_threads=max(1, _CPU_COUNT // 2),
+        cache_mb=512,
+        warp_threads=max(1, _CPU_COUNT // 2),
+        warp_mem_limit=256,
+        creation_options={"tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "lzw"},
+    ),
+    "server": PerformanceProfile(
+        "Сервер",
+        decode_threads=_CPU_COUNT,
+        cache_mb=4096,
+        warp_threads=_CPU_COUNT,
+        warp_mem_limit=2048,
+        creation_options={"tiled": True, "blockxsize": 512, "blockysize": 512},
+    ),
+}
@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from const import DB_BATCH_ROWS, DB_OPEN_PARTITIONS, DB_QUEUE_SIZE, DB_WRITERS
+from .profiler import Profiler
+from .storage import ResultStore
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+_STOP = object()
+
+
+def prefetch(items: Iterable[T], prepare: Callable[[T], R], depth: int) -> Iterator[Tuple[T, R]]:
+    results = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+
+    def produce():
+        for item in items:
+            if stop.is_set():
+                break
+            try:
+                result = prepare(item)
+            except Exception as e:
+                result = e
+            results.put((item, result))
+        results.put(_STOP)
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = results.get()
+            if entry is _STOP:
+                break
+            yield entry
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
+class _PartitionWriter:
+    def __init__(self, store: ResultStore, index: int, profiler: Profiler, batch_rows: int, queue_size: int,
+                 open_sinks: int):
+        self.store = store
+        self.profiler = profiler
+        self.batch_rows = batch_rows
+        self.open_sinks = open_sinks
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self.sinks: Dict[str, list] = {}  # path -> [sink, pending rows], least recently used first
+        self.thread = threading.Thread(target=self._write, name=f"db-writer-{index}", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def _commit(self, path: str) -> None:
+        sink, pending = self.sinks[path]
+        if pending and self.error is None:
+            with self.profiler.stage("db_commit"):
+                sink.commit()
+        self.sinks[path][1] = 0
+
+    def _close(self, path: str) -> None:
+        try:
+            self._commit(path)
+        finally:
+            self.sinks.pop(path)[0].close()
+
+    def _write(self) -> None:
+        try:
+            while True:
+                try:
+                    entry = self.queue.get(timeout=1.0 if self.sinks else None)
+                except queue.Empty:
+                    entry = None
+                try:
+                    if entry is None or entry is _STOP:
+                        # idle partitions are closed, so their connections do not pile up over a long run
+                        for path in list(self.sinks):
+                            self._close(path)
+                        if entry is _STOP:
+                            break
+                        continue
+                    if self.error is not None:
+                        continue
+                    path, rows = entry
+                    if path not in self.sinks:
+                        if len(self.sinks) >= self.open_sinks:
+                            self._close(next(iter(self.sinks)))
+                        self.sinks[path] = [self.store.open_sink(path), 0]
+                    self.sinks[path] = self.sinks.pop(path)
+                    with self.profiler.stage("db_insert"):
+                        self.sinks[path][0].insert(rows)
+                    self.sinks[path][1] += len(rows)
+                    if self.sinks[path][1] >= self.batch_rows:
+                        self._commit(path)
+                except Exception as e:
+                    logger.exception("Database writer exception")
+                    self.error = e
+        finally:
+            for sink, _ in self.sinks.values():
+                sink.close()
+            self.sinks.clear()
+
+
+class DatabaseWriter:
+    def __init__(self, store: ResultStore, profiler: Profiler, batch_rows: int = DB_BATCH_ROWS,
+                 queue_size: int = DB_QUEUE_SIZE, writers: int = DB_WRITERS, open_sinks: int = DB_OPEN_PARTITIONS):
+        self.store = store
+        self.profiler = profiler
+        self.batch_rows = batch_rows
+        self.queue_size = queue_size
+        self.max_writers = max(writers, 1)
+        self.open_sinks = max(open_sinks, 1)
+        self.writers: List[_PartitionWriter] = []
+        self.assignments: Dict[str, _PartitionWriter] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        return next((writer.error for writer in list(self.writers) if writer.error is not None), None)
+
+    def insert(self, rows: Sequence[tuple]) -> None:
+        if self.error is not None:
+            raise RuntimeError("Database writer failed") from self.error
+        for path, partition_rows in self.store.route(rows).items():
+            with self._lock:
+                # a partition always goes to the same writer, so only one connection ever writes to it
+                if path not in self.assignments:
+                    if len(self.writers) < self.max_writers:
+                        self.writers.append(_PartitionWriter(self.store, len(self.writers), self.profiler,
+                                                             self.batch_rows, self.queue_size, self.open_sinks))
+                    self.assignments[path] = self.writers[len(self.assignments) % len(self.writers)]
+                writer = self.assignments[path]
+            writer.queue.put((path, partition_rows))
+
+    def close(self) -> None:
+        with self._lock:
+            writers = list(self.writers)
+        for writer in writers:
+            writer.stop()
+        if self.error is not None:
+            raise RuntimeError("Database writer failed") from self.error
@@ -0,0 +1,74 @@
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+from typing import Callable, Optional, Type
+
+from const import WORKER_POLL_INTERVAL, WORKER_START_METHOD
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessCancelled(RuntimeError):
+    pass
+
+
+def _child_main(processor_type: Type, data: dict, messages: multiprocessing.Queue) -> None:
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(messages)]
+    root.setLevel(logging.INFO)
+
+    def callback(*args, callback_type):
+        messages.put((callback_type, args[0]))
+
+    try:
+        processor_type(**data, callback=callback).run()
+    except Exception as e:
+        logger.exception(f"{processor_type.__name__} failed")
+        messages.put(("failed", str(e)))
+    else:
+        messages.put(("done", None))
+
+
+def run_in_process(processor_type: Type, data: dict, callback: Callable,
+                   cancel: Optional[threading.Event] = None) -> None:
+    context = multiprocessing.get_context(WORKER_START_METHOD)
+    messages = context.Queue()
+    process = context.Process(target=_child_main, args=(processor_type, data, messages),
+                              name=f"{processor_type.__name__}-worker", daemon=True)
+    process.start()
+    logger.info(f"{processor_type.__name__} started in process {process.pid}")
+    failure = None
+    done = False
+    try:
+        while not done and failure is None:
+            if cancel is not None and cancel.is_set():
+                logger.warning(f"{processor_type.__name__} in process {process.pid} terminated by the user")
+                process.terminate()
+                process.join()
+                raise ProcessCancelled("Обработка остановлена пользователем")
+            try:
+                message = messages.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if not process.is_alive() and messages.empty():
+                    failure = f"Процесс обработки аварийно завершился с кодом {process.exitcode}"
+                continue
+            if isinstance(message, logging.LogRecord):
+                logging.getLogger(message.name).handle(message)
+                continue
+            kind, value = message
+            if kind == "done":
+                done = True
+            elif kind == "failed":
+                failure = value
+            else:
+                callback(value, callback_type=kind)
+        process.join()
+    finally:
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        messages.close()
+    if failure is not None:
+        raise RuntimeError(failure)
@@ -0,0 +1,173 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+import psutil
+
+from const import PROFILER_SAMPLE_INTERVAL
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.profiler._enter_stage(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler._add_stage(self.name, self.start, time.perf_counter())
+        return False
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self, enabled: bool = False, trace: bool = False):
+        self.enabled = enabled or trace
+        self.trace = trace
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._process = psutil.Process() if self.enabled else None
+        self.peak_rss = 0
+        self.stages: Dict[str, Dict[str, float]] = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "peak_rss": 0})
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.scenes: Dict[str, Dict[str, Dict]] = {}
+        self.events = []
+        self.meta: Dict[str, object] = {}
+        self._active: Dict[str, int] = defaultdict(int)
+        self._stop = threading.Event()
+        self._sampler = None
+        if self.enabled:
+            self._sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._sampler.start()
+
+    @property
+    def current_scene(self) -> Optional[str]:
+        return getattr(self._local, "scene", None)
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Stage(self, name)
+
+    @contextlib.contextmanager
+    def scene(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        previous = self.current_scene
+        self._local.scene = name
+        with self._lock:
+            self.scenes.setdefault(name, {"stages": defaultdict(lambda: {"calls": 0, "seconds": 0.0}),
+                                          "counters": defaultdict(int)})
+        try:
+            with self.stage("scene"):
+                yield
+        finally:
+            self._local.scene = previous
+
+    def count(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        scene = self.current_scene
+        with self._lock:
+            self.counters[name] += value
+            if scene is not None:
+                self.scenes[scene]["counters"][name] += value
+
+    def sample_rss(self) -> int:
+        if not self.enabled:
+            return 0
+        rss = self._process.memory_info().rss
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    def _sample(self) -> None:
+        while not self._stop.wait(PROFILER_SAMPLE_INTERVAL):
+            rss = self._process.memory_info().rss
+            with self._lock:
+                self.peak_rss = max(self.peak_rss, rss)
+                for name, active in self._active.items():
+                    if active:
+                        self.stages[name]["peak_rss"] = max(self.stages[name]["peak_rss"], rss)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def _enter_stage(self, name: str) -> None:
+        with self._lock:
+            self._active[name] += 1
+
+    def _add_stage(self, name: str, start: float, end: float) -> None:
+        rss = self._process.memory_info().rss
+        scene = self.current_scene
+        with self._lock:
+            self._active[name] -= 1
+            self.peak_rss = max(self.peak_rss, rss)
+            stage = self.stages[name]
+            stage["calls"] += 1
+            stage["seconds"] += end - start
+            stage["peak_rss"] = max(stage["peak_rss"], rss)
+            if scene is not None:
+                scene_stage = self.scenes[scene]["stages"][name]
+                scene_stage["calls"] += 1
+                scene_stage["seconds"] += end - start
+            if self.trace:
+                self.events.append({
+                    "name": name,
+                    "cat": "processor",
+                    "ph": "X",
+                    "ts": (start - self._start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"scene": scene} if scene is not None else {},
+                })
+
+    def report(self) -> Dict:
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "elapsed": elapsed,
+                "peak_rss": self.peak_rss,
+                "meta": dict(self.meta),
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "throughput": {name: value / elapsed for name, value in self.counters.items() if elapsed > 0},
+                "scenes": {scene: {"stages": {name: dict(stage) for name, stage in data["stages"].items()},
+                                   "counters": dict(data["counters"])}
+                           for scene, data in self.scenes.items()},
+            }
+
+    def write(self, output_path: str, name: str) -> None:
+        if not self.enabled:
+            return
+        self.close()
+        self.sample_rss()
+        report = self.report()
+        report["processor"] = name
+        with open(os.path.join(output_path, "run_report.json"), "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=2, ensure_ascii=False)
+        if self.trace:
+            with self._lock:
+                events = list(self.events)
+            with open(os.path.join(output_path, "trace.json"), "w", encoding="utf-8") as trace_file:
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
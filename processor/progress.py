@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from const import PROGRESS_INTERVAL, PROGRESS_LOG_INTERVAL, PROGRESS_WINDOW
+
+logger = logging.getLogger(__name__)
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def format_status(status: Dict) -> str:
+    parts = [f"Завершено на {status['percent']}%"]
+    if status.get("stage"):
+        parts.append(f"{status['stage']} {status.get('scene') or ''}".strip())
+    if status.get("pixels_per_second"):
+        parts.append(f"{status['pixels_per_second']:,.0f} пикс/с".replace(",", " "))
+    if status.get("rows_per_second"):
+        parts.append(f"{status['rows_per_second']:,.0f} строк/с".replace(",", " "))
+    if status.get("mb_per_second"):
+        parts.append(f"{status['mb_per_second']:.1f} МБ/с")
+    parts.append(f"прошло {format_duration(status['elapsed'])}")
+    parts.append(f"осталось {format_duration(status['eta'])}")
+    return " | ".join(parts)
+
+
+class ProgressTracker:
+    def __init__(self, callback: Callable, min_interval: float = PROGRESS_INTERVAL, window: float = PROGRESS_WINDOW):
+        self.callback = callback
+        self.min_interval = min_interval
+        self.window = window
+        self.start = time.monotonic()
+        self.stage = None
+        self.scene = None
+        self.percent = -1
+        self.span = (0.0, 1.0)
+        self.step = 0
+        self.total = 1
+        self.fraction = 0.0
+        self.counters = {"pixels": 0, "rows": 0, "bytes": 0}
+        self.samples = deque()
+        self.last_emit = 0.0
+        self.last_log = 0.0
+        self._lock = threading.Lock()
+
+    def set_span(self, start: float, end: float) -> None:
+        with self._lock:
+            self.span = (start, end)
+            self.step, self.total = 0, 1
+        self.update(0.0)
+
+    def set_step(self, step: int, total: int, stage: Optional[str] = None, scene: Optional[str] = None) -> None:
+        with self._lock:
+            self.step, self.total = step, max(total, 1)
+        self.update(0.0, stage=stage, scene=scene)
+
+    def update(self, sub_fraction: Optional[float] = None, stage: Optional[str] = None, scene: Optional[str] = None,
+               pixels: int = 0, rows: int = 0, nbytes: int = 0) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if sub_fraction is not None:
+                local = (self.step + min(max(sub_fraction, 0.0), 1.0)) / self.total
+                self.fraction = self.span[0] + (self.span[1] - self.span[0]) * min(local, 1.0)
+            if stage is not None:
+                self.stage = stage
+            if scene is not None:
+                self.scene = scene
+            self.counters["pixels"] += pixels
+            self.counters["rows"] += rows
+            self.counters["bytes"] += nbytes
+            percent = int(100 * self.fraction)
+            percent_changed = percent != self.percent
+            self.percent = percent
+            if not percent_changed and now - self.last_emit < self.min_interval:
+                return
+            self.last_emit = now
+            self.samples.append((now, self.fraction, self.counters["pixels"], self.counters["rows"],
+                                 self.counters["bytes"]))
+            while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+            status = self._status(now)
+            log = now - self.last_log >= PROGRESS_LOG_INTERVAL or percent == 100
+            if log:
+                self.last_log = now
+        if percent_changed:
+            self.callback(percent, callback_type="percent")
+        self.callback(status, callback_type="status")
+        if log:
+            logger.info(format_status(status))
+
+    def _status(self, now: float) -> Dict:
+        elapsed = now - self.start
+        first, last = self.samples[0], self.samples[-1]
+        interval = last[0] - first[0]
+        rates = [0.0, 0.0, 0.0, 0.0]
+        if interval > 0:
+            rates = [(last[i] - first[i]) / interval for i in range(1, 5)]
+        eta = None
+        if rates[0] > 0:
+            eta = (1.0 - self.fraction) / rates[0]
+        elif self.fraction > 0:
+            eta = elapsed * (1.0 - self.fraction) / self.fraction
+        return {
+            "stage": self.stage,
+            "scene": self.scene,
+            "percent": self.percent,
+            "elapsed": elapsed,
+            "eta": eta,
+            "pixels_per_second": rates[1],
+            "rows_per_second": rates[2],
+            "mb_per_second": rates[3] / 2 ** 20,
+        }
@@ -0,0 +1,344 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+from collections.abc import Sequence as SequenceABC
+from typing import IO, Callable, Dict, Optional, Sequence, Tuple
+
+import fiona
+import numpy as np
+import openpyxl
+import pandas as pd
+import rasterio
+from rasterio.warp import transform_geom
+
+from const import CACHE_PATH, DELIMITER
+
+logger = logging.getLogger(__name__)
+
+PROJECT_VERSION = 1
+SHAPE_SIDECARS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+MATCH_TABLE_EXTENSIONS = (".csv", ".txt", ".parquet")
+WKB_TYPES = {"Point": 1, "LineString": 2, "Polygon": 3, "MultiPoint": 4, "MultiLineString": 5, "MultiPolygon": 6,
+             "GeometryCollection": 7}
+WKB_NAMES = {code: name for name, code in WKB_TYPES.items()}
+
+
+def content_hash(paths: Sequence[str]) -> str:
+    digest = hashlib.sha1(str(PROJECT_VERSION).encode())
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as content:
+            for chunk in iter(lambda: content.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_coordinates(coordinates) -> bytes:
+    if not len(coordinates):
+        return struct.pack("<I", 0)
+    points = np.asarray(coordinates, dtype="<f8").reshape(len(coordinates), -1)[:, :2]
+    return struct.pack("<I", len(points)) + points.tobytes()
+
+
+def encode_wkb(geometry: Optional[dict]) -> bytes:
+    if not geometry:
+        return b""
+    kind = geometry["type"]
+    header = struct.pack("<BI", 1, WKB_TYPES[kind])
+    if kind == "Point":
+        return header + np.asarray(geometry["coordinates"], dtype="<f8")[:2].tobytes()
+    if kind == "LineString":
+        return header + _encode_coordinates(geometry["coordinates"])
+    if kind == "Polygon":
+        return header + struct.pack("<I", len(geometry["coordinates"])) + b"".join(
+            _encode_coordinates(ring) for ring in geometry["coordinates"])
+    if kind == "GeometryCollection":
+        parts = [encode_wkb(part) for part in geometry["geometries"]]
+    else:
+        part_kind = kind[len("Multi"):]
+        parts = [encode_wkb({"type": part_kind, "coordinates": part}) for part in geometry["coordinates"]]
+    return header + struct.pack("<I", len(parts)) + b"".join(parts)
+
+
+def _decode_coordinates(data: bytes, offset: int) -> Tuple[list, int]:
+    count, = struct.unpack_from("<I", data, offset)
+    points = np.frombuffer(data, dtype="<f8", count=count * 2, offset=offset + 4).reshape(-1, 2)
+    return points.tolist(), offset + 4 + count * 16
+
+
+def _decode(data: bytes, offset: int) -> Tuple[dict, int]:
+    _, code = struct.unpack_from("<BI", data, offset)
+    kind = WKB_NAMES[code]
+    offset += 5
+    if kind == "Point":
+        return {"type": kind, "coordinates": list(struct.unpack_from("<2d", data, offset))}, offset + 16
+    if kind == "LineString":
+        coordinates, offset = _decode_coordinates(data, offset)
+        return {"type": kind, "coordinates": coordinates}, offset
+    count, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    parts = []
+    for _ in range(count):
+        if kind == "Polygon":
+            part, offset = _decode_coordinates(data, offset)
+        else:
+            part, offset = _decode(data, offset)
+        parts.append(part)
+    if kind == "Polygon":
+        return {"type": kind, "coordinates": parts}, offset
+    if kind == "GeometryCollection":
+        return {"type": kind, "geometries": parts}, offset
+    return {"type": kind, "coordinates": [part["coordinates"] for part in parts]}, offset
+
+
+def decode_wkb(data: bytes) -> Optional[dict]:
+    if not data:
+        return None
+    return _decode(data, 0)[0]
+
+
+def _repair_ring(ring) -> Optional[list]:
+    points = [tuple(point[:2]) for point in ring]
+    points = [point for index, point in enumerate(points) if index == 0 or point != points[index - 1]]
+    if points and points[0] != points[-1]:
+        points.append(points[0])
+    if len(points) < 4:
+        return None
+    return points
+
+
+def _repair_polygon(rings) -> Optional[list]:
+    exterior = _repair_ring(rings[0]) if rings else None
+    if exterior is None:
+        return None
+    return [exterior] + [ring for ring in map(_repair_ring, rings[1:]) if ring is not None]
+
+
+def repair_geometry(geometry) -> Optional[dict]:
+    if not geometry:
+        return None
+    kind = geometry["type"]
+    if kind == "Polygon":
+        polygon = _repair_polygon(geometry["coordinates"])
+        return {"type": kind, "coordinates": polygon} if polygon else None
+    if kind == "MultiPolygon":
+        polygons = [polygon for polygon in map(_repair_polygon, geometry["coordinates"]) if polygon]
+        return {"type": kind, "coordinates": polygons} if polygons else None
+    if kind == "GeometryCollection":
+        return {"type": kind, "geometries": [part for part in map(repair_geometry, geometry["geometries"]) if part]}
+    return {"type": kind, "coordinates": geometry["coordinates"]}
+
+
+def geometry_bounds(geometry: Optional[dict]) -> Tuple[float, float, float, float]:
+    if not geometry:
+        return (np.nan, np.nan, np.nan, np.nan)
+    if geometry["type"] == "GeometryCollection":
+        bounds = np.array([geometry_bounds(part) for part in geometry["geometries"]] or [[np.nan] * 4])
+        return (np.nanmin(bounds[:, 0]), np.nanmin(bounds[:, 1]), np.nanmax(bounds[:, 2]), np.nanmax(bounds[:, 3]))
+    points = np.asarray(_flatten(geometry["coordinates"]), dtype="float64").reshape(-1, 2)
+    if not len(points):
+        return (np.nan, np.nan, np.nan, np.nan)
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def _flatten(coordinates) -> list:
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [coordinates[:2]]
+    points = []
+    for part in coordinates:
+        points.extend(_flatten(part))
+    return points
+
+
+class GeometrySequence(SequenceABC):
+    def __init__(self, data: bytes, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+        self._cache: Dict[int, Optional[dict]] = {}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index not in self._cache:
+            self._cache[index] = decode_wkb(self.data[self.offsets[index]:self.offsets[index + 1]])
+        return self._cache[index]
+
+
+def _write_atomic(path: str, write: Callable[[IO], None]) -> None:
+    # jobs run in separate processes and share the cache, a reader must never see a half written file
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporary, "wb") as output:
+            write(output)
+        os.replace(temporary, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temporary)
+
+
+def _write_geometries(path: str, geometries: Sequence[Optional[dict]]) -> None:
+    encoded = [encode_wkb(geometry) for geometry in geometries]
+    offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    bounds = np.array([geometry_bounds(geometry) for geometry in geometries], dtype="float64").reshape(-1, 4)
+    _write_atomic(path + ".wkb", lambda output: output.write(b"".join(encoded)))
+    _write_atomic(path + "_offsets.npy", lambda output: np.save(output, offsets))
+    # the bounds file goes last and marks the geometries as complete
+    _write_atomic(path + "_bounds.npy", lambda output: np.save(output, bounds))
+
+
+def _read_geometries(path: str) -> Tuple[GeometrySequence, np.ndarray]:
+    with open(path + ".wkb", "rb") as data_file:
+        data = data_file.read()
+    return GeometrySequence(data, np.load(path + "_offsets.npy")), np.load(path + "_bounds.npy")
+
+
+class ProjectBundle:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "project.json")) as header_file:
+            header = json.load(header_file)
+        self.crs = rasterio.crs.CRS.from_wkt(header["crs"]) if header["crs"] else None
+        self.shapes, self.bounds = _read_geometries(os.path.join(path, "geometries"))
+        self._reprojected: Dict[str, Tuple[GeometrySequence, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+    def reprojected(self, crs) -> Tuple[GeometrySequence, np.ndarray]:
+        crs = rasterio.crs.CRS.from_user_input(crs)
+        if self.crs is None or crs == self.crs:
+            return self.shapes, self.bounds
+        key = hashlib.sha1(crs.to_wkt().encode()).hexdigest()[:16]
+        with self._lock:
+            if key not in self._reprojected:
+                path = os.path.join(self.path, f"geometries_{key}")
+                if not os.path.isfile(path + "_bounds.npy"):
+                    _write_geometries(path, [transform_geom(self.crs, crs, geometry) if geometry else None
+                                             for geometry in self.shapes])
+                self._reprojected[key] = _read_geometries(path)
+            return self._reprojected[key]
+
+    def field_indices(self, match_fields: Dict[int, str], whitelist) -> np.ndarray:
+        whitelist = set(whitelist)
+        return np.array([index for index in range(len(self.shapes))
+                         if match_fields.get(index) in whitelist and not np.isnan(self.bounds[index, 0])],
+                        dtype="int64")
+
+
+_projects: Dict[str, ProjectBundle] = {}
+_projects_lock = threading.Lock()
+
+
+def load_project(shape_path: str, cache_path: str = CACHE_PATH) -> ProjectBundle:
+    stem = os.path.splitext(shape_path)[0]
+    key = content_hash([stem + extension for extension in SHAPE_SIDECARS if os.path.isfile(stem + extension)])
+    with _projects_lock:
+        if key in _projects:
+            return _projects[key]
+        path = os.path.join(cache_path, "projects", key)
+        if not os.path.isfile(os.path.join(path, "project.json")):
+            compile_project(shape_path, path)
+        _projects[key] = ProjectBundle(path)
+        return _projects[key]
+
+
+def compile_project(shape_path: str, path: str) -> None:
+    logger.info(f"Compiling project {shape_path} into {path}")
+    os.makedirs(path, exist_ok=True)
+    with fiona.open(shape_path, "r") as shapefile:
+        crs = shapefile.crs
+        geometries = [repair_geometry(feature["geometry"]) for feature in shapefile]
+    _write_geometries(os.path.join(path, "geometries"), geometries)
+    header = {"version": PROJECT_VERSION, "source": os.path.abspath(shape_path), "count": len(geometries),
+              "crs": crs.to_wkt() if crs else None}
+    # project.json marks the bundle as complete, so it is only written once the geometries are in place
+    _write_atomic(os.path.join(path, "project.json"), lambda output: output.write(json.dumps(header).encode()))
+
+
+_hashes: Dict[Tuple[str, int, int], str] = {}
+_matches: Dict[str, Dict[int, str]] = {}
+_matches_lock = threading.Lock()
+
+
+def _stat_key(path: str) -> Tuple[str, int, int]:
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def cached_file_hash(path: str) -> Optional[str]:
+    try:
+        key = _stat_key(path)
+    except OSError:
+        return None
+    with _matches_lock:
+        return _hashes.get(key)
+
+
+def file_hash(path: str) -> str:
+    key = _stat_key(path)
+    with _matches_lock:
+        if key in _hashes:
+            return _hashes[key]
+    digest = content_hash([path])
+    with _matches_lock:
+        _hashes[key] = digest
+    return digest
+
+
+def _read_match_workbook(match_path: str) -> Dict[int, str]:
+    match_data = {}
+    wb: openpyxl.workbook.Workbook = openpyxl.load_workbook(match_path, read_only=True)
+    sheet = wb.active
+    for row in sheet.iter_rows(values_only=True):
+        match_data[int(row[0])] = str(row[1])
+    wb.close()
+    return match_data
+
+
+def _read_match_table(match_path: str) -> Dict[int, str]:
+    if match_path.lower().endswith(".parquet"):
+        df = pd.read_parquet(match_path)
+        df = df.iloc[:, :2].astype(str)
+    else:
+        with open(match_path, encoding="utf-8-sig") as match_file:
+            header = match_file.readline()
+        delimiter = DELIMITER if header.count(DELIMITER) >= header.count(",") else ","
+        df = pd.read_csv(match_path, sep=delimiter, header=None, usecols=[0, 1], dtype=str, encoding="utf-8-sig",
+                         keep_default_na=False)
+    df.columns = ["index", "name"]
+    index = pd.to_numeric(df["index"], errors="coerce")
+    df = df[index.notna()]
+    return dict(zip(index[index.notna()].astype("int64").tolist(), df["name"].tolist()))
+
+
+def read_match(match_path: str) -> Dict[int, str]:
+    if os.path.splitext(match_path)[1].lower() in MATCH_TABLE_EXTENSIONS:
+        return _read_match_table(match_path)
+    return _read_match_workbook(match_path)
+
+
+def load_match(match_path: str, cache_path: str = CACHE_PATH) -> Dict[int, str]:
+    key = file_hash(match_path)
+    with _matches_lock:
+        if key in _matches:
+            return _matches[key]
+    path = os.path.join(cache_path, "matches", key + ".json")
+    if os.path.isfile(path):
+        with open(path) as match_file:
+            match_data = {int(index): name for index, name in json.load(match_file).items()}
+    else:
+        match_data = read_match(match_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as match_file:
+            json.dump(match_data, match_file, ensure_ascii=False)
+    with _matches_lock:
+        _matches[key] = match_data
+    return match_data
@@ -0,0 +1,103 @@
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .storage import RESULT_COLUMNS, open_store
+
+COORDINATE_TOLERANCE = 5e-7
+
+
+class ResultQuery:
+    def __init__(self, db_path: str, backend: Optional[str] = None):
+        self.db_path = db_path
+        self.store = open_store(db_path, backend, read_only=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self) -> None:
+        self.store.close()
+
+    def coefficients(self) -> List[str]:
+        return self.store.coefficients()
+
+    def fields(self, coefficient: str) -> List[str]:
+        return self.store.fields(coefficient)
+
+    def dates(self, coefficient: str, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[str]:
+        return sorted(set(self._select(("DISTINCT date",), coefficient, check=False, date_from=date_from,
+                                       date_to=date_to)["date"]))
+
+    def field_series(self, coefficient: str, field: str, date_from: Optional[str] = None,
+                     date_to: Optional[str] = None,
+                     columns: Sequence[str] = ("date", "longitude", "latitude", "value")) -> pd.DataFrame:
+        return self._select(columns, coefficient, field=field, date_from=date_from, date_to=date_to)
+
+    def field_mean(self, coefficient: str, field: str, date_from: Optional[str] = None,
+                   date_to: Optional[str] = None) -> pd.Series:
+        df = self._select(("date", "AVG(value) AS value"), coefficient, check=False, group="date", field=field,
+                          date_from=date_from, date_to=date_to)
+        return df.sort_values("date").set_index("date")["value"]
+
+    def pixel_series(self, coefficient: str, longitude: float, latitude: float, date_from: Optional[str] = None,
+                     date_to: Optional[str] = None) -> pd.Series:
+        bounds = (longitude - COORDINATE_TOLERANCE, latitude - COORDINATE_TOLERANCE,
+                  longitude + COORDINATE_TOLERANCE, latitude + COORDINATE_TOLERANCE)
+        df = self._select(("date", "value"), coefficient, bounds=bounds, date_from=date_from, date_to=date_to)
+        return df.set_index("date")["value"]
+
+    def bbox_series(self, coefficient: str, bounds: Tuple[float, float, float, float],
+                    date_from: Optional[str] = None, date_to: Optional[str] = None,
+                    columns: Sequence[str] = ("date", "longitude", "latitude", "value")) -> pd.DataFrame:
+        return self._select(columns, coefficient, bounds=bounds, date_from=date_from, date_to=date_to)
+
+    def date_slice(self, coefficient: str, date: str, fields: Optional[Sequence[str]] = None,
+                   columns: Sequence[str] = ("field", "longitude", "latitude", "value")) -> pd.DataFrame:
+        return self._select(columns, coefficient, date_from=date, date_to=date, fields=fields)
+
+    def pixel_values(self, coefficient: str, field: str, date: str) -> Tuple[np.ndarray, np.ndarray]:
+        df = self._select(("longitude", "latitude", "value"), coefficient, field=field, date_from=date, date_to=date)
+        data = df.to_numpy(dtype="float64").reshape(-1, 3)
+        return data[:, :2], data[:, 2]
+
+    def _select(self, columns: Sequence[str], coefficient: str, check: bool = True, group: str = "",
+                **filters) -> pd.DataFrame:
+        unknown = set(columns) - set(RESULT_COLUMNS)
+        if check and unknown:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+        where, params = self._where(coefficient, **filters)
+        order = " ORDER BY date" if "date" in columns and not group else ""
+        if group:
+            order = f" GROUP BY {group}"
+        df = self.store.read(coefficient, columns, where, params, filters.get("date_from"), filters.get("date_to"),
+                             order)
+        if "date" in columns and not group:
+            df = df.sort_values("date", kind="stable", ignore_index=True)
+        return df
+
+    @staticmethod
+    def _where(coefficient: str, field: Optional[str] = None, fields: Optional[Sequence[str]] = None,
+               date_from: Optional[str] = None, date_to: Optional[str] = None,
+               bounds: Optional[Tuple[float, float, float, float]] = None) -> Tuple[str, list]:
+        conditions, params = ["coefficient = ?"], [coefficient]
+        if field is not None:
+            conditions.append("field = ?")
+            params.append(field)
+        if fields:
+            conditions.append(f"field IN ({', '.join('?' * len(fields))})")
+            params.extend(fields)
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date <= ?")
+            params.append(date_to)
+        if bounds:
+            conditions.append("longitude BETWEEN ? AND ? AND latitude BETWEEN ? AND ?")
+            params.extend([bounds[0], bounds[2], bounds[1], bounds[3]])
+        return " WHERE " + " AND ".join(conditions), params
@@ -1,105 +1,167 @@
 import datetime
-import glob
 import logging
 import os
 import pathlib
 import re
-import shutil
-from typing import List, Sequence, Callable, Literal, Dict
+from typing import List, Sequence, Callable, Literal, Dict, Optional, Tuple
+from xml.etree import ElementTree
 
 import numpy as np
 import rasterio
 
-from processor.communicator import AbstractProcessor
-from .const import HARMONIZE_BANDS, HARMONIZE_DATE, HARMONIZE_OFFSET, FORMULAS
+from processor.archive import archive_path, file_size, is_archive, is_file, join, list_dir, open_file, physical_path
+from processor.catalog import CatalogScene
+from processor.communicator import AbstractProcessor, Scene
+from .const import (HARMONIZE_BANDS, HARMONIZE_DATE, HARMONIZE_OFFSET, FORMULAS, SCL_CLOUD_CLASSES, SCL_NO_DATA,
+                    PRODUCT_PATTERN, GRANULE_PATTERN, BAND_PATTERN, RESOLUTIONS)
 
 logger = logging.getLogger(__name__)
 
 
 class SentinelProcessor(AbstractProcessor):
+    catalog_kind = "sentinel"
     source_resolution: Literal["R10m", "R20m", "R60m"]
+    read_resolution: Literal["R10m", "R20m", "R60m"]
     coefficients: List[str]
-    directories: List[str]
+    directories: List[CatalogScene]
+    bands: Dict[str, Dict[Tuple[str, str], str]]
 
     def __init__(self, input_path: str, output_path: str, shape_path: str, expected_resolution: int,
                  fields_whitelist: Sequence[str], match_fields: Dict[int, str],
                  source_resolution: Literal["R10m", "R20m", "R60m"], coefficients: List[str],
-                 callback: Callable):
+                 callback: Callable, cloud_threshold: Optional[float] = None,
+                 cloud_filter: Literal["metadata", "overview"] = "metadata", **kwargs):
         super().__init__(input_path, output_path, shape_path, expected_resolution, fields_whitelist, match_fields,
-                         callback)
+                         callback, **kwargs)
         self.source_resolution = source_resolution
+        self.read_resolution = max((resolution for resolution, meters in RESOLUTIONS.items()
+                                    if RESOLUTIONS[source_resolution] <= meters <= expected_resolution),
+                                   key=RESOLUTIONS.get, default=source_resolution)
+        if self.read_resolution != source_resolution:
+            logger.info(f"Reading {self.read_resolution} instead of {source_resolution} "
+                        f"for {expected_resolution} m output")
         self.coefficients = coefficients
+        self.cloud_threshold = cloud_threshold
+        self.cloud_filter = cloud_filter
         self.directories = []
+        self.bands = {}
+
+    def discover_scenes(self, root):
+        granules = []
+        for entry in os.scandir(root):
+            if entry.is_dir():
+                if re.fullmatch(GRANULE_PATTERN, entry.name):
+                    granules.append(entry.path)
+                products = [entry.path]
+            elif re.fullmatch(PRODUCT_PATTERN, entry.name) and is_archive(entry.path):
+                archive = archive_path(entry.path)
+                products = [join(archive, name) for name, is_dir in list_dir(archive).items() if is_dir]
+            else:
+                continue
+            for product in products:
+                if not re.fullmatch(PRODUCT_PATTERN, os.path.basename(product)) or not list_dir(product).get("GRANULE"):
+                    continue
+                granules.extend(join(product, "GRANULE", name)
+                                for name, is_dir in list_dir(join(product, "GRANULE")).items()
+                                if is_dir and re.fullmatch(GRANULE_PATTERN, name))
+        return granules
+
+    def scene_mtime(self, path):
+        if physical_path(path) != path:
+            return os.stat(physical_path(path)).st_mtime
+        mtimes = [os.stat(path).st_mtime]
+        image_path = os.path.join(path, "IMG_DATA")
+        if os.path.isdir(image_path):
+            mtimes.extend(entry.stat().st_mtime for entry in os.scandir(image_path) if entry.is_dir())
+        return max(mtimes)
+
+    def describe_scene(self, path):
+        name = os.path.basename(path)
+        date = datetime.datetime.strptime(re.search(r"\d{8}T\d{6}", name).group(), "%Y%m%dT%H%M%S")
+        bands = {}
+        image_path = join(path, "IMG_DATA")
+        for resolution, is_dir in list_dir(image_path).items():
+            if not is_dir:
+                continue
+            for band in list_dir(join(image_path, resolution)):
+                match = re.fullmatch(BAND_PATTERN, band)
+                if match:
+                    bands[(match.group(1), resolution)] = join(image_path, resolution, band)
+        if not bands:
+            return None
+        crs, bounds, native_bounds = self.describe_raster(bands[min(bands)])
+        return CatalogScene(path, name, date.strftime("%Y-%m-%d"), name.split("_")[1], crs, bounds, bands, {},
+                            native_bounds)
 
     def parse_directories(self):
-        processing_directories = glob.glob(os.path.join(self.input_path, "*"))
-        for directory in processing_directories:
-            directory_name = os.path.basename(directory)
-            if re.fullmatch(r"[A-Z0-9]{3}_[A-Z0-9]{6}_\d{8}T\d{6}_N\d{4}_R\d{3}_T[A-Z0-9]{5}_.*", directory_name):
-                subdirectories = glob.glob(os.path.join(directory, "GRANULE", "*"))
-                for subdirectory in subdirectories:
-                    subdirectory_name = os.path.basename(subdirectory)
-                    if re.fullmatch(r"L2A_[A-Z0-9]{6}_[A-Z0-9]{7}_\d{8}T\d{6}", subdirectory_name):
-                        self.directories.append(subdirectory)
-            if re.fullmatch(r"L2A_[A-Z0-9]{6}_[A-Z0-9]{7}_\d{8}T\d{6}", directory_name):
-                self.directories.append(directory)
-
-    def get_coefficient_path(self, directory_path, coefficient, *args, **kwargs):
+        for scene in self.catalog_scenes():
+            self.directories.append(scene)
+            self.bands[scene.path] = scene.bands
+
+    def band_resolution(self, directory_path, bands):
+        available = self.bands.get(directory_path, {})
+        if all((band, self.read_resolution) in available for band in bands):
+            return self.read_resolution
+        return self.source_resolution
+
+    def get_coefficient_path(self, directory_path, coefficient, *args, resolution=None, **kwargs):
         if 'date' in kwargs:
             date = kwargs['date']
         else:
             date = args[0]
-        filename = glob.glob(os.path.join(directory_path, "IMG_DATA", self.source_resolution, f"*_{coefficient}_*.jp2"))
+        # bands missing from the coarser folder (B08 is only in R10m) are read at the source resolution
+        resolution = resolution or self.band_resolution(directory_path, [coefficient])
+        filename = self.bands.get(directory_path, {}).get((coefficient, resolution))
         if filename:
-            filename = filename[0]
             if coefficient in HARMONIZE_BANDS and date >= HARMONIZE_DATE:
                 output_filename = os.path.join(self.buffer_path, os.path.basename(filename))
                 if os.path.isfile(output_filename):
                     return output_filename
-                with rasterio.open(filename) as dataset:
-                    with rasterio.open(output_filename, 'w', **dataset.meta) as output:
-                        output.write(np.clip(dataset.read(1), HARMONIZE_OFFSET, 32767) - HARMONIZE_OFFSET, 1)
-                return output_filename
+
+                def harmonize():
+                    with rasterio.open(filename) as dataset:
+                        self.write_decimated(dataset, output_filename, source_function=lambda data: (
+                            np.clip(data, HARMONIZE_OFFSET, 32767) - HARMONIZE_OFFSET))
+                    self.profiler.count("bytes_read", file_size(filename))
+
+                return self.derive(output_filename, [filename], f"harmonize {HARMONIZE_OFFSET}", harmonize)
             return filename
         if coefficient == "B08":
-            return self.get_coefficient_path(directory_path, "B8A", date)
-        if coefficient == "SCL" and self.source_resolution == "R10m":
-            scl_filename = glob.glob(os.path.join(directory_path, "IMG_DATA", "R20m", f"*_SCL_*.jp2"))
-            if scl_filename:
-                return scl_filename[0]
-            return None
+            return self.get_coefficient_path(directory_path, "B8A", date, resolution=resolution)
+        if coefficient == "SCL" and resolution == "R10m":
+            return self.bands.get(directory_path, {}).get(("SCL", "R20m"))
         if coefficient in FORMULAS:
             formula = FORMULAS[coefficient]
-            return self.get_calculation_coefficient_path(formula, directory_path, coefficient, date)
+            # all bands of a formula come from one folder so that their decimated grids match
+            resolution = self.band_resolution(directory_path, re.findall(r"\b[A-Z]\w*", formula))
+            return self.get_calculation_coefficient_path(formula, directory_path, coefficient, date,
+                                                         resolution=resolution)
+        return None
+
+    def get_scene_cloud_cover(self, directory, *args, **kwargs):
+        if self.cloud_filter == "overview":
+            for resolution in ("R60m", "R20m"):
+                scl_filename = self.bands.get(directory, {}).get(("SCL", resolution))
+                if scl_filename:
+                    return self.estimate_aoi_cloud_cover(scl_filename,
+                                                         lambda data: np.isin(data, SCL_CLOUD_CLASSES),
+                                                         lambda data: data != SCL_NO_DATA)
+            return None
+        metadata_path = join(directory, "MTD_TL.xml")
+        if not is_file(metadata_path):
+            return None
+        with open_file(metadata_path) as metadata_file:
+            for _, element in ElementTree.iterparse(metadata_file):
+                if element.tag.endswith("CLOUDY_PIXEL_PERCENTAGE"):
+                    return float(element.text)
         return None
 
     def _run(self):
-        self.parse_directories()
+        with self.profiler.stage("scan"):
+            self.parse_directories()
         for coefficient in self.coefficients:
             path = os.path.join(self.output_path, coefficient)
             pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-        try:
-            for directory_index, directory in enumerate(self.directories):
-                try:
-                    shutil.rmtree(self.buffer_path, ignore_errors=True)
-                    os.makedirs(self.buffer_path)
-                    date = re.search(r"\d{8}T\d{6}", directory).group()
-                    date = datetime.datetime.strptime(date, "%Y%m%dT%H%M%S")
-                    date = date.strftime("%Y-%m-%d")
-                    for coefficient_index, coefficient in enumerate(self.coefficients):
-                        self.callback(100 * (directory_index * len(self.coefficients) + coefficient_index) // (
-                                    len(self.directories) * len(self.coefficients)), callback_type="percent")
-                        path = self.get_coefficient_path(directory, coefficient, date)
-                        if not path:
-                            continue
-                        reprojected_path = os.path.join(self.buffer_path, coefficient + "_proc.tif")
-                        self.reproject_one(path, reprojected_path)
-                        self.process_file(reprojected_path, coefficient, date)
-                except Exception as e:
-                    logger.exception(f"Sentinel exception in directory {directory}")
-                    self.callback(f"Exception in directory {directory}", callback_type="error")
-                    continue
-        except Exception:
-            logger.exception("SentinelProcessor exception")
-            self.callback("Unexpected exception", callback_type="error")
-        shutil.rmtree(self.buffer_path, ignore_errors=True)
+        scenes = [Scene(directory.name, directory.path, directory.date, (directory.date,),
+                        directory.native_bounds, directory.crs) for directory in self.directories]
+        self.run_scenes(scenes, self.coefficients)
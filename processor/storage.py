@@ -0,0 +1,431 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib.request import pathname2url
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS_DIR = "result_partitions"
+STORE_FILES = {"sqlite": "result.db", "duckdb": "result.duckdb"}
+RESULT_COLUMNS = ("coefficient", "field", "date", "longitude", "latitude", "value")
+PARTITION_INDEXES = {
+    "result_field": ("field",),
+    "result_date_field": ("date", "field"),
+    "result_position": ("longitude", "latitude", "date"),
+}
+
+
+def partition_year(date: Optional[str]) -> str:
+    if date is None:
+        return "null"
+    date = str(date)
+    return date[:4] if re.match(r"\d{4}", date) else "other"
+
+
+def _partition_name(coefficient: str) -> str:
+    safe = re.sub(r'[^A-Za-z0-9_.-]', "_", coefficient) or "_"
+    return f"{safe}_{hashlib.sha1(coefficient.encode()).hexdigest()[:8]}"
+
+
+def _create_result_table(conn: sqlite3.Connection) -> None:
+    cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL").fetchone()
+    cur.execute("CREATE TABLE IF NOT EXISTS result ("
+                "coefficient VARCHAR(64), "
+                "field VARCHAR(64), "
+                "date VARCHAR(16), "
+                "longitude REAL, "
+                "latitude REAL, "
+                "value REAL, "
+                "UNIQUE(coefficient, field, date, longitude, latitude)"
+                ")")
+    conn.commit()
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return conn.execute(query, (name,)).fetchone() is not None
+
+
+def _with_coefficient(coefficient: str, where: str = "", params: Sequence = ()) -> Tuple[str, list]:
+    condition = re.sub(r"^\s*WHERE\s+", "", where, flags=re.IGNORECASE)
+    return " WHERE coefficient = ?" + (f" AND ({condition})" if condition else ""), [coefficient] + list(params)
+
+
+def _pivot_frame(df: pd.DataFrame) -> pd.DataFrame:
+    pivot = df.pivot(index=['longitude', 'latitude'], columns='date', values='value')
+    pivot.reset_index(inplace=True)
+    pivot.rename(columns={'longitude': 'x', 'latitude': 'y'}, inplace=True)
+    date_cols = sorted(c for c in pivot.columns if c not in ('x', 'y'))
+    return pivot[['x', 'y'] + date_cols]
+
+
+class ResultStore:
+    def route(self, rows: Iterable[tuple]) -> Dict[str, List[tuple]]:
+        raise NotImplementedError()
+
+    def open_sink(self, key: str):
+        raise NotImplementedError()
+
+    def coefficients(self) -> List[str]:
+        raise NotImplementedError()
+
+    def fields(self, coefficient: str) -> List[str]:
+        raise NotImplementedError()
+
+    def count(self, coefficient: Optional[str] = None) -> int:
+        raise NotImplementedError()
+
+    def insert_frame(self, df: pd.DataFrame) -> None:
+        raise NotImplementedError()
+
+    def read(self, coefficient: str, columns: Sequence[str] = RESULT_COLUMNS, where: str = "",
+             params: Sequence = (), date_from: Optional[str] = None, date_to: Optional[str] = None,
+             order: str = "") -> pd.DataFrame:
+        raise NotImplementedError()
+
+    def pivot_fields(self, coefficient: str, max_rows: Optional[int] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        raise NotImplementedError()
+
+    def create_indexes(self) -> None:
+        pass
+
+    def set_memory_limit(self, nbytes: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _SQLiteSink:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.cur = self.conn.cursor()
+
+    def insert(self, rows: Sequence[tuple]) -> None:
+        self.cur.executemany("INSERT OR IGNORE INTO result "
+                             "(coefficient, field, date, longitude, latitude, value) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class PartitionedStore(ResultStore):
+    def __init__(self, db_path: str, read_only: bool = False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.root = os.path.join(os.path.dirname(os.path.abspath(db_path)), PARTITIONS_DIR)
+        self._lock = threading.Lock()
+        with self._connect(db_path) as conn:
+            if not read_only:
+                conn.execute("CREATE TABLE IF NOT EXISTS partitions ("
+                             "coefficient VARCHAR(64), "
+                             "year VARCHAR(8), "
+                             "path TEXT, "
+                             "PRIMARY KEY(coefficient, year)"
+                             ")")
+                conn.commit()
+            legacy = _has_table(conn, "result")
+        self._partitions = self._load_partitions()
+        if legacy and read_only:
+            # a read-only open leaves an old database as it is and reads the flat table directly
+            with self._connect(db_path) as conn:
+                self._partitions = {(coefficient, "other"): db_path for coefficient, in
+                                    conn.execute("SELECT DISTINCT coefficient FROM result")}
+        elif legacy:
+            self._migrate_legacy()
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        if self.read_only:
+            return sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+        return sqlite3.connect(path)
+
+    def _load_partitions(self) -> Dict[Tuple[str, str], str]:
+        with self._connect(self.db_path) as conn:
+            if not _has_table(conn, "partitions"):
+                return {}
+            return {(coefficient, year): os.path.join(self.root, path)
+                    for coefficient, year, path in conn.execute("SELECT coefficient, year, path FROM partitions")}
+
+    def _scoped(self, path: str, coefficient: str, where: str = "", params: Sequence = ()) -> Tuple[str, list]:
+        if path != self.db_path:
+            return where, list(params)
+        return _with_coefficient(coefficient, where, params)
+
+    def partition_path(self, coefficient: str, year: str) -> str:
+        with self._lock:
+            if (coefficient, year) not in self._partitions:
+                relative = os.path.join(_partition_name(coefficient), f"{year}.db")
+                path = os.path.join(self.root, relative)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with sqlite3.connect(path) as conn:
+                    _create_result_table(conn)
+                with sqlite3.connect(self.db_path) as conn:
+                    conn.execute("INSERT OR REPLACE INTO partitions (coefficient, year, path) VALUES (?, ?, ?)",
+                                 (coefficient, year, relative))
+                    conn.commit()
+                self._partitions[(coefficient, year)] = path
+            return self._partitions[(coefficient, year)]
+
+    def partitions(self, coefficient: Optional[str] = None, date_from: Optional[str] = None,
+                   date_to: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        with self._lock:
+            items = sorted(self._partitions.items())
+        selected = []
+        for (partition_coefficient, year), path in items:
+            if coefficient is not None and partition_coefficient != coefficient:
+                continue
+            if year != "other" and ((date_from and year < partition_year(date_from))
+                                    or (date_to and year > partition_year(date_to))):
+                continue
+            selected.append((partition_coefficient, year, path))
+        return selected
+
+    def coefficients(self) -> List[str]:
+        return sorted({coefficient for coefficient, _, _ in self.partitions()})
+
+    def fields(self, coefficient: str) -> List[str]:
+        fields = set()
+        for _, _, path in self.partitions(coefficient):
+            where, params = self._scoped(path, coefficient)
+            with self._connect(path) as conn:
+                fields.update(field for field, in conn.execute(f"SELECT DISTINCT field FROM result{where}", params))
+        return sorted(fields)
+
+    def count(self, coefficient: Optional[str] = None) -> int:
+        total = 0
+        for partition_coefficient, _, path in self.partitions(coefficient):
+            where, params = self._scoped(path, partition_coefficient)
+            with self._connect(path) as conn:
+                total += conn.execute(f"SELECT COUNT(*) FROM result{where}", params).fetchone()[0]
+        return total
+
+    def route(self, rows: Iterable[tuple]) -> Dict[str, List[tuple]]:
+        routed = {}
+        for row in rows:
+            routed.setdefault(self.partition_path(row[0], partition_year(row[2])), []).append(row)
+        return routed
+
+    def open_sink(self, key: str) -> _SQLiteSink:
+        return _SQLiteSink(key)
+
+    def insert_frame(self, df: pd.DataFrame) -> None:
+        df = df[list(RESULT_COLUMNS)]
+        for path, rows in self.route(df.itertuples(index=False, name=None)).items():
+            with sqlite3.connect(path) as conn:
+                conn.executemany("INSERT OR IGNORE INTO result "
+                                 "(coefficient, field, date, longitude, latitude, value) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.commit()
+
+    def read(self, coefficient: str, columns: Sequence[str] = RESULT_COLUMNS, where: str = "",
+             params: Sequence = (), date_from: Optional[str] = None, date_to: Optional[str] = None,
+             order: str = "") -> pd.DataFrame:
+        frames = []
+        for _, _, path in self.partitions(coefficient, date_from, date_to):
+            scoped, scoped_params = self._scoped(path, coefficient, where, params)
+            with self._connect(path) as conn:
+                frames.append(pd.read_sql_query(f"SELECT {', '.join(columns)} FROM result{scoped}{order}", conn,
+                                                params=scoped_params))
+        if not frames:
+            return pd.DataFrame(columns=[column.split()[-1] for column in columns])
+        return pd.concat(frames, ignore_index=True)
+
+    def pivot_fields(self, coefficient: str, max_rows: Optional[int] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        columns = ("field", "date", "longitude", "latitude", "value")
+        if max_rows is None or self.count(coefficient) <= max_rows:
+            df = self.read(coefficient, columns)
+            for field, group in df.groupby('field'):
+                yield field, _pivot_frame(group)
+            return
+        logger.info(f"Exporting {coefficient} field by field to stay within memory budget")
+        self.create_indexes()
+        for field in self.fields(coefficient):
+            yield field, _pivot_frame(self.read(coefficient, columns, " WHERE field = ?", (field,)))
+
+    def create_indexes(self) -> None:
+        if self.read_only:
+            return
+        for _, _, path in self.partitions():
+            if path == self.db_path:
+                continue
+            with sqlite3.connect(path) as conn:
+                for name, columns in PARTITION_INDEXES.items():
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON result ({', '.join(columns)})")
+                conn.commit()
+
+    def _migrate_legacy(self) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            keys = conn.execute("SELECT coefficient, substr(date, 1, 4), COUNT(*) FROM result "
+                                "GROUP BY coefficient, substr(date, 1, 4)").fetchall()
+            logger.info(f"Migrating {self.db_path} into {len(keys)} result partitions")
+            missing = 0
+            for coefficient, year, count in keys:
+                path = self.partition_path(coefficient, partition_year(year))
+                conn.execute("ATTACH DATABASE ? AS partition", (path,))
+                # NOT EXISTS instead of OR IGNORE: rows with a NULL date are not caught by the UNIQUE constraint
+                conn.execute("INSERT INTO partition.result "
+                             "(coefficient, field, date, longitude, latitude, value) "
+                             "SELECT coefficient, field, date, longitude, latitude, value FROM main.result AS legacy "
+                             "WHERE coefficient IS ? AND substr(date, 1, 4) IS ? AND NOT EXISTS ("
+                             "SELECT 1 FROM partition.result AS migrated "
+                             "WHERE migrated.coefficient IS legacy.coefficient AND migrated.field IS legacy.field AND migrated.date IS legacy.date "
+                             "AND migrated.longitude IS legacy.longitude AND migrated.latitude IS legacy.latitude)",
+                             (coefficient, year))
+                conn.commit()
+                migrated, = conn.execute("SELECT COUNT(*) FROM partition.result "
+                                         "WHERE coefficient IS ? AND substr(date, 1, 4) IS ?",
+                                         (coefficient, year)).fetchone()
+                missing += max(count - migrated, 0)
+                conn.execute("DETACH DATABASE partition")
+            if missing:
+                logger.warning(f"{missing} rows of {self.db_path} did not reach a partition, "
+                               f"the legacy result table is kept")
+                return
+            conn.execute("DROP TABLE result")
+            conn.commit()
+
+
+class _DuckDBSink:
+    def __init__(self, conn):
+        self.cur = conn.cursor()
+        self.pending: List[tuple] = []
+
+    def insert(self, rows: Sequence[tuple]) -> None:
+        self.pending.extend(rows)
+
+    def commit(self) -> None:
+        if self.pending:
+            _insert_duckdb(self.cur, pd.DataFrame(self.pending, columns=list(RESULT_COLUMNS)))
+            self.pending = []
+
+    def close(self) -> None:
+        self.cur.close()
+
+
+def _insert_duckdb(cur, df: pd.DataFrame) -> None:
+    cur.register("batch", df[list(RESULT_COLUMNS)])
+    try:
+        cur.execute("INSERT OR IGNORE INTO result "
+                    "SELECT DISTINCT ON (coefficient, field, date, longitude, latitude) * FROM batch")
+    finally:
+        cur.unregister("batch")
+
+
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class DuckDBStore(ResultStore):
+    def __init__(self, db_path: str, read_only: bool = False):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise RuntimeError("DuckDB result store requires the duckdb package") from e
+        self.db_path = db_path
+        self.conn = duckdb.connect(db_path, read_only=read_only)
+        if read_only:
+            return
+        self.conn.execute("CREATE TABLE IF NOT EXISTS result ("
+                          "coefficient VARCHAR, "
+                          "field VARCHAR, "
+                          "date VARCHAR, "
+                          "longitude DOUBLE, "
+                          "latitude DOUBLE, "
+                          "value DOUBLE, "
+                          "PRIMARY KEY(coefficient, field, date, longitude, latitude)"
+                          ")")
+
+    def _query(self, sql: str, params: Sequence = ()) -> pd.DataFrame:
+        cur = self.conn.cursor()
+        try:
+            return cur.execute(sql, list(params)).df()
+        finally:
+            cur.close()
+
+    def route(self, rows: Iterable[tuple]) -> Dict[str, List[tuple]]:
+        rows = list(rows)
+        return {self.db_path: rows} if rows else {}
+
+    def open_sink(self, key: str) -> _DuckDBSink:
+        return _DuckDBSink(self.conn)
+
+    def coefficients(self) -> List[str]:
+        return list(self._query("SELECT DISTINCT coefficient FROM result ORDER BY coefficient")["coefficient"])
+
+    def fields(self, coefficient: str) -> List[str]:
+        return list(self._query("SELECT DISTINCT field FROM result WHERE coefficient = ? ORDER BY field",
+                                (coefficient,))["field"])
+
+    def count(self, coefficient: Optional[str] = None) -> int:
+        if coefficient is None:
+            return int(self._query("SELECT COUNT(*) AS count FROM result")["count"][0])
+        return int(self._query("SELECT COUNT(*) AS count FROM result WHERE coefficient = ?",
+                               (coefficient,))["count"][0])
+
+    def insert_frame(self, df: pd.DataFrame) -> None:
+        cur = self.conn.cursor()
+        try:
+            _insert_duckdb(cur, df)
+        finally:
+            cur.close()
+
+    def read(self, coefficient: str, columns: Sequence[str] = RESULT_COLUMNS, where: str = "",
+             params: Sequence = (), date_from: Optional[str] = None, date_to: Optional[str] = None,
+             order: str = "") -> pd.DataFrame:
+        where, params = _with_coefficient(coefficient, where, params)
+        return self._query(f"SELECT {', '.join(columns)} FROM result{where}{order}", params)
+
+    def pivot_fields(self, coefficient: str, max_rows: Optional[int] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        cur = self.conn.cursor()
+        try:
+            if max_rows is None or self.count(coefficient) <= max_rows:
+                cur.execute("CREATE OR REPLACE TEMP TABLE export AS "
+                            "SELECT field, date, longitude, latitude, value FROM result WHERE coefficient = ? "
+                            "ORDER BY field, date", [coefficient])
+                source, scope = "export", []
+                fields = [field for field, in cur.execute("SELECT DISTINCT field FROM export "
+                                                          "ORDER BY field").fetchall()]
+            else:
+                # too large to copy, each field is read from the result table through its primary key
+                logger.info(f"Exporting {coefficient} field by field to stay within memory budget")
+                source, scope = "result", [coefficient]
+                fields = self.fields(coefficient)
+            condition = "coefficient = ? AND field = ?" if scope else "field = ?"
+            for field in fields:
+                dates = [date for date, in cur.execute(f"SELECT DISTINCT date FROM {source} WHERE {condition} "
+                                                       "ORDER BY date", scope + [field]).fetchall()]
+                columns = "".join(f", first(value) FILTER (WHERE date = ?) AS {_quote(date)}" for date in dates)
+                yield field, cur.execute(f"SELECT longitude AS x, latitude AS y{columns} FROM {source} "
+                                         f"WHERE {condition} GROUP BY longitude, latitude ORDER BY x, y",
+                                         dates + scope + [field]).df()
+            cur.execute("DROP TABLE IF EXISTS export")
+        finally:
+            cur.close()
+
+    def set_memory_limit(self, nbytes: int) -> None:
+        self.conn.execute(f"SET memory_limit = '{max(nbytes // (1024 * 1024), 1)}MB'")
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+RESULT_STORES = {"sqlite": PartitionedStore, "duckdb": DuckDBStore}
+
+
+def open_store(db_path: str, backend: Optional[str] = None, read_only: bool = False) -> ResultStore:
+    if backend is None:
+        backend = "duckdb" if db_path.endswith(".duckdb") else "sqlite"
+    if backend not in RESULT_STORES:
+        raise ValueError(f"Unknown result backend: {backend}")
+    return RESULT_STORES[backend](db_path, read_only)
@@ -3,3 +3,4 @@ from .landsat.window import LandsatTab
 from .meteor.window import MeteorTab
 from .drone.window import DroneTab
 from .custom.window import CustomTab
+from .jobs.window import JobsTab
@@ -1,29 +1,50 @@
+import logging
+import threading
 from typing import Type, TypeVar
 
 from PyQt5.QtCore import QObject, pyqtSignal
 
 from processor.communicator import AbstractProcessor
+from processor.process import ProcessCancelled, run_in_process
 
+logger = logging.getLogger(__name__)
 
 T = TypeVar('T', bound=AbstractProcessor)
 class Worker(QObject):
     finished = pyqtSignal()
     progressChanged = pyqtSignal(int)
+    statusChanged = pyqtSignal(object)
     errorRaised = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
     processor_type: Type[T]
 
     def __init__(self, processor_type: Type[T], *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.processor_type = processor_type
+        self.cancel_event = threading.Event()
+
+    def terminate(self):
+        # called from the GUI thread while run() blocks in the worker thread
+        self.cancel_event.set()
 
     def callback_function(self, *args, callback_type):
         if callback_type == "percent":
             self.progressChanged.emit(args[0])
+        if callback_type == "status":
+            self.statusChanged.emit(args[0])
         if callback_type == "error":
             self.errorRaised.emit(args[0])
 
     def run(self, data):
         self.progressChanged.emit(0)
-        proc: T = self.processor_type(**data, callback=self.callback_function)
-        proc.run()
-        self.finished.emit()
+        try:
+            run_in_process(self.processor_type, data, self.callback_function, self.cancel_event)
+        except ProcessCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            logger.error(f"{self.processor_type.__name__} failed: {e}")
+            self.errorRaised.emit(str(e))
+            self.failed.emit(str(e))
+        finally:
+            self.finished.emit()
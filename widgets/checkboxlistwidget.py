@@ -1,77 +1,185 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QListWidget, QListWidgetItem, QPushButton, QLabel
-from PyQt5.QtCore import Qt, QSignalBlocker
-
-
-class CheckboxListWidget(QDialog):
-    def __init__(self, *args, choices=None, display_total=True, **kwargs):
-        super(CheckboxListWidget, self).__init__(*args, **kwargs)
-        self.resize(600, 800)
-
-        self.layout = QVBoxLayout(self)
-
-        self.display_total = display_total
-        self.total = 0
-        self.total_label = QLabel(self)
-
-        self.list_widget = QListWidget(self)
-        self.layout.addWidget(self.list_widget)
-        self.list_widget.itemChanged.connect(self.list_widget_changed)
-        self.all_items_list_widget = None
-        self.set_choices(choices)
-
-        self.confirm_button = QPushButton("Сохранить", self)
-        self.confirm_button.clicked.connect(self.confirm_button_clicked)
-        self.layout.addWidget(self.confirm_button)
-
-        if self.display_total:
-            self.total_label.setText(f"{self.total}/{self.total}")
-            self.layout.addWidget(self.total_label)
-
-    def set_choices(self, choices):
-        self.list_widget.clear()
-        self.all_items_list_widget = QListWidgetItem()
-        self.all_items_list_widget.setText("Выбрать все")
-        self.list_widget.addItem(self.all_items_list_widget)
-        if choices:
-            self.total = len(choices)
-            for choice in choices:
-                item = QListWidgetItem()
-                item.setCheckState(Qt.Unchecked)
-                item.setText(choice)
-                self.list_widget.addItem(item)
-        self.all_items_list_widget.setCheckState(Qt.Checked)
-
-    def list_widget_changed(self, item: QListWidgetItem):
-        if item is self.all_items_list_widget:
-            state = self.all_items_list_widget.checkState()
-            with QSignalBlocker(self.list_widget):
-                for i in range(self.list_widget.count()):
-                    self.list_widget.item(i).setCheckState(state)
-        else:
-            if item.checkState() == Qt.Checked:
-                if all((self.list_widget.item(i).checkState() == Qt.Checked or
-                        self.list_widget.item(i) is self.all_items_list_widget for i in range(self.list_widget.count()))):
-                    with QSignalBlocker(self.list_widget):
-                        self.all_items_list_widget.setCheckState(Qt.Checked)
-            elif item.checkState() == Qt.Unchecked:
-                with QSignalBlocker(self.list_widget):
-                    self.all_items_list_widget.setCheckState(Qt.Unchecked)
-        if self.display_total:
-            self.total_label.setText(f"{len(self.selected_item_texts())}/{self.total}")
-
-    def selected_item_texts(self):
-        ret = []
-        for i in range(self.list_widget.count()):
-            item = self.list_widget.item(i)
-            if item is self.all_items_list_widget:
-                continue
-            if item.checkState() == Qt.Checked:
-                ret.append(item.text())
-        return ret
-
-    def confirm_button_clicked(self):
-        self.close()
-
-
-
-
+import fnmatch
+import re
+from typing import List, Optional, Sequence
+
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QListView, QPushButton, QLabel, QLineEdit,
+                             QCheckBox)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSignalBlocker, pyqtSignal
+
+
+class CheckboxListModel(QAbstractListModel):
+    selectionChanged = pyqtSignal(int)
+
+    def __init__(self, *args, **kwargs):
+        super(CheckboxListModel, self).__init__(*args, **kwargs)
+        self.choices: List[str] = []
+        self.folded: List[str] = []
+        self.bits = bytearray()
+        self.selected = 0
+        self.visible: Sequence[int] = []
+        self.pattern = ""
+
+    def set_choices(self, choices: Sequence[str], checked: bool = True):
+        self.beginResetModel()
+        self.choices = [str(choice) for choice in choices]
+        self.folded = [choice.casefold() for choice in self.choices]
+        self.bits = bytearray((len(self.choices) + 7) // 8)
+        self.selected = 0
+        self.pattern = ""
+        self.visible = range(len(self.choices))
+        self.endResetModel()
+        self.set_all(checked)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.visible)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        choice = self.visible[index.row()]
+        if role == Qt.DisplayRole:
+            return self.choices[choice]
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.is_checked(choice) else Qt.Unchecked
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if role != Qt.CheckStateRole or not index.isValid():
+            return False
+        if self._set(self.visible[index.row()], value == Qt.Checked):
+            self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+            self.selectionChanged.emit(self.selected)
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsUserCheckable
+
+    def is_checked(self, choice: int) -> bool:
+        return bool(self.bits[choice >> 3] & (1 << (choice & 7)))
+
+    def _set(self, choice: int, checked: bool) -> bool:
+        if self.is_checked(choice) == checked:
+            return False
+        self.bits[choice >> 3] ^= 1 << (choice & 7)
+        self.selected += 1 if checked else -1
+        return True
+
+    def set_all(self, checked: bool):
+        self.bits = bytearray(b"\xff" if checked else b"\x00") * len(self.bits)
+        if checked and len(self.choices) % 8:
+            self.bits[-1] = (1 << (len(self.choices) % 8)) - 1
+        self.selected = len(self.choices) if checked else 0
+        self._visible_changed()
+
+    def set_visible(self, checked: bool):
+        for choice in self.visible:
+            self._set(choice, checked)
+        self._visible_changed()
+
+    def _visible_changed(self):
+        if self.visible:
+            self.dataChanged.emit(self.index(0), self.index(len(self.visible) - 1), [Qt.CheckStateRole])
+        self.selectionChanged.emit(self.selected)
+
+    def set_filter(self, pattern: str):
+        pattern = pattern.strip().casefold()
+        if pattern == self.pattern:
+            return
+        wildcard = any(char in pattern for char in "*?[")
+        if not pattern:
+            visible = range(len(self.choices))
+        elif wildcard:
+            match = re.compile(fnmatch.translate(pattern)).match
+            visible = [choice for choice, text in enumerate(self.folded) if match(text)]
+        else:
+            incremental = self.pattern and pattern.startswith(self.pattern) and not any(
+                char in self.pattern for char in "*?[")
+            source = self.visible if incremental else range(len(self.choices))
+            visible = [choice for choice in source if pattern in self.folded[choice]]
+        self.beginResetModel()
+        self.pattern = pattern
+        self.visible = visible
+        self.endResetModel()
+
+    def selected_texts(self) -> List[str]:
+        if self.selected == len(self.choices):
+            return list(self.choices)
+        return [choice for index, choice in enumerate(self.choices) if self.is_checked(index)]
+
+
+class CheckboxListWidget(QDialog):
+    def __init__(self, *args, choices=None, display_total=True, **kwargs):
+        super(CheckboxListWidget, self).__init__(*args, **kwargs)
+        self.resize(600, 800)
+
+        self.layout = QVBoxLayout(self)
+
+        self.display_total = display_total
+        self.total = 0
+        self.total_label = QLabel(self)
+
+        self.filter_line = QLineEdit(self)
+        self.filter_line.setPlaceholderText("Поиск (можно использовать * и ?)")
+        self.filter_line.setClearButtonEnabled(True)
+        self.filter_line.textChanged.connect(self.filter_changed)
+        self.layout.addWidget(self.filter_line)
+
+        self.button_layout = QHBoxLayout()
+        self.layout.addLayout(self.button_layout)
+        self.all_items_checkbox = QCheckBox("Выбрать все", self)
+        self.all_items_checkbox.clicked.connect(self.all_items_clicked)
+        self.button_layout.addWidget(self.all_items_checkbox)
+        self.button_layout.addStretch()
+        self.select_visible_button = QPushButton("Отметить найденные", self)
+        self.select_visible_button.clicked.connect(lambda: self.model.set_visible(True))
+        self.button_layout.addWidget(self.select_visible_button)
+        self.deselect_visible_button = QPushButton("Снять найденные", self)
+        self.deselect_visible_button.clicked.connect(lambda: self.model.set_visible(False))
+        self.button_layout.addWidget(self.deselect_visible_button)
+
+        self.model = CheckboxListModel(self)
+        self.model.selectionChanged.connect(self.selection_changed)
+        self.list_view = QListView(self)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setModel(self.model)
+        self.layout.addWidget(self.list_view)
+        self.set_choices(choices)
+
+        self.confirm_button = QPushButton("Сохранить", self)
+        self.confirm_button.clicked.connect(self.confirm_button_clicked)
+        self.layout.addWidget(self.confirm_button)
+
+        if self.display_total:
+            self.layout.addWidget(self.total_label)
+
+    def set_choices(self, choices: Optional[Sequence[str]]):
+        with QSignalBlocker(self.filter_line):
+            self.filter_line.clear()
+        self.total = len(choices) if choices else 0
+        self.model.set_choices(choices or [])
+
+    def filter_changed(self, text: str):
+        self.model.set_filter(text)
+
+    def all_items_clicked(self):
+        self.model.set_all(self.model.selected < self.total)
+
+    def selection_changed(self, selected: int):
+        if selected == self.total:
+            state = Qt.Checked
+        elif selected == 0:
+            state = Qt.Unchecked
+        else:
+            state = Qt.PartiallyChecked
+        with QSignalBlocker(self.all_items_checkbox):
+            self.all_items_checkbox.setCheckState(state)
+        if self.display_total:
+            self.total_label.setText(f"{selected}/{self.total}")
+
+    def selected_item_texts(self):
+        return self.model.selected_texts()
+
+    def confirm_button_clicked(self):
+        self.close()